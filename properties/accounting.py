@@ -0,0 +1,84 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.utils import timezone
+from properties.models import PipelineRun, StageUsage
+
+
+class RunAccounting:
+    """Per-hotel, per-stage Ollama usage of one run, and the run's budgets.
+
+    The pipeline names the hotels and stage a worker thread is generating for;
+    the client listener charges Ollama's reported metrics to them. A coalesced
+    duplicate prompt is charged once, to the call that actually reached Ollama.
+    """
+
+    def __init__(self, run, max_tokens=None, max_duration=None):
+        self.run = run
+        self.max_tokens = max_tokens
+        self.max_duration = max_duration
+        self.started = time.monotonic()
+        self.tokens = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.pending = []  # StageUsage rows waiting for flush()
+
+    @contextmanager
+    def charge_to(self, hotels, stage, model):
+        self._local.target = ([hotel.hotel_id for hotel in hotels], stage.name, model)
+        try:
+            yield
+        finally:
+            self._local.target = None
+
+    def observe_response(self, payload, data, wall_seconds):
+        target = getattr(self._local, 'target', None)
+        if target is None:
+            return
+        hotel_ids, stage, model = target
+        prompt_tokens = data.get('prompt_eval_count') or 0
+        eval_tokens = data.get('eval_count') or 0
+        gpu_seconds = (data.get('total_duration') or 0) / 1e9
+        eval_seconds = (data.get('eval_duration') or 0) / 1e9
+        # A packed prompt's usage is split evenly between its hotels
+        share = len(hotel_ids)
+        rows = [
+            StageUsage(
+                run_id=self.run.pk, hotel_id=hotel_id, stage=stage, model=data.get('model') or model,
+                hotels_in_prompt=share,
+                prompt_tokens=round(prompt_tokens / share), eval_tokens=round(eval_tokens / share),
+                gpu_seconds=gpu_seconds / share, eval_seconds=eval_seconds / share,
+            )
+            for hotel_id in hotel_ids
+        ]
+        with self._lock:
+            self.tokens += prompt_tokens + eval_tokens
+            self.pending.extend(rows)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def exhausted(self):
+        """Return why the run should stop, or None while it is within its budgets."""
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return f"token budget reached ({self.tokens} of {self.max_tokens} tokens)"
+        if self.max_duration is not None and self.elapsed() >= self.max_duration:
+            return f"time budget reached ({self.elapsed():.0f}s of {self.max_duration:g}s)"
+        return None
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, []
+        if pending:
+            StageUsage.objects.bulk_create(pending)
+
+    def finish(self, usage, hotels, status, stop_reason='', unfinished=()):
+        """Flush the remaining rows and store the run's totals from the client's Usage."""
+        self.flush()
+        PipelineRun.objects.filter(pk=self.run.pk).update(
+            status=status, stop_reason=stop_reason, finished_at=timezone.now(), unfinished=list(unfinished),
+            hotels=hotels, requests=usage.requests,
+            prompt_tokens=usage.prompt_tokens, eval_tokens=usage.eval_tokens,
+            gpu_seconds=usage.gpu_seconds, wall_seconds=self.elapsed(),
+        )
@@ -1,12 +1,53 @@
-from django.contrib import admin
-from .models import Property, PropertySummary, PropertyRatingReview, Hotel
+from django.contrib import admin, messages
+from django.urls import reverse
+from django.utils.html import format_html
+from .jobs import enqueue, progress, throughput
+from .models import Property, PropertySummary, PropertyRatingReview, Hotel, HotelCard, RewriteJob
+from .search import refresh_search_vectors, search_query
+
+
+def regenerate_action(stages, description, id_field):
+    """An admin action that queues a RewriteJob for the selected hotels and returns at once."""
+    def action(modeladmin, request, queryset):
+        hotel_ids = list(queryset.values_list(id_field, flat=True).distinct())
+        job = enqueue(stages, hotel_ids, requested_by=request.user.get_username())
+        modeladmin.message_user(request, format_html(
+            'Queued <a href="{}">rewrite job {}</a> for {} hotels; run_jobs processes it in the background.',
+            reverse('admin:properties_rewritejob_change', args=[job.pk]), job.pk, len(job.hotel_ids),
+        ), messages.SUCCESS)
+    action.__name__ = 'regenerate_' + '_'.join(stages)
+    return admin.action(description=description)(action)
+
+
+def regenerate_actions(id_field):
+    return [
+        regenerate_action(('title', 'description'), 'Regenerate title and description for selected', id_field),
+        regenerate_action(('summary',), 'Regenerate summary for selected', id_field),
+        regenerate_action(('rating_review',), 'Regenerate rating and review for selected', id_field),
+        regenerate_action(('title', 'description', 'summary', 'rating_review'),
+                          'Regenerate everything for selected', id_field),
+    ]
 
 # Register Property model
 @admin.register(Property)
 class PropertyAdmin(admin.ModelAdmin):
-    list_display = ('original_id', 'original_title', 'rewritten_title', 'description')  # Fields to display
+    list_display = ('original_id', 'original_title', 'rewritten_title', 'description', 'provisional')  # Fields to display
     search_fields = ('original_id', 'original_title', 'rewritten_title')  # Searchable fields
-    list_filter = ('rewritten_title',)  # Filter by rewritten title
+    list_filter = ('provisional', 'rewritten_title')  # Template text awaiting regeneration, rewritten title
+    actions = regenerate_actions('original_id')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Words go through the full-text index; numeric searches still match original_id
+        if search_term.strip() and not search_term.strip().isdigit():
+            # Rows not indexed yet (new or renamed, until the next refresh) use the plain lookups
+            stale, may_have_duplicates = super().get_search_results(
+                request, queryset.filter(search_vector__isnull=True), search_term)
+            return queryset.filter(search_vector=search_query(search_term)) | stale, may_have_duplicates
+        return super().get_search_results(request, queryset, search_term)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        refresh_search_vectors([obj.original_id])  # Edited titles and descriptions are searchable at once
 
 # Register PropertySummary model
 @admin.register(PropertySummary)
@@ -20,14 +61,53 @@ class PropertyRatingReviewAdmin(admin.ModelAdmin):
     list_display = ('property_id', 'rating', 'review')  # Fields to display
     search_fields = ('property_id', 'rating')  # Searchable fields
 
+# Register HotelCard model; rows are derived, so edit the source tables instead
+@admin.register(HotelCard)
+class HotelCardAdmin(admin.ModelAdmin):
+    list_display = ('hotel_id', 'title', 'rating', 'provisional', 'updated_at')  # Fields to display
+    search_fields = ('hotel_id',)  # Searchable fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Hotel)
 class HotelAdmin(admin.ModelAdmin):
     list_display = ('hotel_id', 'hotelName', 'city_name', 'positionName', 'price', 'description')
     search_fields = ('hotelName', 'city_name', 'positionName')
-    list_filter = ('city_name',)
+    list_filter = ('city_name',)  # Reads go to the 'trip' database through TripRouter
+    actions = regenerate_actions('hotel_id')
+
+
+# Progress of the jobs queued by the regenerate actions
+@admin.register(RewriteJob)
+class RewriteJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'stages', 'status', 'progress', 'throughput', 'failed_stages', 'requested_by', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('stages', 'status', 'progress', 'throughput', 'failed_stages', 'error', 'requested_by',
+                       'runs', 'created_at', 'started_at', 'finished_at', 'updated_at')
+    exclude = ('hotel_ids', 'position')
+    actions = ['cancel']
+
+    @admin.display(description='Progress')
+    def progress(self, obj):
+        done, total, percent = progress(obj)
+        return f"{done}/{total} ({percent:.0f}%)"
+
+    @admin.display(description='Hotels/min')
+    def throughput(self, obj):
+        rate = throughput(obj)
+        return '-' if rate is None else f"{rate:.1f}"
+
+    @admin.action(description='Cancel selected jobs')
+    def cancel(self, request, queryset):
+        # A running job stops before its next batch
+        cancelled = queryset.filter(status__in=[RewriteJob.QUEUED, RewriteJob.RUNNING]).update(
+            status=RewriteJob.CANCELLED)
+        self.message_user(request, f"Cancelled {cancelled} jobs.")
 
-    def get_queryset(self, request):
-        # Use the 'trip' database when querying for hotels
-        return Hotel.using_trip_db().all()
\ No newline at end of file
+    def has_add_permission(self, request):
+        return False
\ No newline at end of file
@@ -0,0 +1,46 @@
+def copy_value(value):
+    """Render one value in PostgreSQL COPY text format."""
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def copy_line(values):
+    return '\t'.join(copy_value(value) for value in values) + '\n'
+
+
+class CopyStream:
+    """File-like object that feeds `COPY ... FROM STDIN` from an iterator of rows.
+
+    Rows are rendered lazily as psycopg2 asks for data, so a sync never holds
+    the whole table in memory.
+    """
+
+    def __init__(self, rows):
+        self._lines = map(copy_line, rows)
+        self._buffer = []
+        self._buffered = 0
+        self.rows = 0
+
+    def read(self, size=-1):
+        while size < 0 or self._buffered < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer.append(line)
+            self._buffered += len(line)
+            self.rows += 1
+
+        data = ''.join(self._buffer)
+        if 0 <= size < len(data):
+            data, rest = data[:size], data[size:]
+            self._buffer, self._buffered = [rest], len(rest)
+        else:
+            self._buffer, self._buffered = [], 0
+        return data
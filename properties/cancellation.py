@@ -0,0 +1,90 @@
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+
+class RunCancelled(Exception):
+    """An Ollama call was not sent, or was cut off, because the run was cancelled or hit its deadline."""
+
+
+class RunControl:
+    """Deadline and cancellation shared by a run's main thread and its Ollama calls.
+
+    Every request is sent with the time left before the deadline as its timeout.
+    Non-streamed generations send nothing until they are done, so the timeout
+    bounds the whole call, and Ollama stops generating once the client hangs up.
+    """
+
+    def __init__(self, deadline=None, grace=30.0):
+        self.deadline = time.monotonic() + deadline if deadline is not None else None
+        self.grace = grace  # Seconds to wait for calls already sent once the run is cancelled
+        self.reason = None
+        self.cancelled_at = None
+        self.signalled = False
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self, reason):
+        with self._lock:
+            if not self._event.is_set():
+                self.reason = reason
+                self.cancelled_at = time.monotonic()
+                self._event.set()
+
+    @property
+    def cancelled(self):
+        """Why the run should stop, or None."""
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline reached")
+        return self.reason if self._event.is_set() else None
+
+    def timeout(self):
+        """Timeout for the next request: the time left, or None without a deadline."""
+        reason = self.cancelled
+        if reason:
+            raise RunCancelled(reason)
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def abandon(self):
+        """Whether to stop waiting for the calls still running."""
+        return self.cancelled is not None and time.monotonic() - self.cancelled_at >= self.grace
+
+    def wait(self, timeout):
+        """Sleep for up to `timeout` seconds; returns early, and True, once cancelled."""
+        self._event.wait(timeout)
+        return self.cancelled is not None
+
+
+@contextmanager
+def cancel_on_signals(control, signals=(signal.SIGTERM, signal.SIGINT)):
+    """Turn SIGTERM/SIGINT into a cancellation of `control` while the block runs.
+
+    A second signal raises KeyboardInterrupt as usual. When nested (a worker
+    running a pipeline command), the signal also cancels the enclosing control,
+    so the worker stops after the command has drained its results.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        # Handlers can only be installed from the main thread (e.g. not under runserver's workers)
+        yield control
+        return
+
+    previous = {signum: signal.getsignal(signum) for signum in signals}
+
+    def handler(signum, frame):
+        if control.signalled:
+            raise KeyboardInterrupt
+        control.signalled = True
+        control.cancel(f"{signal.Signals(signum).name} received")
+        outer = previous.get(signum)
+        if getattr(outer, 'cancels_run', False):
+            outer(signum, frame)
+
+    handler.cancels_run = True
+    for signum in signals:
+        signal.signal(signum, handler)
+    try:
+        yield control
+    finally:
+        for signum, outer in previous.items():
+            signal.signal(signum, outer)
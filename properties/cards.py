@@ -0,0 +1,66 @@
+from django.db import connections
+from properties.models import HotelCard, Property, PropertyRatingReview, PropertySummary
+
+# The source tables share no relation, only the hotel id: Property.original_id and
+# property_id on the other two. A hotel's newest Property row wins over older duplicates.
+REFRESH_SQL = """
+    WITH ids AS ({ids}),
+    cards AS (
+        SELECT ids.hotel_id, p.original_title, p.rewritten_title, p.description,
+               s.summary, r.rating, r.review, coalesce(p.provisional, false) AS provisional
+        FROM ids
+        LEFT JOIN LATERAL (
+            SELECT * FROM {property} WHERE original_id = ids.hotel_id ORDER BY id DESC LIMIT 1
+        ) AS p ON true
+        LEFT JOIN {summary} AS s ON s.property_id = ids.hotel_id
+        LEFT JOIN {rating} AS r ON r.property_id = ids.hotel_id
+        WHERE p.id IS NOT NULL OR s.id IS NOT NULL OR r.id IS NOT NULL
+    ),
+    removed AS (
+        DELETE FROM {card} AS c
+        WHERE c.hotel_id IN (SELECT hotel_id FROM ids) AND c.hotel_id NOT IN (SELECT hotel_id FROM cards)
+    )
+    INSERT INTO {card} (hotel_id, original_title, title, description, summary, rating, review, provisional, updated_at)
+    SELECT hotel_id, original_title, rewritten_title, description, summary, rating, review, provisional, now()
+    FROM cards
+    ON CONFLICT (hotel_id) DO UPDATE SET
+        original_title = EXCLUDED.original_title, title = EXCLUDED.title, description = EXCLUDED.description,
+        summary = EXCLUDED.summary, rating = EXCLUDED.rating, review = EXCLUDED.review,
+        provisional = EXCLUDED.provisional, updated_at = EXCLUDED.updated_at
+    WHERE ({card}.original_title, {card}.title, {card}.description, {card}.summary, {card}.rating,
+           {card}.review, {card}.provisional)
+          IS DISTINCT FROM
+          (EXCLUDED.original_title, EXCLUDED.title, EXCLUDED.description, EXCLUDED.summary, EXCLUDED.rating,
+           EXCLUDED.review, EXCLUDED.provisional)
+"""
+
+SOME_IDS = 'SELECT DISTINCT unnest(%(ids)s::bigint[]) AS hotel_id'
+ALL_IDS = """
+    SELECT original_id AS hotel_id FROM {property}
+    UNION SELECT property_id FROM {summary}
+    UNION SELECT property_id FROM {rating}
+    UNION SELECT hotel_id FROM {card}
+"""
+
+
+def refresh_hotel_cards(original_ids=None):
+    """Rebuild the HotelCard rows of the given hotels, or of every hotel.
+
+    The sinks call this for the hotels they just wrote, so a card follows each
+    stage as it completes. Unchanged cards are not rewritten. Returns the number
+    of cards inserted or updated.
+    """
+    if original_ids is not None:
+        original_ids = list(original_ids)
+        if not original_ids:
+            return 0
+    tables = {
+        'property': Property._meta.db_table,
+        'summary': PropertySummary._meta.db_table,
+        'rating': PropertyRatingReview._meta.db_table,
+        'card': HotelCard._meta.db_table,
+    }
+    ids = SOME_IDS if original_ids is not None else ALL_IDS.format(**tables)
+    with connections['default'].cursor() as cursor:
+        cursor.execute(REFRESH_SQL.format(ids=ids, **tables), {'ids': original_ids})
+        return cursor.rowcount
@@ -0,0 +1,86 @@
+import select
+
+CHANNEL = 'hotels_changed'
+
+# Writers that must not re-enqueue their own updates (rewrite_hotels) set this
+# transaction-local flag before touching the hotels table.
+SKIP_SETTING = 'property_rewrite.skip_changefeed'
+SKIP_CHANGEFEED_SQL = f"SELECT set_config('{SKIP_SETTING}', 'on', true)"
+
+# Trigger-populated changelog on the trip database. The NOTIFY carries no payload,
+# so Postgres folds all notifications of one scraper transaction into one wake-up;
+# the changelog table is the durable source of hotel ids.
+INSTALL_SQL = f"""
+CREATE TABLE IF NOT EXISTS hotels_changelog (
+    id BIGSERIAL PRIMARY KEY,
+    hotel_id BIGINT NOT NULL,
+    op CHAR(1) NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION hotels_changelog_capture() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('{SKIP_SETTING}', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO hotels_changelog (hotel_id, op) VALUES (NEW.hotel_id, left(TG_OP, 1));
+    PERFORM pg_notify('{CHANNEL}', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS hotels_changelog_insert ON hotels;
+CREATE TRIGGER hotels_changelog_insert
+    AFTER INSERT ON hotels
+    FOR EACH ROW EXECUTE FUNCTION hotels_changelog_capture();
+
+DROP TRIGGER IF EXISTS hotels_changelog_update ON hotels;
+CREATE TRIGGER hotels_changelog_update
+    AFTER UPDATE OF "hotelName", city_id, city_name, "positionName", price, "roomType", latitude, longitude
+    ON hotels
+    FOR EACH ROW
+    WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE FUNCTION hotels_changelog_capture();
+"""
+
+
+class ChangeFeed:
+    """Consumer side of the hotels changelog on the `trip` connection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(INSTALL_SQL)
+
+    def listen(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+
+    def read(self, after_id, limit):
+        """Return (last changelog id, distinct hotel ids) for the next batch of changes."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id, hotel_id FROM hotels_changelog WHERE id > %s ORDER BY id LIMIT %s',
+                [after_id, limit],
+            )
+            rows = cursor.fetchall()
+        if not rows:
+            return after_id, []
+        return rows[-1][0], sorted({hotel_id for _, hotel_id in rows})
+
+    def prune(self, up_to_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DELETE FROM hotels_changelog WHERE id <= %s', [up_to_id])
+
+    def wait(self, timeout):
+        """Block until a notification arrives or `timeout` seconds pass."""
+        self.connection.ensure_connection()
+        raw = self.connection.connection
+        if not raw.notifies:
+            select.select([raw], [], [], timeout)
+            raw.poll()
+        woke = bool(raw.notifies)
+        raw.notifies.clear()
+        return woke
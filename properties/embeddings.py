@@ -0,0 +1,157 @@
+import hashlib
+import math
+import random
+from array import array
+from collections import defaultdict
+
+
+def listing_text(hotel):
+    return ' | '.join(part for part in (hotel.hotelName, hotel.city_name, hotel.positionName) if part)
+
+
+def dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def normalize(vector):
+    values = array('f', vector)
+    norm = math.sqrt(dot(values, values))
+    if norm:
+        for i in range(len(values)):
+            values[i] /= norm
+    return values
+
+
+class OllamaEmbedder:
+    def __init__(self, client, model):
+        self.client = client
+        self.model = model
+
+    def embed(self, text):
+        return self.client.embed(text, self.model)
+
+
+class LocalEmbedder:
+    """Hashed character-trigram counts; needs no model.
+
+    Used when OLLAMA_EMBEDDING_MODEL is empty and in tests. It catches listings that
+    differ in spelling, punctuation or word order, not paraphrases.
+    """
+
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    def embed(self, text):
+        vector = [0.0] * self.dimensions
+        text = f"  {text.lower()} "
+        for i in range(len(text) - 2):
+            digest = hashlib.md5(text[i:i + 3].encode()).digest()
+            vector[int.from_bytes(digest[:4], 'little') % self.dimensions] += 1.0
+        return vector
+
+
+class VectorIndex:
+    """Unit vectors packed into one float32 array, bucketed by random-hyperplane LSH.
+
+    Each of `tables` hash tables signs the vector against `planes` random
+    hyperplanes. A lookup compares exactly against the vectors sharing a bucket, or
+    a bucket one hyperplane away, in any table, so its cost follows the bucket sizes
+    rather than the index size. The dimension is fixed by the first vector added.
+    """
+
+    def __init__(self, tables=8, planes=8, seed=0):
+        self.table_count = tables
+        self.plane_count = planes
+        self.seed = seed
+        self.dimensions = None
+        self.planes = []  # One list of hyperplanes per table
+        self.vectors = array('f')
+        self.keys = []
+        self.buckets = [defaultdict(list) for _ in range(tables)]  # signature -> row numbers
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _prepare(self, vector):
+        vector = normalize(vector)
+        if self.dimensions is None:
+            rng = random.Random(self.seed)
+            self.dimensions = len(vector)
+            self.planes = [
+                [array('f', (rng.gauss(0, 1) for _ in range(self.dimensions))) for _ in range(self.plane_count)]
+                for _ in range(self.table_count)
+            ]
+        elif len(vector) != self.dimensions:
+            raise ValueError(f"Expected a {self.dimensions}-dimensional vector, got {len(vector)}.")
+        return vector
+
+    def signatures(self, vector):
+        result = []
+        for planes in self.planes:
+            bits = 0
+            for i, plane in enumerate(planes):
+                if dot(plane, vector) >= 0:
+                    bits |= 1 << i
+            result.append(bits)
+        return result
+
+    def add(self, key, vector):
+        vector = self._prepare(vector)
+        row = len(self.keys)
+        for buckets, signature in zip(self.buckets, self.signatures(vector)):
+            buckets[signature].append(row)
+        self.keys.append(key)
+        self.vectors.extend(vector)
+
+    def nearest(self, vector):
+        """Return (key, cosine similarity) of the closest indexed vector, or None."""
+        if not self.keys:
+            return None
+        vector = self._prepare(vector)
+        rows = set()
+        for buckets, signature in zip(self.buckets, self.signatures(vector)):
+            for probe in [signature] + [signature ^ (1 << i) for i in range(self.plane_count)]:
+                rows.update(buckets.get(probe, ()))
+
+        best = None
+        for row in rows:
+            start = row * self.dimensions
+            similarity = dot(vector, self.vectors[start:start + self.dimensions])
+            if best is None or similarity > best[1]:
+                best = (self.keys[row], similarity)
+        return best
+
+
+class DuplicateDetector:
+    """Matches each hotel against the earlier hotels of a run by listing similarity.
+
+    Only hotels that are not duplicates are indexed, so every duplicate points at
+    the first hotel of its group. With reuse, duplicates take that hotel's results
+    instead of being generated; otherwise they are only reported.
+    """
+
+    def __init__(self, embedder, threshold, reuse=True):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.reuse = reuse
+        self.index = VectorIndex()
+
+    def embed(self, hotel):
+        return self.embedder.embed(listing_text(hotel))
+
+    def assign(self, hotels, vectors):
+        """Return {hotel_id: (original hotel_id, similarity)} for the duplicates among `hotels`.
+
+        Hotels without a vector (the embedding failed) are neither matched nor indexed.
+        """
+        duplicates = {}
+        for hotel in hotels:
+            vector = vectors.get(hotel.hotel_id)
+            if vector is None:
+                continue
+            match = self.index.nearest(vector)
+            if match and match[1] >= self.threshold:
+                duplicates[hotel.hotel_id] = match
+            else:
+                self.index.add(hotel.hotel_id, vector)
+        return duplicates
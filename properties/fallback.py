@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+# Model recorded in the rewrite history for template output
+TEMPLATE_MODEL = 'template'
+
+
+def template_title(hotel):
+    """A plain title from the listing itself, used while Ollama cannot produce one."""
+    name = (hotel.hotelName or '').strip() or 'Hotel'
+    if hotel.positionName:
+        return f"{name} near {hotel.positionName}"
+    if hotel.city_name:
+        return f"{name}, {hotel.city_name}"
+    return name
+
+
+def template_description(hotel):
+    """One factual sentence from the listing's columns; never invents amenities."""
+    name = (hotel.hotelName or '').strip() or 'This hotel'
+    text = name
+    if hotel.city_name:
+        text += f" is in {hotel.city_name}"
+        if hotel.positionName:
+            text += f", near {hotel.positionName}"
+    elif hotel.positionName:
+        text += f" is near {hotel.positionName}"
+    else:
+        text += " is available to book"
+
+    offers = []
+    if hotel.roomType:
+        offers.append(f"{hotel.roomType} rooms")
+    if hotel.price:
+        price = Decimal(hotel.price).quantize(Decimal(1))
+        offers.append(f"from {price} per night")
+    if offers:
+        text += ", offering " + " ".join(offers)
+    return text + "."
@@ -0,0 +1,146 @@
+import math
+import threading
+import time
+from array import array
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+from properties.rows import fetch_hotels, project
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32  # Along a meridian
+
+# Columns the neighbourhood index reads from the hotels table
+GEO_COLUMNS = ('hotelName', 'city_name', 'positionName', 'latitude', 'longitude')
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GeoIndex:
+    """Named points in flat float arrays, bucketed on a fixed lat/lon grid.
+
+    A radius query visits only the grid cells overlapping the circle's bounding
+    box and checks the exact haversine distance of the points in them, so it needs
+    neither PostGIS nor a scan of every point.
+    """
+
+    def __init__(self, cell_degrees=0.05):
+        self.cell = cell_degrees  # ~5.5 km along a meridian
+        self.keys = []
+        self.names = []
+        self.lats = array('d')
+        self.lons = array('d')
+        self.rows = {}  # key -> row number
+        self.cells = defaultdict(list)  # (lat cell, lon cell) -> row numbers
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def add(self, key, name, lat, lon):
+        lat, lon = float(lat), float(lon)  # The scraper stores coordinates as DECIMAL
+        row = len(self.keys)
+        self.keys.append(key)
+        self.names.append(name)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.rows[key] = row
+        self.cells[self._cell(lat, lon)].append(row)
+
+    def location(self, key):
+        row = self.rows.get(key)
+        return None if row is None else (self.lats[row], self.lons[row])
+
+    def near(self, lat, lon, radius_km, limit=10, exclude=None):
+        """Points within radius_km of (lat, lon), nearest first, as (key, name, distance_km)."""
+        lat_span = radius_km / KM_PER_DEGREE
+        lon_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        low_lat, low_lon = self._cell(lat - lat_span, lon - lon_span)
+        high_lat, high_lon = self._cell(lat + lat_span, lon + lon_span)
+
+        found = []
+        for i in range(low_lat, high_lat + 1):
+            for j in range(low_lon, high_lon + 1):
+                for row in self.cells.get((i, j), ()):
+                    if self.keys[row] == exclude:
+                        continue
+                    distance = haversine_km(lat, lon, self.lats[row], self.lons[row])
+                    if distance <= radius_km:
+                        found.append((distance, row))
+        found.sort()
+        return [(self.keys[row], self.names[row], distance) for distance, row in found[:limit]]
+
+
+class Neighbourhoods:
+    """Nearby hotels and landmarks, built from one pass over the hotels table.
+
+    The scraper's positionName is the landmark or area a hotel is listed near; a
+    landmark is placed at the centroid of the hotels of its city listed near it.
+    """
+
+    def __init__(self, hotels):
+        self.hotels = GeoIndex()
+        self.landmarks = GeoIndex()
+        sums = defaultdict(lambda: [0.0, 0.0, 0])
+        for hotel in hotels:
+            if hotel.latitude is None or hotel.longitude is None:
+                continue
+            # DECIMAL columns come back as Decimal, which cannot be added to floats
+            lat, lon = float(hotel.latitude), float(hotel.longitude)
+            self.hotels.add(hotel.hotel_id, hotel.hotelName, lat, lon)
+            if hotel.positionName:
+                total = sums[(hotel.city_name, hotel.positionName)]
+                total[0] += lat
+                total[1] += lon
+                total[2] += 1
+        for key, (lat, lon, count) in sums.items():
+            self.landmarks.add(key, key[1], lat / count, lon / count)
+
+    def hotels_near(self, lat, lon, radius_km=1.0, limit=10, exclude=None):
+        return self.hotels.near(lat, lon, radius_km, limit, exclude)
+
+    def landmarks_near(self, lat, lon, radius_km=2.0, limit=5):
+        return self.landmarks.near(lat, lon, radius_km, limit)
+
+    def describe(self, hotel_id):
+        """One line of location facts for a prompt, or None if the hotel has no coordinates."""
+        location = self.hotels.location(hotel_id)
+        if location is None:
+            return None
+        landmarks = self.landmarks_near(*location, radius_km=settings.GEO_LANDMARK_RADIUS_KM, limit=3)
+        hotels = self.hotels_near(*location, radius_km=settings.GEO_HOTEL_RADIUS_KM, limit=None, exclude=hotel_id)
+
+        parts = []
+        if landmarks:
+            parts.append("Nearby landmarks: " + ", ".join(f"{name} ({distance:.1f} km)" for _, name, distance in landmarks) + ".")
+        parts.append(f"Other hotels within {settings.GEO_HOTEL_RADIUS_KM:g} km: {len(hotels)}.")
+        return " ".join(parts)
+
+
+def load_neighbourhoods(snapshot=None):
+    if snapshot is not None:
+        return Neighbourhoods(snapshot.fetch(project(GEO_COLUMNS)))
+    with connections['trip'].cursor() as cursor:
+        return Neighbourhoods(fetch_hotels(cursor, project(GEO_COLUMNS)))
+
+
+_cached = None
+_cached_at = 0.0
+_cache_lock = threading.Lock()
+
+
+def get_neighbourhoods():
+    """Process-wide Neighbourhoods for the API, rebuilt every GEO_INDEX_TTL_SECONDS."""
+    global _cached, _cached_at
+    with _cache_lock:
+        if _cached is None or time.monotonic() - _cached_at > settings.GEO_INDEX_TTL_SECONDS:
+            _cached = load_neighbourhoods()
+            _cached_at = time.monotonic()
+        return _cached
@@ -0,0 +1,85 @@
+import hashlib
+import json
+
+from properties.models import ContentBlob, RewriteVersion
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def as_text(value):
+    # rating_review results are (rating, review) tuples
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+class RewriteHistory:
+    """Original and generated values per hotel, field, model and prompt version.
+
+    rewrite_hotels overwrites "hotelName" in the scraper's table, so the name read
+    on a later run may be one we generated. restore_originals() puts the preserved
+    original back before prompting, keeping prompts, caches and duplicate checks
+    tied to the scraped data. Values are stored once per content hash.
+    """
+
+    chunk_size = 10000
+
+    def __init__(self):
+        self.pending = []  # (RewriteVersion, text) waiting for flush()
+
+    def restore_originals(self, hotels, record=True):
+        """Return `hotels` with generated names swapped back to their originals.
+
+        Names that are not ours are originals; with `record`, new ones are saved.
+        """
+        originals, generated = {}, {}
+        ids = [hotel.hotel_id for hotel in hotels if hotel.hotelName]
+        for start in range(0, len(ids), self.chunk_size):
+            versions = (
+                RewriteVersion.objects
+                .filter(hotel_id__in=ids[start:start + self.chunk_size], field='title')
+                .order_by('id')
+                .values_list('hotel_id', 'kind', 'content_id', 'content__text')
+            )
+            for hotel_id, kind, digest, text in versions:
+                if kind == RewriteVersion.ORIGINAL:
+                    originals.setdefault(hotel_id, {})[digest] = text  # Insertion order: latest last
+                else:
+                    generated.setdefault(hotel_id, set()).add(digest)
+
+        restored = []
+        for hotel in hotels:
+            if hotel.hotelName:
+                digest = content_hash(hotel.hotelName)
+                known = originals.get(hotel.hotel_id, {})
+                if digest in generated.get(hotel.hotel_id, ()) and known:
+                    hotel = hotel._replace(hotelName=list(known.values())[-1])
+                elif digest not in known and record:
+                    self.add(hotel.hotel_id, 'title', RewriteVersion.ORIGINAL, hotel.hotelName)
+            restored.append(hotel)
+        if record:
+            self.flush()
+        return restored
+
+    def add(self, hotel_id, field, kind, value, model='', prompt_version=''):
+        text = as_text(value)
+        version = RewriteVersion(hotel_id=hotel_id, field=field, kind=kind, model=model,
+                                 prompt_version=prompt_version, content_id=content_hash(text))
+        self.pending.append((version, text))
+
+    def add_results(self, hotel, results, models, stages):
+        for stage in stages:
+            if stage.name in results:
+                self.add(hotel.hotel_id, stage.name, RewriteVersion.GENERATED, results[stage.name],
+                         models.get(stage.name, ''), stage.prompt_version)
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        blobs = {version.content_id: text for version, text in pending}
+        ContentBlob.objects.bulk_create(
+            [ContentBlob(hash=digest, text=text) for digest, text in blobs.items()],
+            ignore_conflicts=True,
+        )
+        RewriteVersion.objects.bulk_create([version for version, _ in pending], ignore_conflicts=True)
@@ -0,0 +1,71 @@
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from properties.models import RewriteJob
+
+
+def enqueue(stages, hotel_ids, requested_by=''):
+    """Queue a rewrite of `stages` for `hotel_ids`; returns the job without waiting for it."""
+    return RewriteJob.objects.create(
+        stages=','.join(stages),
+        hotel_ids=sorted(set(hotel_ids)),
+        requested_by=requested_by,
+    )
+
+
+def claim_job(stale_after):
+    """Take the oldest queued job, or one whose worker stopped saving progress.
+
+    SKIP LOCKED lets several workers claim jobs concurrently without blocking.
+    A reclaimed job resumes from its saved position.
+    """
+    stale = timezone.now() - timedelta(seconds=stale_after)
+    with transaction.atomic():
+        job = (
+            RewriteJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(Q(status=RewriteJob.QUEUED) | Q(status=RewriteJob.RUNNING, updated_at__lt=stale))
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is not None:
+            job.status = RewriteJob.RUNNING
+            job.started_at = job.started_at or timezone.now()
+            job.save(update_fields=['status', 'started_at', 'updated_at'])
+    return job
+
+
+class Heartbeat:
+    """Saves a running job's updated_at at most every `interval` seconds.
+
+    The pipeline calls it while a batch runs, so claim_job does not take a job
+    whose batch outlasts --stale-after for abandoned and hand it to a second worker.
+    """
+
+    def __init__(self, job, interval):
+        self.job = job
+        self.interval = interval
+        self.last = time.monotonic()
+
+    def __call__(self):
+        if time.monotonic() - self.last < self.interval:
+            return
+        # Only while running, so a cancel from the admin is not overwritten
+        RewriteJob.objects.filter(pk=self.job.pk, status=RewriteJob.RUNNING).update(updated_at=timezone.now())
+        self.last = time.monotonic()
+
+
+def progress(job):
+    total = len(job.hotel_ids)
+    return job.position, total, (100 * job.position / total if total else 100.0)
+
+
+def throughput(job):
+    """Hotels per minute since the job started, or None before it has."""
+    if job.started_at is None or not job.position:
+        return None
+    seconds = ((job.finished_at or timezone.now()) - job.started_at).total_seconds()
+    return job.position * 60 / seconds if seconds > 0 else None
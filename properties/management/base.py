@@ -0,0 +1,445 @@
+import argparse
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from properties.accounting import RunAccounting
+from properties.cancellation import RunControl, cancel_on_signals
+from properties.embeddings import DuplicateDetector, LocalEmbedder, OllamaEmbedder
+from properties.geo import load_neighbourhoods
+from properties.history import RewriteHistory
+from properties.models import PipelineRun, Property
+from properties.ollama import OllamaClient
+from properties.pipeline import Pipeline
+from properties.planning import RunEstimate
+from properties.priority import PriorityScheduler
+from properties.profiling import Profiler, Timings
+from properties.routing import ModelRouter
+from properties.rows import count_hotels, fetch_hotels, project
+from properties.sinks import SINKS
+from properties.snapshot import HotelSnapshot, SnapshotError
+from properties.stages import STAGES
+from properties.uniqueness import TitleIndex, fetch_hotel_names, stored_titles
+from properties.validation import Validator
+
+
+def refresh_worker_connection():
+    """Apply CONN_MAX_AGE and health checks between polls, the way the end of a request would.
+
+    Long-running workers never finish a request, so they call this themselves. Only
+    'default' is checked: watch_hotels' 'trip' connection holds its LISTEN.
+    """
+    connections['default'].close_if_unusable_or_obsolete()
+
+
+class ProfiledCommand(BaseCommand):
+    """Adds --profile/--profile-dir to a command without touching its own arguments."""
+
+    profiler = None
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument('--profile', nargs='?', const='cprofile', choices=['cprofile', 'sample'],
+                            help='Profile the run: cProfile (default) or periodic stack sampling for long runs. '
+                                 'Also summarizes SQL per database and step timings')
+        parser.add_argument('--profile-dir', default=settings.PROFILE_DIR,
+                            help='Where profiling artifacts are written')
+        return parser
+
+    def execute(self, *args, **options):
+        if not options.get('profile'):
+            return super().execute(*args, **options)
+        name = self.__class__.__module__.rpartition('.')[2]
+        self.profiler = Profiler(options['profile'], options['profile_dir'], name,
+                                 interval=settings.PROFILE_SAMPLE_INTERVAL)
+        try:
+            with self.profiler.run():
+                return super().execute(*args, **options)
+        finally:
+            # super().execute() has set up self.stdout by now
+            self.stdout.write(self.style.MIGRATE_HEADING("Profile"))
+            self.stdout.write(self.profiler.summary)
+            self.stdout.write(f"Profile written to {self.profiler.path}.*")
+
+
+class PipelineCommand(ProfiledCommand):
+    """Fetches hotels once and runs them through the stage/sink pipeline.
+
+    Subclasses are presets that name their stages and sinks; run_pipeline lets the
+    caller choose them on the command line.
+    """
+
+    stages = ()
+    sinks = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ollama = OllamaClient()  # Coalesces identical prompts within a run
+        self.timings = Timings()
+        self.history = RewriteHistory()
+        self.accounting = None  # Set for runs that write; --dry-run and --sample are not recorded
+        self.scheduler = None  # PriorityScheduler when priority rules are configured
+        self.fallback = False  # Whether failed stages get template output
+        self.stats = None  # PipelineStats of the last run, for callers such as run_jobs
+        self.control = None  # RunControl: --deadline and SIGTERM/SIGINT cancellation
+        self.titles = None  # TitleIndex with --unique-titles
+        self.progress = None  # Passed to the pipeline; run_jobs sets its job heartbeat
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hotel-id', type=int, action='append', dest='hotel_ids',
+                            help='Only process this hotel (repeatable); used by watch_hotels')
+        parser.add_argument('--limit', type=int,
+                            help='Process at most this many hotels')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Render every prompt without calling Ollama and estimate the run')
+        parser.add_argument('--sample', type=int, metavar='N',
+                            help='Time real calls for N hotels without writing, then extrapolate')
+        parser.add_argument('--concurrency', type=int, default=settings.OLLAMA_CONCURRENCY,
+                            help='Concurrent Ollama requests')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Hotels per batch; each sink writes once per batch')
+        parser.add_argument('--model', action='append', default=[], metavar='STAGE=MODEL',
+                            help='Use MODEL for STAGE instead of OLLAMA_STAGE_MODELS (repeatable)')
+        parser.add_argument('--prompt-batch', default='', metavar='STAGES',
+                            help='Comma-separated short-output stages (title, rating_review) that pack '
+                                 'several hotels into one prompt')
+        parser.add_argument('--prompt-batch-size', type=int, default=8,
+                            help='Hotels per packed prompt')
+        parser.add_argument('--geo-context', action='store_true',
+                            help='Add nearby landmarks and hotel density, computed from the coordinates '
+                                 'of all hotels, to the description and summary prompts')
+        parser.add_argument('--dedupe', choices=['reuse', 'flag'],
+                            help='Detect near-duplicate listings by embedding similarity and either reuse '
+                                 'the first hotel\'s rewrite or only report them')
+        parser.add_argument('--dedupe-threshold', type=float, default=settings.DUPLICATE_SIMILARITY,
+                            help='Cosine similarity above which two listings count as duplicates')
+        parser.add_argument('--priority', action='append', metavar='RULE',
+                            help='Process hotels in priority order (repeatable, earlier rules weigh more): '
+                                 'city=Paris,London, price=MIN-MAX (either end optional) or recent. '
+                                 'Defaults to HOTEL_PRIORITY_RULES')
+        parser.add_argument('--no-city-fairness', action='store_false', dest='city_fairness',
+                            help='With priority rules, do not let cities take turns within a priority tier')
+        parser.add_argument('--snapshot', nargs='?', const=settings.HOTEL_SNAPSHOT_PATH, metavar='PATH',
+                            help='Read hotels from a snapshot_hotels file instead of the trip database '
+                                 '(default path: HOTEL_SNAPSHOT_PATH); sinks still write where they always do')
+        parser.add_argument('--fallback', action=argparse.BooleanOptionalAction, default=settings.TEMPLATE_FALLBACK,
+                            help='When a title or description cannot be generated, write a template built from the '
+                                 'listing instead, flagged as provisional (only sinks that keep the flag use it)')
+        parser.add_argument('--provisional', action='store_true',
+                            help='Only process hotels whose stored text is provisional template output')
+        parser.add_argument('--validate', action=argparse.BooleanOptionalAction, default=settings.VALIDATE_OUTPUT,
+                            help='Check every answer before it is written (length, banned phrases, charset, '
+                                 'rating range) and regenerate rejected ones with a stricter prompt')
+        parser.add_argument('--unique-titles', choices=['city', 'all', 'off'], default=settings.UNIQUE_TITLES,
+                            help='Regenerate titles another hotel already uses in the same city, or anywhere '
+                                 '(default UNIQUE_TITLES)')
+        parser.add_argument('--max-tokens', type=int,
+                            help='Stop after the batch in which prompt plus generated tokens reach this total')
+        parser.add_argument('--max-duration', type=float, metavar='SECONDS',
+                            help='Start no new batch after this many seconds')
+        parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                            help='Hard limit for the whole run: each Ollama request may only take the time left, '
+                                 'and hotels whose calls are cut off are left for --resume')
+        parser.add_argument('--cancel-grace', type=float, default=settings.CANCEL_GRACE_SECONDS, metavar='SECONDS',
+                            help='After SIGTERM/SIGINT or the deadline, how long to wait for calls already sent '
+                                 'before writing what has finished')
+        parser.add_argument('--resume', type=int, metavar='RUN',
+                            help='Process the hotels that run RUN (see run_stats) left unfinished when it was '
+                                 'cancelled or stopped by a budget')
+
+    def get_stage_names(self, options):
+        return list(self.stages)
+
+    def get_sink_names(self, options, stage_names):
+        return list(self.sinks)
+
+    def build_stages(self, options):
+        names = self.get_stage_names(options)
+        unknown = [name for name in names if name not in STAGES]
+        if unknown:
+            raise CommandError(f"Unknown stages: {', '.join(unknown)}. Choose from {', '.join(STAGES)}.")
+        return [STAGES[name]() for name in names]
+
+    def build_sinks(self, options, stages):
+        stage_names = [stage.name for stage in stages]
+        sinks = []
+        for name in self.get_sink_names(options, stage_names):
+            if name not in SINKS:
+                raise CommandError(f"Unknown sink: {name}. Choose from {', '.join(SINKS)}.")
+            sink = SINKS[name](self.stdout, self.style)
+            missing = [stage for stage in sink.requires if stage not in stage_names]
+            if missing:
+                raise CommandError(f"Sink {name} needs stages: {', '.join(missing)}.")
+            sinks.append(sink)
+        return sinks
+
+    def get_prompt_batch(self, options, stages):
+        names = [name.strip() for name in options['prompt_batch'].split(',') if name.strip()]
+        by_name = {stage.name: stage for stage in stages}
+        for name in names:
+            if name not in by_name or not by_name[name].batchable:
+                raise CommandError(f"--prompt-batch: {name} is not a selected stage that supports batching.")
+        return names
+
+    def build_router(self, options):
+        overrides = {}
+        for value in options['model']:
+            stage, sep, model = value.partition('=')
+            if not sep or not model:
+                raise CommandError(f"--model expects STAGE=MODEL, got {value!r}.")
+            overrides[stage] = model
+        router = ModelRouter.from_settings(overrides)
+        self.ollama.listeners.append(router.observe_response)
+        return router
+
+    def build_scheduler(self, options):
+        rules = options['priority'] if options['priority'] is not None else settings.HOTEL_PRIORITY_RULES
+        if not rules:
+            return None
+        try:
+            return PriorityScheduler.from_rules(rules, fair=options['city_fairness'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def build_detector(self, options):
+        if not options['dedupe']:
+            return None
+        if settings.OLLAMA_EMBEDDING_MODEL:
+            embedder = OllamaEmbedder(self.ollama, settings.OLLAMA_EMBEDDING_MODEL)
+        else:
+            embedder = LocalEmbedder()
+        return DuplicateDetector(embedder, options['dedupe_threshold'], reuse=options['dedupe'] == 'reuse')
+
+    def build_pipeline(self, stages, sinks, options):
+        return Pipeline(
+            stages, sinks, self.ollama, self.router, self.stdout, self.style,
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            prompt_batch=self.prompt_batch,
+            prompt_batch_size=options['prompt_batch_size'],
+            detector=self.build_detector(options),
+            timings=self.timings,
+            # Only runs that write keep their outputs; --sample measures and discards
+            history=self.history if sinks else None,
+            accounting=self.accounting if sinks else None,
+            fallback=self.fallback,
+            control=self.control,
+            titles=self.titles,
+            validator=self.build_validator(options),
+            progress=self.progress,
+        )
+
+    def build_validator(self, options):
+        if not options['validate']:
+            return None
+        return Validator(settings.VALIDATION_BANNED_PHRASES, settings.VALIDATION_MIN_LATIN,
+                         settings.VALIDATION_RETRIES)
+
+    def handle(self, *args, **options):
+        if self.profiler:
+            self.profiler.timings = self.timings
+        stages = self.build_stages(options)
+        self.prompt_batch = self.get_prompt_batch(options, stages)
+        self.scheduler = self.build_scheduler(options)
+        if options['snapshot'] and self.scheduler and self.scheduler.recent:
+            self.stdout.write(self.style.WARNING(
+                "The recent priority rule reads the trip database's changelog; it is ignored with --snapshot."
+            ))
+        if options['resume'] is not None:
+            options['hotel_ids'] = self.resume_ids(options['resume'])
+            if not options['hotel_ids']:
+                self.stdout.write(f"Run {options['resume']} left no hotels to resume.")
+                return
+        if options['provisional']:
+            options['hotel_ids'] = self.provisional_ids(options['hotel_ids'])
+            if not options['hotel_ids']:
+                self.stdout.write("No provisional hotels to regenerate.")
+                return
+        self.router = self.build_router(options)
+        self.control = self.ollama.control = RunControl(options['deadline'], options['cancel_grace'])
+        if options['dry_run']:
+            return self.dry_run(stages, options)
+        if options['sample']:
+            with cancel_on_signals(self.control):
+                return self.sample(stages, options)
+
+        sinks = self.build_sinks(options, stages)
+        self.fallback = options['fallback'] and any(sink.accepts_provisional for sink in sinks)
+        self.accounting = self.start_run(stages, options)
+        # SIGTERM/SIGINT let the batch in flight finish and be written, then record what is left
+        with cancel_on_signals(self.control):
+            try:
+                hotels = self.fetch(stages, options, options['limit'])
+                self.titles = self.build_title_index(stages, hotels, options)
+                stats = self.stats = self.build_pipeline(stages, sinks, options).run(hotels)
+            except BaseException as e:
+                self.accounting.finish(self.ollama.usage, 0, PipelineRun.FAILED, str(e) or type(e).__name__)
+                raise
+        if stats.cancelled:
+            status = PipelineRun.CANCELLED
+        elif stats.stop_reason:
+            status = PipelineRun.BUDGET_REACHED
+        else:
+            status = PipelineRun.COMPLETED
+        self.accounting.finish(self.ollama.usage, stats.hotels, status, stats.stop_reason or '',
+                               unfinished=stats.unfinished)
+        self.stdout.write(
+            f"Processed {stats.hotels} hotels: {stats.generated} fields generated, "
+            f"{stats.failed} failed, {sum(sink.written for sink in sinks)} rows written."
+        )
+        if stats.duplicates:
+            self.stdout.write(f"{stats.duplicates} near-duplicate hotels reused an earlier rewrite.")
+        if stats.rejected:
+            self.stdout.write(f"{stats.rejected} answers failed validation and were regenerated or dropped.")
+        if stats.collisions:
+            self.stdout.write(f"{stats.collisions} generated titles were already in use and were regenerated.")
+        if self.router.fallbacks:
+            self.stdout.write(self.style.WARNING(
+                f"{self.router.fallbacks} calls used a fast fallback model because of queue latency."
+            ))
+        if stats.provisional:
+            self.stdout.write(self.style.WARNING(
+                f"{stats.provisional} hotels got provisional template text; "
+                f"{self.__class__.__module__.rpartition('.')[2]} --provisional regenerates them."
+            ))
+        if stats.stop_reason:
+            self.stdout.write(self.style.WARNING(
+                f"Stopped early ({stats.stop_reason}); {len(stats.unfinished)} hotels left, "
+                f"{self.__class__.__module__.rpartition('.')[2]} --resume {self.accounting.run.pk} processes them."
+            ))
+        self.stdout.write(f"Run stats recorded as run {self.accounting.run.pk}; see manage.py run_stats.")
+
+    def start_run(self, stages, options):
+        run = PipelineRun.objects.create(
+            command=self.__class__.__module__.rpartition('.')[2],
+            stages=','.join(stage.name for stage in stages),
+        )
+        accounting = RunAccounting(run, options['max_tokens'], options['max_duration'])
+        self.ollama.listeners.append(accounting.observe_response)
+        return accounting
+
+    def fetch(self, stages, options, limit=None):
+        # Read each hotel once, selecting only the columns the chosen stages need
+        columns = project(
+            *(stage.columns for stage in stages),
+            *(stage.fallback_columns for stage in stages if self.fallback),
+            self.scheduler.columns if self.scheduler else (),
+        )
+        with self.timings.measure('fetch hotels'):
+            hotels = self.read_hotels(columns, options, limit)
+        # Prompt from the scraped names even where rewrite_hotels has overwritten them;
+        # planning runs only read the history
+        with self.timings.measure('restore originals'):
+            hotels = self.history.restore_originals(hotels, record=not (options['dry_run'] or options['sample']))
+        if options['geo_context']:
+            with self.timings.measure('load geo index'):
+                if options['snapshot']:
+                    with self.open_snapshot(options) as snapshot:
+                        try:
+                            neighbourhoods = load_neighbourhoods(snapshot)
+                        except SnapshotError as e:
+                            raise CommandError(str(e))
+                else:
+                    neighbourhoods = load_neighbourhoods()
+            hotels = [hotel._replace(neighbourhood=neighbourhoods.describe(hotel.hotel_id)) for hotel in hotels]
+        return hotels
+
+    def build_title_index(self, stages, hotels, options):
+        scope = options['unique_titles']
+        if scope == 'off' or not any(stage.name == 'title' for stage in stages):
+            return None
+        # Only the cities of this run's hotels are loaded, once, before any title is generated
+        cities = None if scope == 'all' else sorted({hotel.city_name or '' for hotel in hotels})
+        index = TitleIndex(scope, settings.TITLE_UNIQUENESS_RETRIES)
+        with self.timings.measure('load title index'):
+            index.load(self.hotel_names(cities, options), stored_titles())
+        return index
+
+    def hotel_names(self, cities, options):
+        if options['snapshot']:
+            with self.open_snapshot(options) as snapshot:
+                try:
+                    rows = snapshot.fetch(('hotel_id', 'city_name', 'hotelName'))
+                except SnapshotError as e:
+                    raise CommandError(str(e))
+            wanted = None if cities is None else set(cities)
+            return [(row.hotel_id, row.city_name, row.hotelName) for row in rows
+                    if wanted is None or (row.city_name or '') in wanted]
+        with connections['trip'].cursor() as cursor:
+            return fetch_hotel_names(cursor, cities)
+
+    def read_hotels(self, columns, options, limit=None):
+        # With priority rules --limit keeps the most valuable hotels, so the cut comes after ordering
+        if options['snapshot']:
+            with self.open_snapshot(options) as snapshot:
+                if self.scheduler:
+                    return self.scheduler.order(self.snapshot_rows(snapshot, columns, options))[:limit]
+                return self.snapshot_rows(snapshot, columns, options, limit)
+        with connections['trip'].cursor() as cursor:
+            if self.scheduler:
+                self.scheduler.load(cursor)
+                return self.scheduler.order(fetch_hotels(cursor, columns, options['hotel_ids']))[:limit]
+            return fetch_hotels(cursor, columns, options['hotel_ids'], limit)
+
+    def open_snapshot(self, options):
+        try:
+            return HotelSnapshot(options['snapshot'])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+
+    def snapshot_rows(self, snapshot, columns, options, limit=None):
+        try:
+            return snapshot.fetch(columns, options['hotel_ids'], limit)
+        except SnapshotError as e:
+            raise CommandError(str(e))
+
+    def resume_ids(self, run_id):
+        try:
+            return PipelineRun.objects.get(pk=run_id).unfinished
+        except PipelineRun.DoesNotExist:
+            raise CommandError(f"No run {run_id}; see manage.py run_stats.")
+
+    def provisional_ids(self, hotel_ids=None):
+        queryset = Property.objects.filter(provisional=True)
+        if hotel_ids is not None:
+            queryset = queryset.filter(original_id__in=hotel_ids)
+        return list(queryset.order_by('original_id').values_list('original_id', flat=True))
+
+    def count(self, options):
+        if options['snapshot']:
+            with self.open_snapshot(options) as snapshot:
+                return snapshot.count(options['hotel_ids'])
+        with connections['trip'].cursor() as cursor:
+            return count_hotels(cursor, options['hotel_ids'])
+
+    def dry_run(self, stages, options):
+        hotels = self.fetch(stages, options, options['limit'])
+        estimate = RunEstimate(len(hotels), options['concurrency'])
+        # Render the calls exactly as the pipeline would send them
+        for stage, target in self.build_pipeline(stages, [], options).schedule(hotels):
+            model = self.router.model_for(stage.name)
+            if isinstance(target, list):
+                estimate.add_prompt(stage.name, stage.batch_payload(target, model), len(target))
+            else:
+                estimate.add_prompt(stage.name, stage.payload(target, model))
+        self.report(estimate, "Dry run (no Ollama calls)")
+
+    def sample(self, stages, options):
+        total = options['limit'] or self.count(options)
+        hotels = self.fetch(stages, options, min(options['sample'], total))
+        self.titles = self.build_title_index(stages, hotels, options)
+        estimate = RunEstimate(total, options['concurrency'])
+        started = time.monotonic()
+        # No sinks: the sample measures generation only and writes nothing
+        stats = self.build_pipeline(stages, [], options).run(hotels)
+        estimate.hotels = stats.hotels
+        estimate.add_usage(self.ollama.usage)
+        # Elapsed time was measured at --concurrency; the estimate divides by it again
+        estimate.wall_seconds = (time.monotonic() - started) * estimate.concurrency
+        self.report(estimate, "Sample run (nothing written)")
+
+    def report(self, estimate, heading):
+        self.stdout.write(self.style.MIGRATE_HEADING(heading))
+        for line in estimate.report():
+            self.stdout.write(line)
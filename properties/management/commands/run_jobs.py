@@ -0,0 +1,81 @@
+from django.core.management import call_command
+from django.utils import timezone
+from properties.cancellation import RunControl, cancel_on_signals
+from properties.jobs import Heartbeat, claim_job
+from properties.management.base import ProfiledCommand, refresh_worker_connection
+from properties.management.commands.run_pipeline import Command as RunPipelineCommand
+from properties.models import RewriteJob
+
+
+class Command(ProfiledCommand):
+    help = 'Work through rewrite jobs queued from the admin, one batch of hotels at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process queued jobs and exit instead of waiting for new ones')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Hotels per pipeline run; progress is saved after each')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Seconds between checks for new jobs while idle')
+        parser.add_argument('--stale-after', type=float, default=1800.0,
+                            help='Reclaim running jobs whose worker has not saved progress for this many seconds. '
+                                 'Workers save a heartbeat every quarter of it during a batch, so it must '
+                                 'still cover the longest single step (a sink flush or the hotels fetch)')
+
+    def handle(self, *args, **options):
+        # SIGTERM/SIGINT during a batch reach the pipeline command, which drains its results
+        # and cancels this control too; the job goes back to the queue for the next worker
+        self.control = RunControl()
+        with cancel_on_signals(self.control):
+            while not self.control.cancelled:
+                job = claim_job(options['stale_after'])
+                if job is not None:
+                    self.process(job, max(1, options['batch_size']), options['stale_after'])
+                    continue
+                if options['once'] or self.control.wait(options['poll_interval']):
+                    break
+                refresh_worker_connection()
+        if self.control.cancelled:
+            self.stdout.write(self.style.WARNING(f"Worker stopped: {self.control.cancelled}."))
+
+    def process(self, job, batch_size, stale_after):
+        self.stdout.write(f"Job {job.pk}: {job.stages} for {len(job.hotel_ids)} hotels from position {job.position}.")
+        while job.position < len(job.hotel_ids):
+            job.refresh_from_db(fields=['status'])
+            if job.status == RewriteJob.CANCELLED:
+                self.stdout.write(self.style.WARNING(f"Job {job.pk} cancelled at {job.position} hotels."))
+                return
+
+            batch = job.hotel_ids[job.position:job.position + batch_size]
+            command = RunPipelineCommand()
+            command.progress = Heartbeat(job, stale_after / 4)
+            try:
+                call_command(command, stages=job.stages, hotel_ids=batch, stdout=self.stdout, stderr=self.stderr)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Job {job.pk} failed: {str(e)}"))
+                RewriteJob.objects.filter(pk=job.pk).update(
+                    status=RewriteJob.FAILED, error=str(e), finished_at=timezone.now(), updated_at=timezone.now(),
+                )
+                return
+
+            # Status is left alone, so a cancel from the admin during the batch sticks
+            unfinished = set(command.stats.unfinished)
+            finished = [hotel_id for hotel_id in batch if hotel_id not in unfinished]
+            # Hotels an interrupted batch did not process move up to start the next one
+            job.hotel_ids[job.position:job.position + len(batch)] = finished + sorted(unfinished)
+            job.position += len(finished)
+            job.failed_stages += command.stats.failed
+            job.save(update_fields=['hotel_ids', 'position', 'failed_stages', 'updated_at'])
+            job.runs.add(command.accounting.run)
+
+            if self.control.cancelled:
+                RewriteJob.objects.filter(pk=job.pk, status=RewriteJob.RUNNING).update(
+                    status=RewriteJob.QUEUED, updated_at=timezone.now(),
+                )
+                self.stdout.write(self.style.WARNING(f"Job {job.pk} back in the queue at {job.position} hotels."))
+                return
+
+        RewriteJob.objects.filter(pk=job.pk, status=RewriteJob.RUNNING).update(
+            status=RewriteJob.DONE, finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Job {job.pk} done: {job.position} hotels."))
@@ -0,0 +1,25 @@
+from properties.management.base import PipelineCommand
+from properties.sinks import DEFAULT_SINKS, SINKS
+from properties.stages import STAGES
+
+
+class Command(PipelineCommand):
+    help = 'Run any combination of generation stages over the hotels in one pass'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--stages', default=','.join(STAGES),
+                            help=f"Comma-separated stages to run ({', '.join(STAGES)})")
+        parser.add_argument('--sinks',
+                            help=f"Comma-separated sinks to write ({', '.join(SINKS)}); "
+                                 "defaults to the usual table of each stage")
+
+    def get_stage_names(self, options):
+        return [name.strip() for name in options['stages'].split(',') if name.strip()]
+
+    def get_sink_names(self, options, stage_names):
+        if options['sinks']:
+            return [name.strip() for name in options['sinks'].split(',') if name.strip()]
+        # The usual table of each stage, as long as every stage that table needs was selected
+        names = dict.fromkeys(DEFAULT_SINKS[name] for name in stage_names if name in DEFAULT_SINKS)
+        return [name for name in names if all(stage in stage_names for stage in SINKS[name].requires)]
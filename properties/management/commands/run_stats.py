@@ -0,0 +1,62 @@
+from django.db.models import Avg, Count, Sum
+from properties.management.base import ProfiledCommand
+from properties.models import PipelineRun, StageUsage
+from properties.planning import format_duration
+
+
+def per_second(amount, seconds):
+    return f"{amount / seconds:.1f}" if seconds else "-"
+
+
+class Command(ProfiledCommand):
+    help = 'Compare token usage and throughput of recent pipeline runs, per run and per stage and model'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--last', type=int, default=10,
+                            help='Number of most recent runs to compare')
+        parser.add_argument('--run', type=int, action='append', dest='run_ids',
+                            help='Compare this run instead (repeatable)')
+
+    def handle(self, *args, **options):
+        runs = PipelineRun.objects.order_by('-started_at', '-id')
+        if options['run_ids']:
+            runs = list(runs.filter(pk__in=options['run_ids']))
+        else:
+            runs = list(runs[:options['last']])
+        if not runs:
+            self.stdout.write("No runs recorded yet.")
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Runs"))
+        for run in runs:
+            self.stdout.write(
+                f"  #{run.pk} {run.command} [{run.stages}] {run.started_at:%Y-%m-%d %H:%M} {run.status}: "
+                f"{run.hotels} hotels, {run.requests} requests, "
+                f"{run.prompt_tokens} prompt + {run.eval_tokens} generated tokens, "
+                f"GPU {format_duration(run.gpu_seconds)}, wall {format_duration(run.wall_seconds)}, "
+                f"{per_second(run.hotels * 60, run.wall_seconds)} hotels/min"
+            )
+            if run.stop_reason:
+                self.stdout.write(f"    stopped: {run.stop_reason}")
+
+        # Generation speed is eval tokens over eval time; prompt tokens per call shows prompts growing
+        self.stdout.write(self.style.MIGRATE_HEADING("Per stage and model"))
+        rows = (
+            StageUsage.objects
+            .filter(run__in=runs)
+            .values('run_id', 'stage', 'model')
+            .annotate(
+                hotels=Count('hotel_id', distinct=True),
+                prompt=Sum('prompt_tokens'), generated=Sum('eval_tokens'),
+                gpu=Sum('gpu_seconds'), generating=Sum('eval_seconds'),
+                avg_prompt=Avg('prompt_tokens'),
+            )
+            .order_by('stage', 'model', '-run_id')
+        )
+        for row in rows:
+            self.stdout.write(
+                f"  #{row['run_id']} {row['stage']} {row['model']}: {row['hotels']} hotels, "
+                f"{row['avg_prompt']:.0f} prompt tokens/call, "
+                f"{per_second(row['generated'], row['generating'])} generated tokens/s, "
+                f"{per_second(row['prompt'] + row['generated'], row['gpu'])} tokens/GPU-s"
+            )
@@ -0,0 +1,40 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import connections
+from properties.management.base import ProfiledCommand
+from properties.rows import HOTEL_COLUMNS, project, stream_hotels
+from properties.snapshot import SnapshotError, write_snapshot
+
+
+class Command(ProfiledCommand):
+    help = 'Dump hotels columns from the trip DB into a local memory-mapped columnar file for offline runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.HOTEL_SNAPSHOT_PATH,
+                            help='Snapshot file to write (replaced atomically)')
+        parser.add_argument('--columns', default=','.join(HOTEL_COLUMNS),
+                            help='Comma-separated hotels columns to include; hotel_id is always kept')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Rows fetched per round trip from the trip database')
+
+    def handle(self, *args, **options):
+        try:
+            columns = project([name.strip() for name in options['columns'].split(',') if name.strip()])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        try:
+            rows = write_snapshot(options['output'], columns, self.iter_hotels(columns, options['chunk_size']))
+        except (SnapshotError, OSError) as e:
+            raise CommandError(f"Could not write snapshot: {e}")
+
+        size = os.path.getsize(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {rows} hotels ({len(columns)} columns, {size / 1e6:.1f} MB) to {options['output']}."
+        ))
+
+    def iter_hotels(self, columns, chunk_size):
+        with connections['trip'].chunked_cursor() as cursor:
+            yield from stream_hotels(cursor, columns, chunk_size, ordered=True)
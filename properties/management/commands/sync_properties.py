@@ -0,0 +1,91 @@
+from itertools import islice
+
+from django.db import connections, transaction
+from properties.bulk import CopyStream
+from properties.cards import refresh_hotel_cards
+from properties.history import RewriteHistory
+from properties.management.base import ProfiledCommand
+from properties.models import Property
+from properties.rows import HotelRow, stream_hotels
+from properties.search import refresh_search_vectors
+
+
+class Command(ProfiledCommand):
+    help = 'Bulk-load hotels from the trip DB into rewrite_property_info (COPY into a staging table, then merge)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Rows fetched per round trip from the trip database')
+        parser.add_argument('--hotel-id', type=int, action='append', dest='hotel_ids',
+                            help='Only sync this hotel (repeatable); used by watch_hotels')
+
+    def handle(self, *args, **options):
+        table = Property._meta.db_table
+        not_rewritten = Property._meta.get_field('rewritten_title').get_default()
+        no_description = Property._meta.get_field('description').get_default()
+
+        with transaction.atomic(using='default'), connections['default'].cursor() as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE property_sync_stage (
+                    original_id BIGINT,
+                    original_title TEXT
+                ) ON COMMIT DROP
+            """)
+
+            # One COPY per chunk: restoring the names queries this connection, which a COPY holds
+            synced = 0
+            for chunk in self.original_names(options['chunk_size'], options['hotel_ids']):
+                stream = CopyStream(chunk)
+                cursor.copy_expert(
+                    'COPY property_sync_stage (original_id, original_title) FROM STDIN',
+                    stream,
+                )
+                synced += stream.rows
+            cursor.execute('ANALYZE property_sync_stage')
+
+            # Refresh titles of rows we already track
+            cursor.execute(f"""
+                UPDATE {table} AS p
+                SET original_title = s.original_title, search_vector = NULL
+                FROM property_sync_stage AS s
+                WHERE p.original_id = s.original_id
+                  AND p.original_title IS DISTINCT FROM s.original_title
+            """)
+            updated = cursor.rowcount
+
+            # Add hotels we have never seen, keeping the model defaults for generated fields.
+            # Django sets no server-side defaults, so every NOT NULL column is listed here.
+            cursor.execute(f"""
+                INSERT INTO {table} (original_id, original_title, rewritten_title, description, provisional)
+                SELECT s.original_id, s.original_title, %s, %s, false
+                FROM property_sync_stage AS s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {table} AS p WHERE p.original_id = s.original_id
+                )
+            """, [not_rewritten, no_description])
+            inserted = cursor.rowcount
+
+            # Index the changed and new rows (all of them on the first sync after migrating)
+            indexed = refresh_search_vectors()
+            # The synced hotels (every hotel without --hotel-id); unchanged cards are left alone
+            cards = refresh_hotel_cards(options['hotel_ids'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Synced {synced} hotels: {inserted} inserted, {updated} updated, {indexed} reindexed for search, "
+            f"{cards} hotel cards refreshed."
+        ))
+
+    def original_names(self, chunk_size, hotel_ids=None):
+        """Chunks of (hotel_id, name), with names rewrite_hotels overwrote swapped back to the originals."""
+        history = RewriteHistory()
+        rows = self.iter_hotels(chunk_size, hotel_ids)
+        while True:
+            chunk = [HotelRow(hotel_id=hotel_id, hotelName=name) for hotel_id, name in islice(rows, chunk_size)]
+            if not chunk:
+                break
+            # Like the pipeline's fetch, but new originals are left for the pipeline to record
+            yield [(hotel.hotel_id, hotel.hotelName) for hotel in history.restore_originals(chunk, record=False)]
+
+    def iter_hotels(self, chunk_size, hotel_ids=None):
+        with connections['trip'].chunked_cursor() as cursor:
+            yield from stream_hotels(cursor, ('hotel_id', 'hotelName'), chunk_size, hotel_ids)
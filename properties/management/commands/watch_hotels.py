@@ -0,0 +1,92 @@
+from django.core.management import call_command
+from django.db import connections
+from django.db.models import Min
+from properties.cancellation import RunControl, cancel_on_signals
+from properties.changefeed import ChangeFeed
+from properties.management.base import ProfiledCommand, refresh_worker_connection
+from properties.models import ChangeFeedCursor, Property
+from properties.ollama import ollama_available
+
+
+class Command(ProfiledCommand):
+    help = 'Consume the hotels change feed on the trip DB and rewrite new or updated hotels'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--install', action='store_true',
+                            help='Create the changelog table and triggers on the trip database first')
+        parser.add_argument('--once', action='store_true',
+                            help='Process pending changes and exit instead of listening')
+        parser.add_argument('--name', default='rewrite',
+                            help='Consumer name; each name keeps its own position in the feed')
+        parser.add_argument('--command', action='append', dest='commands',
+                            help='Command to run for changed hotels (repeatable). '
+                                 'Defaults to rewrite_property_info and generate_property_info')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Changelog entries handled per pipeline run')
+        parser.add_argument('--requeue-provisional', type=int, default=200, metavar='N',
+                            help='When the feed is idle and Ollama answers, regenerate up to N hotels that got '
+                                 'provisional template text (0 disables)')
+        parser.add_argument('--poll-interval', type=float, default=30.0,
+                            help='Seconds to wait for a notification before re-checking the changelog')
+
+    def handle(self, *args, **options):
+        feed = ChangeFeed(connections['trip'])
+        if options['install']:
+            feed.install()
+            self.stdout.write(self.style.SUCCESS("Installed hotels change feed on the trip database."))
+
+        commands = options['commands'] or ['rewrite_property_info', 'generate_property_info']
+        cursor, _ = ChangeFeedCursor.objects.get_or_create(name=options['name'])
+
+        # A signal during a pipeline run also cancels this control (see cancel_on_signals)
+        self.control = RunControl()
+        with cancel_on_signals(self.control):
+            feed.listen()
+            while not self.control.cancelled:
+                processed = self.drain(feed, cursor, commands, options['batch_size'])
+                if options['once'] or self.control.cancelled:
+                    break
+                if not processed and not self.requeue_provisional(options['requeue_provisional']):
+                    feed.wait(options['poll_interval'])
+                refresh_worker_connection()
+        if self.control.cancelled:
+            self.stdout.write(self.style.WARNING(f"Stopped watching: {self.control.cancelled}."))
+
+    def drain(self, feed, cursor, commands, batch_size):
+        processed = 0
+        while True:
+            position, hotel_ids = feed.read(cursor.position, batch_size)
+            if not hotel_ids:
+                return processed
+
+            self.stdout.write(f"Change feed: {len(hotel_ids)} hotels changed (up to entry {position}).")
+            # The sinks only update existing rows: add new hotels and pick up renames first
+            call_command('sync_properties', hotel_ids=hotel_ids, stdout=self.stdout, stderr=self.stderr)
+            for name in commands:
+                call_command(name, hotel_ids=hotel_ids, stdout=self.stdout, stderr=self.stderr)
+                if self.control.cancelled:
+                    # The position stays put, so the next start processes these entries again
+                    return processed
+
+            cursor.position = position
+            cursor.save(update_fields=['position', 'updated_at'])
+            processed += len(hotel_ids)
+
+            # Entries are only removed once every consumer has moved past them
+            oldest = ChangeFeedCursor.objects.aggregate(oldest=Min('position'))['oldest']
+            feed.prune(oldest)
+
+    def requeue_provisional(self, limit):
+        """Regenerate template text from a degraded run once Ollama is back; returns hotels fixed."""
+        if limit <= 0 or not Property.objects.filter(provisional=True).exists() or not ollama_available():
+            return 0
+        hotel_ids = list(
+            Property.objects.filter(provisional=True).order_by('original_id')
+            .values_list('original_id', flat=True)[:limit]
+        )
+        self.stdout.write(f"Regenerating {len(hotel_ids)} hotels with provisional text.")
+        # Without the fallback, hotels that fail again keep their template text and flag
+        call_command('rewrite_property_info', hotel_ids=hotel_ids, fallback=False,
+                     stdout=self.stdout, stderr=self.stderr)
+        # Only progress skips the wait, so hotels that keep failing do not spin the loop
+        return len(hotel_ids) - Property.objects.filter(original_id__in=hotel_ids, provisional=True).count()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0005_hotel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='property',
+            name='original_id',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0008_property_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentBlob',
+            fields=[
+                ('hash', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('text', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RewriteVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hotel_id', models.BigIntegerField()),
+                ('field', models.CharField(max_length=50)),
+                ('kind', models.CharField(choices=[('original', 'Original'), ('generated', 'Generated')], max_length=10)),
+                ('model', models.CharField(blank=True, max_length=100)),
+                ('prompt_version', models.CharField(blank=True, max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('content', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='properties.contentblob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('hotel_id', 'field', 'kind', 'model', 'prompt_version', 'content'), name='rewrite_version_unique')],
+            },
+        ),
+    ]
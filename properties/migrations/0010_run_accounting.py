@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0009_rewrite_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=100)),
+                ('stages', models.CharField(max_length=200)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('budget_reached', 'Budget reached'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('stop_reason', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('hotels', models.IntegerField(default=0)),
+                ('requests', models.IntegerField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('eval_tokens', models.BigIntegerField(default=0)),
+                ('gpu_seconds', models.FloatField(default=0)),
+                ('wall_seconds', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StageUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hotel_id', models.BigIntegerField()),
+                ('stage', models.CharField(max_length=50)),
+                ('model', models.CharField(max_length=100)),
+                ('hotels_in_prompt', models.IntegerField(default=1)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('eval_tokens', models.IntegerField(default=0)),
+                ('gpu_seconds', models.FloatField(default=0)),
+                ('eval_seconds', models.FloatField(default=0)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='properties.pipelinerun')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0010_run_accounting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='property',
+            name='provisional',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='property',
+            index=models.Index(condition=models.Q(('provisional', True)), fields=['id'], name='property_provisional'),
+        ),
+    ]
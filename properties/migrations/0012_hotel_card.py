@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0011_property_provisional'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotelCard',
+            fields=[
+                ('hotel_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('original_title', models.TextField(null=True)),
+                ('title', models.TextField(null=True)),
+                ('description', models.TextField(null=True)),
+                ('summary', models.TextField(null=True)),
+                ('rating', models.FloatField(null=True)),
+                ('review', models.TextField(null=True)),
+                ('provisional', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField()),
+            ],
+        ),
+    ]
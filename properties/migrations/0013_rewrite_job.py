@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0012_hotel_card'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RewriteJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stages', models.CharField(max_length=200)),
+                ('hotel_ids', models.JSONField(default=list)),
+                ('position', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=20)),
+                ('failed_stages', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('requested_by', models.CharField(blank=True, max_length=150)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('runs', models.ManyToManyField(blank=True, to='properties.pipelinerun')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='rewrite_job_queue')],
+            },
+        ),
+    ]
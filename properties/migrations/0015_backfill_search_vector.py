@@ -0,0 +1,26 @@
+from django.db import migrations
+
+# The rows that existed when 0008 added search_vector; without it they stay out of
+# full-text search until the next sync_properties. Same weights as search.REFRESH_SQL.
+BACKFILL_SQL = """
+    UPDATE rewrite_property_info AS p
+    SET search_vector =
+        setweight(to_tsvector('english', coalesce(p.rewritten_title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(p.original_title, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(p.description, '')), 'C') ||
+        setweight(to_tsvector('english', coalesce(
+            (SELECT s.summary FROM properties_propertysummary AS s WHERE s.property_id = p.original_id), ''
+        )), 'D')
+    WHERE p.search_vector IS NULL
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0014_run_cancellation'),
+    ]
+
+    operations = [
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
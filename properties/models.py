@@ -1,12 +1,23 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 
 class Property(models.Model):
-    original_id = models.BigIntegerField(default=0)  # Default for existing rows
+    original_id = models.BigIntegerField(default=0, db_index=True)  # Default for existing rows; indexed for syncs and lookups
     original_title = models.TextField(default="Unknown")  # Default for existing rows
     rewritten_title = models.TextField(default="Not rewritten")  # Default for existing rows
     description = models.TextField(default="Not rewritten")  # New field for the description
+    search_vector = SearchVectorField(null=True, editable=False)  # Kept up to date by properties.search; NULL = stale
+    provisional = models.BooleanField(default=False)  # Template text written while Ollama was failing; to regenerate
     class Meta:
         db_table = 'rewrite_property_info'
+        indexes = [
+            GinIndex(fields=['search_vector'], name='property_search_gin'),
+            # Finds the rows refresh_search_vectors() still has to recompute
+            models.Index(fields=['id'], name='property_search_stale', condition=models.Q(search_vector__isnull=True)),
+            # The queue of rows rewrite_property_info --provisional regenerates
+            models.Index(fields=['id'], name='property_provisional', condition=models.Q(provisional=True)),
+        ]
 
     def __str__(self):
         return f"{self.original_title} -> {self.rewritten_title}"
@@ -25,6 +36,15 @@ class PropertyRatingReview(models.Model):
 
     def __str__(self):
         return f"Rating and Review for Property {self.property_id}"
+
+class ChangeFeedCursor(models.Model):
+    name = models.CharField(max_length=100, unique=True)  # Consumer name
+    position = models.BigIntegerField(default=0)  # Last consumed hotels_changelog id on the trip DB
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
 class Hotel(models.Model):
     hotel_id = models.BigIntegerField(primary_key=True)
     hotelName = models.CharField(max_length=255)
@@ -43,4 +63,117 @@ class Hotel(models.Model):
 
     @classmethod
     def using_trip_db(cls):
-        return cls.objects.using('trip') 
\ No newline at end of file
+        # Kept for existing callers; TripRouter already routes Hotel queries to 'trip'
+        return cls.objects.using('trip') 
+class ContentBlob(models.Model):
+    hash = models.CharField(max_length=40, primary_key=True)  # sha1 of text; identical values are stored once
+    text = models.TextField()
+
+    def __str__(self):
+        return self.hash
+
+class RewriteVersion(models.Model):
+    ORIGINAL = 'original'
+    GENERATED = 'generated'
+    KIND_CHOICES = [(ORIGINAL, 'Original'), (GENERATED, 'Generated')]
+
+    hotel_id = models.BigIntegerField()
+    field = models.CharField(max_length=50)  # Stage name; the original of 'title' is the scraped hotelName
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    model = models.CharField(max_length=100, blank=True)  # Empty for originals
+    prompt_version = models.CharField(max_length=20, blank=True)  # Empty for originals
+    content = models.ForeignKey(ContentBlob, on_delete=models.PROTECT)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Re-runs that produce the same value add nothing; also serves lookups by hotel_id, field
+            models.UniqueConstraint(fields=['hotel_id', 'field', 'kind', 'model', 'prompt_version', 'content'],
+                                    name='rewrite_version_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.field} for Hotel {self.hotel_id}"
+
+class PipelineRun(models.Model):
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    BUDGET_REACHED = 'budget_reached'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [(RUNNING, 'Running'), (COMPLETED, 'Completed'), (BUDGET_REACHED, 'Budget reached'),
+                      (FAILED, 'Failed'), (CANCELLED, 'Cancelled')]
+
+    command = models.CharField(max_length=100)
+    stages = models.CharField(max_length=200)  # Comma-separated stage names
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=RUNNING)
+    stop_reason = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    hotels = models.IntegerField(default=0)
+    requests = models.IntegerField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    eval_tokens = models.BigIntegerField(default=0)
+    gpu_seconds = models.FloatField(default=0)  # Sum of Ollama's total_duration
+    wall_seconds = models.FloatField(default=0)  # Elapsed time of the run
+    unfinished = models.JSONField(default=list, blank=True)  # Hotel ids a stopped run left; see --resume
+
+    def __str__(self):
+        return f"{self.command} run {self.pk} ({self.status})"
+
+class StageUsage(models.Model):
+    run = models.ForeignKey(PipelineRun, on_delete=models.CASCADE, related_name='usage')
+    hotel_id = models.BigIntegerField()
+    stage = models.CharField(max_length=50)
+    model = models.CharField(max_length=100)
+    hotels_in_prompt = models.IntegerField(default=1)  # >1 for packed prompts; their usage is split evenly
+    prompt_tokens = models.IntegerField(default=0)
+    eval_tokens = models.IntegerField(default=0)
+    gpu_seconds = models.FloatField(default=0)  # total_duration
+    eval_seconds = models.FloatField(default=0)  # eval_duration, for generation throughput
+
+    def __str__(self):
+        return f"{self.stage} usage for Hotel {self.hotel_id} in run {self.run_id}"
+
+class HotelCard(models.Model):
+    """One row per hotel with everything generated for it; maintained by properties.cards."""
+    hotel_id = models.BigIntegerField(primary_key=True)  # Property.original_id / property_id of the other tables
+    original_title = models.TextField(null=True)
+    title = models.TextField(null=True)
+    description = models.TextField(null=True)
+    summary = models.TextField(null=True)
+    rating = models.FloatField(null=True)
+    review = models.TextField(null=True)
+    provisional = models.BooleanField(default=False)
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Card for Hotel {self.hotel_id}"
+
+class RewriteJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed'),
+                      (CANCELLED, 'Cancelled')]
+
+    stages = models.CharField(max_length=200)  # Comma-separated, as for run_pipeline --stages
+    hotel_ids = models.JSONField(default=list)
+    position = models.IntegerField(default=0)  # hotel_ids[:position] have been processed
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    failed_stages = models.IntegerField(default=0)  # Stage calls that errored or produced unusable output
+    error = models.TextField(blank=True)
+    requested_by = models.CharField(max_length=150, blank=True)
+    runs = models.ManyToManyField(PipelineRun, blank=True)  # Token usage of each batch
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Heartbeat: saved after every batch
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'], name='rewrite_job_queue')]
+
+    def __str__(self):
+        return f"Rewrite job {self.pk}: {self.stages} for {len(self.hotel_ids)} hotels ({self.status})"
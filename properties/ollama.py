@@ -0,0 +1,183 @@
+import hashlib
+import json
+import threading
+import time
+
+import requests
+from properties.cancellation import RunCancelled
+
+OLLAMA_URL = "http://ollama:11434/api/generate"
+OLLAMA_EMBEDDINGS_URL = "http://ollama:11434/api/embeddings"
+OLLAMA_TAGS_URL = "http://ollama:11434/api/tags"
+
+
+def ollama_available(url=OLLAMA_TAGS_URL, timeout=5):
+    """Whether Ollama answers a cheap request promptly; false while it is down or swamped."""
+    try:
+        return requests.get(url, timeout=timeout).status_code == 200
+    except requests.exceptions.RequestException:
+        return False
+
+
+class OllamaError(Exception):
+    """A generation failed; the message is ready to show to the operator."""
+
+
+class SingleFlight:
+    """Run each distinct key once; concurrent and later callers reuse the result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call
+
+    def do(self, key, fn, keep=lambda result: True):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            # Failed results are only shared with callers already waiting, so a
+            # later hotel with the same prompt gets a fresh attempt.
+            if call.error is not None or not keep(call.result):
+                with self._lock:
+                    self._calls.pop(key, None)
+            call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Usage:
+    """Running totals of the metrics Ollama reports with each generation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.eval_tokens = 0
+        self.gpu_seconds = 0.0  # Ollama's total_duration, i.e. time spent on the server
+        self.wall_seconds = 0.0  # Round trip as seen by the client
+
+    def add(self, data, wall_seconds):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += data.get('prompt_eval_count') or 0
+            self.eval_tokens += data.get('eval_count') or 0
+            self.gpu_seconds += (data.get('total_duration') or 0) / 1e9
+            self.wall_seconds += wall_seconds
+
+
+class OllamaClient:
+    """Thin wrapper around the Ollama generate endpoint shared by the commands.
+
+    Identical payloads within one client (i.e. one command run) are coalesced,
+    so duplicate hotels cost a single generation.
+    """
+
+    def __init__(self, url=OLLAMA_URL, embeddings_url=OLLAMA_EMBEDDINGS_URL):
+        self.url = url
+        self.embeddings_url = embeddings_url
+        self.inflight = SingleFlight()
+        self.usage = Usage()
+        self.listeners = []  # Called as listener(payload, data, wall_seconds) after each generation
+        self.control = None  # RunControl whose deadline and cancellation apply to every request
+
+    def post(self, payload):
+        key = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+        return self.inflight.do(
+            key,
+            lambda: self._post(payload),
+            keep=lambda response: response.status_code == 200,
+        )
+
+    def _post(self, payload):
+        started = time.monotonic()
+        response = self._send(self.url, payload)
+        if response.status_code == 200:
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            if isinstance(data, dict):
+                wall_seconds = time.monotonic() - started
+                self.usage.add(data, wall_seconds)
+                for listener in self.listeners:
+                    listener(payload, data, wall_seconds)
+        return response
+
+    def _send(self, url, payload):
+        timeout = self.control.timeout() if self.control else None
+        try:
+            return requests.post(url, json=payload, timeout=timeout)
+        except requests.exceptions.Timeout:
+            # Cut off by the run's deadline rather than failed: the caller retries it in a later run
+            if self.control and self.control.cancelled:
+                raise RunCancelled(self.control.cancelled)
+            raise
+
+    def generate(self, payload):
+        """Return the generated text for `payload`, raising OllamaError on failure.
+
+        RunCancelled is raised instead when the run's deadline or cancellation stopped the call.
+        """
+        try:
+            response = self.post(payload)
+            if response.status_code != 200:
+                raise OllamaError(f"Ollama API error: {response.text}")
+            response_data = response.json()
+        except json.JSONDecodeError as e:
+            # Checked first: requests' own JSONDecodeError is also a RequestException
+            raise OllamaError(f"JSON decode error: {str(e)}") from e
+        except requests.exceptions.RequestException as e:
+            raise OllamaError(f"Request error: {str(e)}") from e
+
+        if 'response' not in response_data:
+            raise OllamaError("No 'response' field in API response.")
+        return response_data['response']
+
+    def embed(self, text, model):
+        """Return the embedding of `text` as a list of floats, raising OllamaError on failure.
+
+        Like generate(), raises RunCancelled when the run's deadline or cancellation stopped the call.
+        """
+        payload = {"model": model, "prompt": text}
+        key = 'embed:' + hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        try:
+            # Not reported to usage/listeners: embeddings carry no generation metrics
+            response = self.inflight.do(
+                key,
+                lambda: self._send(self.embeddings_url, payload),
+                keep=lambda response: response.status_code == 200,
+            )
+            if response.status_code != 200:
+                raise OllamaError(f"Ollama API error: {response.text}")
+            response_data = response.json()
+        except json.JSONDecodeError as e:
+            raise OllamaError(f"JSON decode error: {str(e)}") from e
+        except requests.exceptions.RequestException as e:
+            raise OllamaError(f"Request error: {str(e)}") from e
+
+        if not response_data.get('embedding'):
+            raise OllamaError("No 'embedding' field in API response.")
+        return response_data['embedding']
@@ -0,0 +1,412 @@
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from itertools import islice
+
+from properties.cancellation import RunCancelled
+from properties.fallback import TEMPLATE_MODEL
+from properties.ollama import OllamaError
+from properties.profiling import Timings
+from properties.stages import InvalidOutput
+from properties.validation import check_answer
+
+# How often a cancellable run checks for a signal or deadline while waiting for calls
+CANCEL_POLL_SECONDS = 1.0
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def hotels_of(target):
+    # A call's target is one hotel, or the list of hotels of a packed prompt
+    return target if isinstance(target, list) else [target]
+
+
+class PipelineStats:
+    def __init__(self):
+        self.hotels = 0
+        self.generated = 0  # Stage results that parsed and passed validation and the title check
+        self.failed = 0  # Stage calls that errored or produced unusable output
+        self.skipped = 0  # Hotel/sink pairs not written because a required stage failed
+        self.batched = 0  # Stage results taken from multi-hotel prompts
+        self.batch_retries = 0  # Hotels re-asked on their own after a batched answer failed them
+        self.duplicates = 0  # Hotels that took the results of an earlier near-duplicate
+        self.stop_reason = None  # Set when a budget or cancellation ended the run before all hotels were processed
+        self.cancelled = False  # Stopped by a signal or the deadline rather than a budget
+        self.unfinished = []  # Ids of the hotels a stopped run did not process, for --resume
+        self.provisional = 0  # Hotels given template output for at least one stage
+        self.collisions = 0  # Generated titles rejected because another hotel already has them
+        self.rejected = 0  # Answers that failed validation
+
+
+class Pipeline:
+    """Runs the selected stages for each hotel and hands the results to the sinks.
+
+    Stage calls of a batch run concurrently on a thread pool; parsing, logging and
+    all database writes stay on the calling thread, one flush per sink per batch.
+    """
+
+    def __init__(self, stages, sinks, client, router, stdout, style, concurrency=1, batch_size=50,
+                 prompt_batch=(), prompt_batch_size=8, detector=None, timings=None, history=None,
+                 accounting=None, fallback=False, control=None, titles=None, validator=None, progress=None):
+        self.stages = stages
+        self.sinks = sinks
+        self.client = client
+        self.router = router
+        self.stdout = stdout
+        self.style = style
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.prompt_batch = set(prompt_batch)  # Stages that pack several hotels into one prompt
+        self.prompt_batch_size = max(1, prompt_batch_size)
+        self.detector = detector  # DuplicateDetector, when near-duplicates are checked
+        self.timings = timings or Timings()
+        self.history = history  # RewriteHistory recording every generated value
+        self.accounting = accounting  # RunAccounting charging usage to hotels and checking budgets
+        self.fallback = fallback  # Fill failed stages with their provisional template output
+        self.control = control  # RunControl: deadline and SIGTERM/SIGINT cancellation
+        self.cancelling = False
+        self.abandoned = False  # Gave up waiting for calls still running after a cancellation
+        self.titles = titles  # TitleIndex that generated titles must be unique in
+        self.validator = validator  # Validator every parsed answer must pass before it can be written
+        self.progress = progress  # Called on this thread about every CANCEL_POLL_SECONDS while a batch runs
+        self.notes = {}  # (hotel_id, stage name) -> why earlier answers were rejected, for the retry prompt
+        self.rejections = Counter()  # (hotel_id, stage name, rejection kind) -> answers rejected for it
+        self.models = {}  # (hotel_id, stage name) -> model of the call that produced the result
+        self.finished = {}  # hotel_id -> (results, models), kept for later duplicates when the detector reuses
+        self.stats = PipelineStats()
+
+    def run(self, hotels):
+        for sink in self.sinks:
+            sink.prepare()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            batches = batched(hotels, self.batch_size)
+            for batch in batches:
+                # Budgets and cancellation are checked between batches, so every started batch is written
+                reason = self.stop_reason()
+                if reason:
+                    self.stats.stop_reason = reason
+                    self.stats.unfinished.extend(hotel.hotel_id for rest in [batch, *batches] for hotel in rest)
+                    self.stdout.write(self.style.WARNING(f"Stopping early: {reason}."))
+                    break
+                self.run_batch(executor, batch)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        # Calls abandoned after a cancellation are not waited for; their results are discarded
+        executor.shutdown(wait=not self.abandoned, cancel_futures=True)
+        return self.stats
+
+    def stop_reason(self):
+        if self.control and self.control.cancelled:
+            self.stats.cancelled = True
+            return self.control.cancelled
+        return self.accounting.exhausted() if self.accounting else None
+
+    def run_batch(self, executor, batch):
+        results = {hotel.hotel_id: {} for hotel in batch}
+        self.models = {}
+        duplicates = self.find_duplicates(executor, batch) if self.detector else {}
+        reused = duplicates if self.detector and self.detector.reuse else {}
+
+        pending = {}
+        for stage, target in self.schedule([hotel for hotel in batch if hotel.hotel_id not in reused]):
+            call = self.call_group if isinstance(target, list) else self.call
+            pending[executor.submit(call, stage, target)] = (target, stage)
+
+        interrupted = set()  # Hotels with a call cancelled or cut off by the deadline; left for a later run
+        while pending:
+            done, _ = wait(pending, timeout=CANCEL_POLL_SECONDS if self.control else None,
+                           return_when=FIRST_COMPLETED)
+            if self.progress:
+                self.progress()
+            for future in done:
+                target, stage = pending.pop(future)
+                if isinstance(future.exception(), RunCancelled):
+                    interrupted.update(hotel.hotel_id for hotel in hotels_of(target))
+                    continue
+                if isinstance(target, list):
+                    # Hotels the batched answer did not cover get a single-hotel call
+                    for hotel in self.collect_group(future, stage, target, results):
+                        if self.control and self.control.cancelled:
+                            interrupted.add(hotel.hotel_id)
+                        else:
+                            pending[executor.submit(self.call, stage, hotel)] = (hotel, stage)
+                    continue
+                value = self.collect(future, stage)
+                rejection = self.rejection(stage, target, value) if value is not None else None
+                if rejection:
+                    # Regenerated right away, before anything is written
+                    if self.control and self.control.cancelled:
+                        interrupted.add(target.hotel_id)
+                        continue
+                    if self.reject(stage, target, rejection):
+                        pending[executor.submit(self.call, stage, target)] = (target, stage)
+                        continue
+                    value = None
+                    self.stats.failed += 1
+                if value is not None:
+                    results[target.hotel_id][stage.name] = value
+                    self.stats.generated += 1
+            if self.control and self.control.cancelled:
+                self.cancel_pending(pending, interrupted)
+
+        for hotel in batch:
+            original = reused[hotel.hotel_id][0] if hotel.hotel_id in reused else None
+            if hotel.hotel_id in interrupted or original in interrupted:
+                # Not written at all, rather than with the stages that happened to finish
+                self.stats.unfinished.append(hotel.hotel_id)
+                continue
+            self.stats.hotels += 1
+            if hotel.hotel_id in reused:
+                # The original always comes earlier, so its finalized results are ready
+                self.stats.duplicates += 1
+                copied, models = self.finished.get(original, ({}, {}))
+                self.finish(hotel, dict(copied), finalize=False)
+                if self.history:
+                    # Under the duplicate's own id, so the next run recognises the copied title as ours
+                    self.history.add_results(hotel, copied, models, self.stages)
+                continue
+            self.finish(hotel, results[hotel.hotel_id])
+            models = {stage.name: self.models.get((hotel.hotel_id, stage.name), '') for stage in self.stages}
+            if self.history:
+                self.history.add_results(hotel, results[hotel.hotel_id], models, self.stages)
+            if self.detector and self.detector.reuse:
+                self.finished[hotel.hotel_id] = (results[hotel.hotel_id], models)
+
+        # History first: a sink that overwrites scraped names must not run unless the originals are saved
+        history_saved = True
+        if self.history:
+            try:
+                with self.timings.measure("rewrite history"):
+                    self.history.flush()
+            except Exception as e:
+                history_saved = False
+                self.stdout.write(self.style.ERROR(f"Error writing rewrite history: {str(e)}"))
+        for sink in self.sinks:
+            if sink.overwrites_source and not history_saved:
+                skipped = sink.discard()
+                self.stdout.write(self.style.ERROR(
+                    f"Not writing {skipped} hotels to {sink.name}: their original values could not be saved."
+                ))
+                continue
+            try:
+                with self.timings.measure(f"sink {sink.name}"):
+                    sink.flush()
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Error writing {sink.name}: {str(e)}"))
+        if self.accounting:
+            try:
+                self.accounting.flush()
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Error writing run stats: {str(e)}"))
+
+    def cancel_pending(self, pending, interrupted):
+        """Drop the calls not sent yet and, once the grace period is over, those still running."""
+        if not self.cancelling:
+            self.cancelling = True
+            self.stdout.write(self.style.WARNING(
+                f"Cancelling ({self.control.cancelled}): writing finished results, "
+                f"waiting up to {self.control.grace:g}s for calls already sent."
+            ))
+        abandon = self.control.abandon()
+        for future, (target, stage) in list(pending.items()):
+            if future.cancel() or abandon:
+                del pending[future]
+                interrupted.update(hotel.hotel_id for hotel in hotels_of(target))
+        self.abandoned = self.abandoned or abandon
+
+    def schedule(self, batch):
+        """Yield (stage, hotel or packed group) in the order the calls should be sent.
+
+        Ollama reuses the evaluated prompt of a slot's previous request for as long as
+        the new one starts the same way. Calls are therefore grouped by system prompt,
+        then stage, then each stage's prefix key (city and nearby location, which the
+        prompts put before the hotel's name), instead of alternating stages hotel by hotel.
+        """
+        by_system = {}
+        for stage in self.stages:
+            system = stage.batch_system if stage.name in self.prompt_batch else stage.system
+            by_system.setdefault(system, []).append(stage)
+
+        for stages in by_system.values():
+            for stage in stages:
+                hotels = sorted(batch, key=stage.prefix_key)  # Stable: keeps fetch order within a key
+                if stage.name in self.prompt_batch:
+                    for group in batched(hotels, self.prompt_batch_size):
+                        yield stage, group
+                else:
+                    for hotel in hotels:
+                        yield stage, hotel
+
+    def embed(self, hotel):
+        with self.timings.measure("embeddings"):
+            return self.detector.embed(hotel)
+
+    def find_duplicates(self, executor, batch):
+        futures = [(hotel, executor.submit(self.embed, hotel)) for hotel in batch]
+        vectors = {}
+        for hotel, future in futures:
+            # Checked between hotels: once cancelled, the embeddings not sent yet are dropped and
+            # the batch's generation calls are cancelled in turn, so its hotels are left for a later run
+            while self.control and not self.control.cancelled and not future.done():
+                wait([future], timeout=CANCEL_POLL_SECONDS)
+                if self.progress:
+                    self.progress()
+            if self.control and self.control.cancelled:
+                for _, rest in futures:
+                    rest.cancel()
+                break
+            try:
+                vectors[hotel.hotel_id] = future.result()
+            except OllamaError as e:
+                self.stdout.write(self.style.WARNING(f"Not checking ID {hotel.hotel_id} for duplicates: {str(e)}"))
+
+        duplicates = self.detector.assign(batch, vectors)
+        for hotel_id, (original_id, similarity) in duplicates.items():
+            action = "reusing its rewrite" if self.detector.reuse else "generating anyway"
+            self.stdout.write(self.style.WARNING(
+                f"ID {hotel_id} looks like a duplicate of ID {original_id} (similarity {similarity:.2f}); {action}."
+            ))
+        return duplicates
+
+    def call(self, stage, hotel):
+        # Runs on a worker thread; the model is chosen when the call starts, not when queued
+        model = self.router.model_for(stage.name)
+        self.models[(hotel.hotel_id, stage.name)] = model
+        notes = self.notes.get((hotel.hotel_id, stage.name))
+        payload = stage.payload(hotel, model, notes) if notes else stage.payload(hotel, model)
+        with self.timings.measure(f"ollama {stage.name}"), self.charge_to([hotel], stage, model):
+            return self.client.generate(payload)
+
+    def call_group(self, stage, hotels):
+        model = self.router.model_for(stage.name)
+        for hotel in hotels:
+            self.models[(hotel.hotel_id, stage.name)] = model  # A single-hotel retry overwrites it
+        with self.timings.measure(f"ollama {stage.name} (packed)"), self.charge_to(hotels, stage, model):
+            return self.client.generate(stage.batch_payload(hotels, model))
+
+    def rejection(self, stage, hotel, value):
+        """Why a parsed answer cannot be written, as a Rejection, or None."""
+        rejection = check_answer(stage, hotel, value, self.validator, self.titles)
+        if rejection is None:
+            return None
+        if rejection.kind == 'taken':
+            self.stats.collisions += 1
+        else:
+            self.stats.rejected += 1
+        self.stdout.write(self.style.WARNING(rejection.message))
+        return rejection
+
+    def reject(self, stage, hotel, rejection):
+        """Record a rejected answer; True if the hotel gets another call with its note in the prompt.
+
+        Each kind of rejection is held to its own retry setting, so collisions do not
+        use up the regenerations allowed for invalid answers or the other way round.
+        """
+        notes = self.notes.setdefault((hotel.hotel_id, stage.name), [])
+        notes.append(rejection.note)
+        key = (hotel.hotel_id, stage.name, rejection.kind)
+        self.rejections[key] += 1
+        if self.rejections[key] > rejection.retries:
+            self.stdout.write(self.style.WARNING(
+                f"No usable {stage.label} for ID {hotel.hotel_id} after {len(notes) - 1} regenerations "
+                f"({self.rejections[key]} rejected as {rejection.kind})."
+            ))
+            return False
+        return True
+
+    def charge_to(self, hotels, stage, model):
+        return self.accounting.charge_to(hotels, stage, model) if self.accounting else nullcontext()
+
+    def collect_group(self, future, stage, hotels, results):
+        """Store the usable items of a batched answer and return the hotels to retry."""
+        try:
+            items = stage.split_batch(future.result(), hotels)
+        except (OllamaError, InvalidOutput) as e:
+            self.stdout.write(self.style.WARNING(str(e)))
+            items = {}
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Error generating batched {stage.name}: {str(e)}"))
+            items = {}
+
+        retry = []
+        for hotel in hotels:
+            try:
+                value = stage.parse(items[hotel.hotel_id])
+            except (KeyError, InvalidOutput):
+                retry.append(hotel)
+            else:
+                rejection = self.rejection(stage, hotel, value)
+                if rejection:
+                    # The single-hotel call says why this answer was rejected
+                    if self.reject(stage, hotel, rejection):
+                        retry.append(hotel)
+                    else:
+                        self.stats.failed += 1
+                    continue
+                results[hotel.hotel_id][stage.name] = value
+                self.stats.generated += 1
+                self.stats.batched += 1
+        if retry:
+            self.stats.batch_retries += len(retry)
+            self.stdout.write(self.style.WARNING(
+                f"Batched {stage.name}: {len(retry)} of {len(hotels)} hotels unusable, retrying individually."
+            ))
+        return retry
+
+    def collect(self, future, stage):
+        try:
+            value = stage.parse(future.result())
+        except OllamaError as e:
+            self.stdout.write(self.style.ERROR(str(e)))
+        except InvalidOutput as e:
+            self.stdout.write(self.style.WARNING(str(e)))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"Error generating {stage.name}: {str(e)}"))
+        else:
+            return value  # Counted as generated once it passes rejection()
+        self.stats.failed += 1
+        return None
+
+    def finish(self, hotel, results, finalize=True):
+        if finalize:
+            for stage in self.stages:
+                if stage.name in results:
+                    results[stage.name] = stage.finalize(results[stage.name], hotel, results)
+            if self.fallback:
+                self.fill_fallbacks(hotel, results)
+
+        reported = set()
+        provisional = results.get('provisional', ())
+        for sink in self.sinks:
+            missing = [name for name in sink.requires
+                       if name not in results or (name in provisional and not sink.accepts_provisional)]
+            if not missing:
+                sink.add(hotel, results)
+                continue
+            self.stats.skipped += 1
+            for stage in self.stages:
+                if stage.name in missing and stage.name not in reported:
+                    reported.add(stage.name)
+                    self.stdout.write(self.style.WARNING(
+                        f"Skipping ID {hotel.hotel_id} due to invalid {stage.label}."
+                    ))
+
+    def fill_fallbacks(self, hotel, results):
+        # After finalize(), so generated values are never adjusted to match template ones
+        provisional = set()
+        for stage in self.stages:
+            if stage.name not in results:
+                value = stage.fallback(hotel)
+                if value is not None:
+                    results[stage.name] = value
+                    provisional.add(stage.name)
+                    self.models[(hotel.hotel_id, stage.name)] = TEMPLATE_MODEL
+        if provisional:
+            results['provisional'] = frozenset(provisional)
+            self.stats.provisional += 1
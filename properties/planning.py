@@ -0,0 +1,84 @@
+from collections import defaultdict
+
+from django.conf import settings
+
+# Rough output length per stage, used by --dry-run where nothing is generated
+EXPECTED_EVAL_TOKENS = {
+    'title': 12,
+    'description': 40,
+    'summary': 90,
+    'rating_review': 60,
+}
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text with the models we run
+    return max(1, len(text) // 4)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+class RunEstimate:
+    """Extrapolates a full run from rendered prompts (--dry-run) or timed calls (--sample)."""
+
+    def __init__(self, total_hotels, concurrency):
+        self.total_hotels = total_hotels
+        self.concurrency = max(1, concurrency)
+        self.stage_requests = defaultdict(int)
+        self.hotels = total_hotels  # Hotels the measurements cover; a sample run sets how many it reached
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.eval_tokens = 0
+        self.gpu_seconds = 0.0
+        self.wall_seconds = 0.0
+
+    def add_prompt(self, stage, payload, hotels=1):
+        """Account for a rendered payload (covering `hotels` hotels) without calling Ollama."""
+        prompt_tokens = estimate_tokens(payload.get('system', '') + payload['prompt'])
+        eval_tokens = EXPECTED_EVAL_TOKENS.get(stage, 50) * hotels
+        seconds = (prompt_tokens / settings.OLLAMA_PROMPT_TOKENS_PER_SECOND
+                   + eval_tokens / settings.OLLAMA_EVAL_TOKENS_PER_SECOND)
+        self.stage_requests[stage] += 1
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.eval_tokens += eval_tokens
+        self.gpu_seconds += seconds
+        self.wall_seconds += seconds
+
+    def add_usage(self, usage):
+        """Account for the metrics Ollama reported for real calls."""
+        self.requests += usage.requests
+        self.prompt_tokens += usage.prompt_tokens
+        self.eval_tokens += usage.eval_tokens
+        self.gpu_seconds += usage.gpu_seconds
+        self.wall_seconds += usage.wall_seconds
+
+    def scale(self):
+        return self.total_hotels / self.hotels if self.hotels else 0
+
+    def report(self):
+        scale = self.scale()
+        lines = [
+            f"Measured {self.hotels} of {self.total_hotels} hotels: {self.requests} requests, "
+            f"{self.prompt_tokens} prompt + {self.eval_tokens} generated tokens.",
+        ]
+        for stage, count in sorted(self.stage_requests.items()):
+            lines.append(f"  {stage}: {count} prompts")
+        lines += [
+            f"Estimated full run: {round(self.requests * scale)} requests, "
+            f"{round(self.prompt_tokens * scale)} prompt tokens, "
+            f"{round(self.eval_tokens * scale)} generated tokens.",
+            f"Estimated GPU time: {format_duration(self.gpu_seconds * scale)}; "
+            f"wall clock at concurrency {self.concurrency}: "
+            f"{format_duration(self.wall_seconds * scale / self.concurrency)}.",
+        ]
+        return lines
@@ -0,0 +1,137 @@
+from decimal import Decimal, InvalidOperation
+
+
+class CityRule:
+    """Listed cities first, in the order given."""
+
+    columns = ('city_name',)
+
+    def __init__(self, cities):
+        self.rank = {}
+        for city in cities:
+            self.rank.setdefault(city.casefold(), len(self.rank))
+
+    def key(self, hotel):
+        return self.rank.get((hotel.city_name or '').casefold(), len(self.rank))
+
+
+class PriceRule:
+    """Hotels priced within [low, high] first; either end may be open."""
+
+    columns = ('price',)
+
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+
+    def key(self, hotel):
+        if hotel.price is None:
+            return 1
+        if self.low is not None and hotel.price < self.low:
+            return 1
+        if self.high is not None and hotel.price > self.high:
+            return 1
+        return 0
+
+
+class RecentRule:
+    """Most recently inserted or changed first, from the change feed's changelog.
+
+    Orders hotels within a priority tier rather than forming tiers of its own, so
+    it combines with city fairness. watch_hotels prunes entries every consumer has
+    processed, so hotels without one (and every hotel on trip databases without the
+    change feed) come last, highest hotel_id first: the fetch has no ORDER BY, and
+    the scraper hands out ids in insertion order.
+    """
+
+    columns = ()
+
+    def __init__(self):
+        self.latest = {}  # hotel_id -> id of its newest changelog entry
+
+    def load(self, cursor):
+        cursor.execute("SELECT to_regclass('hotels_changelog') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute('SELECT hotel_id, max(id) FROM hotels_changelog GROUP BY hotel_id')
+            self.latest = dict(cursor.fetchall())
+
+    def key(self, hotel):
+        if hotel.hotel_id in self.latest:
+            return (0, -self.latest[hotel.hotel_id])
+        return (1, -hotel.hotel_id)
+
+
+def parse_price(value):
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"Invalid price {value!r} in priority rule.")
+
+
+def parse_rule(text):
+    """Build a rule from 'city=Paris,London', 'price=100-300' (or '150-', '-80') or 'recent'."""
+    name, _, value = text.partition('=')
+    name = name.strip()
+    if name == 'city':
+        cities = [city.strip() for city in value.split(',') if city.strip()]
+        if not cities:
+            raise ValueError("Priority rule city= needs at least one city.")
+        return CityRule(cities)
+    if name == 'price':
+        low, sep, high = value.partition('-')
+        if not sep:
+            raise ValueError(f"Priority rule price= expects MIN-MAX, got {value!r}.")
+        return PriceRule(parse_price(low.strip()), parse_price(high.strip()))
+    if name == 'recent' and not value:
+        return RecentRule()
+    raise ValueError(f"Unknown priority rule {text!r}. Use city=..., price=MIN-MAX or recent.")
+
+
+class PriorityScheduler:
+    """Orders hotels so that a run cut short has already done the most valuable work.
+
+    City and price rules split hotels into tiers (earlier rules weigh more). Within
+    a tier, cities take turns one hotel at a time when `fair`, so one large city
+    cannot hold back the others; each city's hotels follow the recent rule if
+    given, otherwise the fetch order.
+    """
+
+    def __init__(self, rules, fair=True):
+        self.tiers = [rule for rule in rules if not isinstance(rule, RecentRule)]
+        self.recent = next((rule for rule in rules if isinstance(rule, RecentRule)), None)
+        self.fair = fair
+
+    @classmethod
+    def from_rules(cls, texts, fair=True):
+        return cls([parse_rule(text) for text in texts], fair)
+
+    @property
+    def columns(self):
+        columns = {column for rule in self.tiers for column in rule.columns}
+        if self.fair:
+            columns.add('city_name')
+        return columns
+
+    def load(self, cursor):
+        if self.recent:
+            self.recent.load(cursor)
+
+    def order(self, hotels):
+        keyed = []
+        seen = {}  # (tier, city) -> hotels of that city placed in the tier so far
+        recency = self.recent.key if self.recent else (lambda hotel: 0)
+        ranked = sorted(enumerate(hotels), key=lambda item: (self.tier(item[1]), recency(item[1]), item[0]))
+        for position, hotel in ranked:
+            tier = self.tier(hotel)
+            turn = 0
+            if self.fair:
+                city = (tier, (hotel.city_name or '').casefold())
+                turn = seen[city] = seen.get(city, -1) + 1
+            keyed.append(((tier, turn, recency(hotel), position), hotel))
+        keyed.sort(key=lambda item: item[0])
+        return [hotel for _, hotel in keyed]
+
+    def tier(self, hotel):
+        return tuple(rule.key(hotel) for rule in self.tiers)
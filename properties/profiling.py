@@ -0,0 +1,236 @@
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from django.db import connections
+
+# Tells apart runs of one process within the same second (run_jobs profiles every job)
+_runs = itertools.count(1)
+
+
+class Timings:
+    """Wall time per named step (a stage's Ollama calls, a sink's writes, the fetch).
+
+    Steps that run on several threads at once add up to more than the elapsed time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.steps = defaultdict(lambda: [0, 0.0, 0.0])  # name -> [count, total, max]
+
+    def add(self, name, seconds):
+        with self._lock:
+            step = self.steps[name]
+            step[0] += 1
+            step[1] += seconds
+            step[2] = max(step[2], seconds)
+
+    @contextmanager
+    def measure(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+
+    def report(self):
+        lines = []
+        for name, (count, total, longest) in sorted(self.steps.items(), key=lambda item: -item[1][1]):
+            lines.append(f"  {name}: {count} x, {total:.2f}s total, {total / count:.3f}s mean, {longest:.3f}s max")
+        return lines
+
+
+class SqlLog:
+    """Count and time every query run through Django's connections, per alias."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = defaultdict(list)  # alias -> [(seconds, sql)]
+
+    def wrapper(self, alias):
+        def execute(execute, sql, params, many, context):
+            started = time.monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                with self._lock:
+                    self.queries[alias].append((time.monotonic() - started, sql))
+        return execute
+
+    @contextmanager
+    def capture(self):
+        # Wrappers apply to the calling thread's connections, where the commands do their SQL.
+        # Raw psycopg2 calls (execute_values, copy_expert) are not seen.
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self.wrapper(alias)))
+            yield self
+
+    def report(self, slowest=5):
+        lines = []
+        for alias, queries in sorted(self.queries.items()):
+            total = sum(seconds for seconds, _ in queries)
+            lines.append(f"  {alias}: {len(queries)} queries, {total:.3f}s total")
+            for seconds, sql in sorted(queries, key=lambda query: -query[0])[:slowest]:
+                lines.append(f"    {seconds:.3f}s  {' '.join(sql.split())[:200]}")
+        return lines
+
+
+class Sampler:
+    """Records the stack of every thread at a fixed interval; cheap enough for long runs."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()  # (thread name, frame, ...) root first -> samples
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == self._thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def folded(self):
+        # The "collapsed stack" format read by flamegraph.pl and speedscope
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self, top=15):
+        total = sum(self.stacks.values()) or 1
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for frame in set(stack[1:]):
+                inclusive[frame] += count
+        lines = [f"  {total} samples every {self.interval * 1000:g} ms; top frames by own samples:"]
+        for frame, count in own.most_common(top):
+            lines.append(f"    {100 * count / total:5.1f}% own, {100 * inclusive[frame] / total:5.1f}% incl  {frame}")
+        return lines
+
+
+class ThreadProfiles:
+    """cProfile for every thread started while it is active, not just the calling one.
+
+    cProfile.Profile.enable() only traces the thread that calls it, and the pipeline
+    makes its Ollama calls on executor threads, so each new thread enables its own
+    profile on its first call. The profiles are merged into one pstats.Stats.
+    """
+
+    def __init__(self):
+        self.main = cProfile.Profile()
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def _start_thread(self, frame, event, arg):
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ profiles through sys.monitoring, which already covers every thread
+            return
+        with self._lock:
+            self.threads.append(profile)
+
+    def enable(self):
+        threading.setprofile(self._start_thread)
+        self.main.enable()
+
+    def disable(self):
+        self.main.disable()
+        threading.setprofile(None)
+
+    def stats(self, stream=None):
+        stats = pstats.Stats(self.main, stream=stream)
+        with self._lock:
+            for profile in self.threads:
+                stats.add(profile)
+        return stats
+
+
+class Profiler:
+    """Profiles one command run and writes its artifacts to `directory`.
+
+    mode 'cprofile' traces every call on every thread (exact, slower); 'sample' takes periodic stack
+    samples (cheap, for long runs). Both also log SQL per alias and report the
+    command's step timings.
+    """
+
+    def __init__(self, mode, directory, name, interval=0.01):
+        self.mode = mode
+        self.directory = Path(directory)
+        self.name = name
+        self.interval = interval
+        self.sql = SqlLog()
+        self.timings = None  # Set by commands that time their steps
+        self.summary = None  # Filled in when the run ends
+        self.path = None  # Artifacts are this path plus .txt/.prof/.folded
+
+    @contextmanager
+    def run(self):
+        profile = sampler = None
+        started = time.monotonic()
+        with self.sql.capture():
+            if self.mode == 'sample':
+                sampler = Sampler(self.interval)
+                sampler.start()
+            else:
+                profile = ThreadProfiles()
+                profile.enable()
+            try:
+                yield self
+            finally:
+                if profile:
+                    profile.disable()
+                if sampler:
+                    sampler.stop()
+                self.write(time.monotonic() - started, profile, sampler)
+
+    def write(self, elapsed, profile, sampler):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        base = self.directory / f"{self.name}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{next(_runs)}"
+
+        lines = [f"{self.name}: {elapsed:.2f}s wall clock"]
+        if self.timings is not None and self.timings.steps:
+            lines += ["Step timings:"] + self.timings.report()
+        lines += ["SQL:"] + (self.sql.report() or ["  no queries"])
+        if sampler:
+            lines += ["Samples:"] + sampler.report()
+            base.with_suffix('.folded').write_text(sampler.folded())
+        summary = '\n'.join(lines)
+
+        details = summary
+        if profile:
+            text = io.StringIO()
+            stats = profile.stats(stream=text)
+            stats.dump_stats(base.with_suffix('.prof'))
+            stats.sort_stats('cumulative').print_stats(40)
+            details += '\n\ncProfile (cumulative):\n' + text.getvalue()
+        base.with_suffix('.txt').write_text(details + '\n')
+        self.summary, self.path = summary, base
@@ -0,0 +1,21 @@
+class TripRouter:
+    """Sends the scraper's models to the trip database and keeps migrations off it."""
+
+    trip_models = {'hotel'}
+
+    def _is_trip(self, model):
+        return model._meta.app_label == 'properties' and model._meta.model_name in self.trip_models
+
+    def db_for_read(self, model, **hints):
+        return 'trip' if self._is_trip(model) else None
+
+    def db_for_write(self, model, **hints):
+        return 'trip' if self._is_trip(model) else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The scraper owns the trip schema; our tables never go there
+        if db == 'trip':
+            return False
+        if app_label == 'properties' and model_name in self.trip_models:
+            return False
+        return None
@@ -0,0 +1,50 @@
+import threading
+
+from django.conf import settings
+
+
+class ModelRouter:
+    """Picks the Ollama model for each stage call.
+
+    Every stage has a primary model and optionally a faster one. While the smoothed
+    queue latency (a call's wall time minus Ollama's total_duration, i.e. the time
+    it waited on the server before being processed) is above the threshold, stages
+    with a fast model use it. They switch back once latency drops below half the
+    threshold.
+    """
+
+    def __init__(self, routes, default_model, threshold_seconds, smoothing=0.3):
+        self.routes = routes
+        self.default_model = default_model
+        self.threshold = threshold_seconds
+        self.smoothing = smoothing
+        self.queue_latency = 0.0  # EWMA in seconds
+        self.congested = False
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, overrides=None):
+        routes = {stage: dict(route) for stage, route in settings.OLLAMA_STAGE_MODELS.items()}
+        for stage, model in (overrides or {}).items():
+            # An explicit model for a stage also disables its fallback
+            routes[stage] = {'model': model}
+        return cls(routes, settings.OLLAMA_DEFAULT_MODEL, settings.OLLAMA_FALLBACK_QUEUE_SECONDS)
+
+    def model_for(self, stage_name):
+        route = self.routes.get(stage_name, {})
+        fast = route.get('fast')
+        if fast and self.congested:
+            with self._lock:
+                self.fallbacks += 1
+            return fast
+        return route.get('model', self.default_model)
+
+    def observe_response(self, payload, data, wall_seconds):
+        queued = max(0.0, wall_seconds - (data.get('total_duration') or 0) / 1e9)
+        with self._lock:
+            self.queue_latency += self.smoothing * (queued - self.queue_latency)
+            if self.queue_latency > self.threshold:
+                self.congested = True
+            elif self.queue_latency < self.threshold / 2:
+                self.congested = False
@@ -0,0 +1,97 @@
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+# Column name -> SQL expression on the scraper's `hotels` table
+HOTEL_COLUMNS = {
+    'hotel_id': 'hotel_id',
+    'hotelName': '"hotelName"',
+    'city_id': 'city_id',
+    'city_name': 'city_name',
+    'positionName': '"positionName"',
+    'price': 'price',
+    'roomType': '"roomType"',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+}
+
+
+class HotelRow(NamedTuple):
+    """One row of the `hotels` table. Columns that were not selected stay None."""
+    hotel_id: int
+    hotelName: Optional[str] = None
+    city_id: Optional[int] = None
+    city_name: Optional[str] = None
+    positionName: Optional[str] = None
+    price: Optional[Decimal] = None
+    roomType: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    neighbourhood: Optional[str] = None  # Not a column: filled from properties.geo by --geo-context
+
+
+def project(*column_sets):
+    """Union of the columns needed by each stage, in table order, always led by hotel_id."""
+    wanted = {'hotel_id'}
+    for columns in column_sets:
+        wanted.update(columns)
+    unknown = wanted - HOTEL_COLUMNS.keys()
+    if unknown:
+        raise ValueError(f"Unknown hotel columns: {', '.join(sorted(unknown))}")
+    return tuple(name for name in HOTEL_COLUMNS if name in wanted)
+
+
+def select_hotels_sql(columns, filter_ids=False, limit=False):
+    sql = 'SELECT {} FROM hotels'.format(', '.join(HOTEL_COLUMNS[name] for name in columns))
+    if filter_ids:
+        sql += ' WHERE hotel_id = ANY(%s)'
+    if limit:
+        sql += ' LIMIT %s'
+    return sql
+
+
+def row_factory(columns):
+    """Build a converter from a projected DB tuple to a HotelRow."""
+    if columns == tuple(HOTEL_COLUMNS):
+        return lambda values: HotelRow(*values)
+    positions = [columns.index(name) if name in columns else None for name in HOTEL_COLUMNS]
+
+    def make(values):
+        return HotelRow(*[None if i is None else values[i] for i in positions])
+    return make
+
+
+def fetch_hotels(cursor, columns, hotel_ids=None, limit=None):
+    """Select only `columns` from hotels (optionally just `hotel_ids`) as HotelRow records."""
+    params = []
+    if hotel_ids is not None:
+        params.append(list(hotel_ids))
+    if limit is not None:
+        params.append(limit)
+    cursor.execute(select_hotels_sql(columns, hotel_ids is not None, limit is not None), params)
+    make = row_factory(columns)
+    return [make(values) for values in cursor.fetchall()]
+
+
+def stream_hotels(cursor, columns, chunk_size, hotel_ids=None, ordered=False):
+    """Yield `columns` of hotels as plain tuples, fetched `chunk_size` rows per round trip.
+
+    Pass a server-side cursor (connection.chunked_cursor()), so the scraper table is
+    streamed rather than fetched whole.
+    """
+    sql = select_hotels_sql(columns, hotel_ids is not None)
+    if ordered:
+        sql += ' ORDER BY hotel_id'
+    cursor.execute(sql, [list(hotel_ids)] if hotel_ids is not None else None)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def count_hotels(cursor, hotel_ids=None):
+    if hotel_ids is not None:
+        cursor.execute('SELECT count(*) FROM hotels WHERE hotel_id = ANY(%s)', [list(hotel_ids)])
+    else:
+        cursor.execute('SELECT count(*) FROM hotels')
+    return cursor.fetchone()[0]
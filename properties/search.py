@@ -0,0 +1,60 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, OuterRef, Subquery
+from properties.models import Property, PropertySummary
+
+SEARCH_CONFIG = 'english'
+
+# Weights: rewritten title A, original title B, description C, summary D
+REFRESH_SQL = """
+    UPDATE {table} AS p
+    SET search_vector =
+        setweight(to_tsvector(%(config)s, coalesce(p.rewritten_title, '')), 'A') ||
+        setweight(to_tsvector(%(config)s, coalesce(p.original_title, '')), 'B') ||
+        setweight(to_tsvector(%(config)s, coalesce(p.description, '')), 'C') ||
+        setweight(to_tsvector(%(config)s, coalesce(
+            (SELECT s.summary FROM {summary_table} AS s WHERE s.property_id = p.original_id), ''
+        )), 'D')
+    WHERE {condition}
+"""
+
+
+def refresh_search_vectors(original_ids=None):
+    """Recompute search_vector for the given hotels, or for every row marked stale (NULL).
+
+    The sinks call this for the hotels they just wrote, so the index follows the
+    pipeline one batch at a time. Returns the number of rows refreshed.
+    """
+    if original_ids is not None:
+        original_ids = list(original_ids)
+        if not original_ids:
+            return 0
+        condition = 'p.original_id = ANY(%(ids)s)'
+    else:
+        condition = 'p.search_vector IS NULL'
+
+    sql = REFRESH_SQL.format(
+        table=Property._meta.db_table,
+        summary_table=PropertySummary._meta.db_table,
+        condition=condition,
+    )
+    with connections['default'].cursor() as cursor:
+        cursor.execute(sql, {'config': SEARCH_CONFIG, 'ids': original_ids})
+        return cursor.rowcount
+
+
+def search_query(text):
+    # websearch syntax: quoted phrases, "or", and -excluded words
+    return SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+
+
+def search_properties(text, limit=20):
+    """Return the best matching properties, annotated with rank and summary."""
+    query = search_query(text)
+    summaries = PropertySummary.objects.filter(property_id=OuterRef('original_id')).values('summary')[:1]
+    return (
+        Property.objects
+        .filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query), summary=Subquery(summaries))
+        .order_by('-rank', 'original_id')[:limit]
+    )
@@ -0,0 +1,173 @@
+from django.db import connections, transaction
+from psycopg2.extras import execute_values
+from properties.cards import refresh_hotel_cards
+from properties.changefeed import SKIP_CHANGEFEED_SQL
+from properties.models import Property, PropertySummary, PropertyRatingReview
+from properties.search import refresh_search_vectors
+
+
+class Sink:
+    """Buffers finished hotels and writes them in one batch per flush()."""
+
+    name = None
+    requires = ()  # Stages whose results this sink writes; all must have succeeded
+    accepts_provisional = False  # Whether template fallbacks may stand in for those results
+    overwrites_source = False  # Replaces scraped values that only the rewrite history keeps a copy of
+
+    def __init__(self, stdout, style):
+        self.stdout = stdout
+        self.style = style
+        self.pending = []
+        self.written = 0
+
+    def prepare(self):
+        """Hook run once before the first hotel is written."""
+
+    def add(self, hotel, results):
+        self.pending.append((hotel, results))
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        self.write(pending)
+
+    def discard(self):
+        """Drop the buffered hotels without writing them; returns how many there were."""
+        pending, self.pending = self.pending, []
+        return len(pending)
+
+    def write(self, items):
+        raise NotImplementedError
+
+
+class HotelsTableSink(Sink):
+    """Overwrites "hotelName" and description in the scraper's hotels table."""
+
+    name = 'hotels'
+    requires = ('title', 'description')
+    overwrites_source = True  # "hotelName" is only recoverable from RewriteHistory
+
+    def prepare(self):
+        # Ensure 'description' column exists in the 'hotels' table
+        with connections['trip'].cursor() as cursor:
+            try:
+                cursor.execute("""
+                    DO $$
+                    BEGIN
+                        IF NOT EXISTS (
+                            SELECT 1
+                            FROM information_schema.columns
+                            WHERE table_name = 'hotels'
+                              AND column_name = 'description'
+                        ) THEN
+                            ALTER TABLE hotels ADD COLUMN description TEXT;
+                        END IF;
+                    END $$;
+                """)
+                self.stdout.write(self.style.SUCCESS("Verified or added 'description' column in the 'hotels' table."))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"Error ensuring 'description' column: {str(e)}"))
+
+    def write(self, items):
+        rows = [(hotel.hotel_id, results['title'], results['description']) for hotel, results in items]
+
+        # Our own rewrite must not show up in the hotels change feed again
+        with transaction.atomic(using='trip'), connections['trip'].cursor() as cursor:
+            cursor.execute(SKIP_CHANGEFEED_SQL)
+            execute_values(cursor.cursor, """
+                UPDATE hotels AS h
+                SET "hotelName" = v.title, description = v.description
+                FROM (VALUES %s) AS v (hotel_id, title, description)
+                WHERE h.hotel_id = v.hotel_id
+            """, rows)
+
+        for hotel_id, title, description in rows:
+            self.stdout.write(self.style.SUCCESS(
+                f"Updated: Original ID {hotel_id}, Rewritten Title: {title}, Description: {description}"
+            ))
+        self.written += len(rows)
+
+
+class PropertySink(Sink):
+    """Fills rewritten_title/description of existing rewrite_property_info rows."""
+
+    name = 'property'
+    requires = ('title', 'description')
+    accepts_provisional = True  # Flagged, and regenerated by rewrite_property_info --provisional
+
+    def write(self, items):
+        by_id = {hotel.hotel_id: results for hotel, results in items}
+        properties = list(Property.objects.filter(original_id__in=by_id))
+        for property_instance in properties:
+            results = by_id[property_instance.original_id]
+            property_instance.rewritten_title = results['title']
+            property_instance.description = results['description']
+            property_instance.provisional = bool(set(self.requires) & results.get('provisional', set()))
+        Property.objects.bulk_update(properties, ['rewritten_title', 'description', 'provisional'])
+
+        found = {property_instance.original_id for property_instance in properties}
+        refresh_search_vectors(found)
+        refresh_hotel_cards(found)
+        for hotel_id, results in by_id.items():
+            if hotel_id in found:
+                style, action = self.style.SUCCESS, "Updated"
+                if results.get('provisional'):
+                    style, action = self.style.WARNING, "Updated with provisional template text"
+                self.stdout.write(style(
+                    f"{action}: Original ID {hotel_id}\nRewritten: {results['title']}\nDescription: {results['description']}\n"
+                ))
+                self.written += 1
+            else:
+                self.stdout.write(self.style.WARNING(f"No existing record for Original ID {hotel_id}. Skipping update."))
+
+
+class PropertySummarySink(Sink):
+    name = 'property_summary'
+    requires = ('summary',)
+
+    def write(self, items):
+        PropertySummary.objects.bulk_create(
+            [PropertySummary(property_id=hotel.hotel_id, summary=results['summary']) for hotel, results in items],
+            update_conflicts=True,
+            unique_fields=['property_id'],
+            update_fields=['summary'],
+        )
+        refresh_search_vectors(hotel.hotel_id for hotel, _ in items)
+        refresh_hotel_cards(hotel.hotel_id for hotel, _ in items)
+        for hotel, _ in items:
+            self.stdout.write(self.style.SUCCESS(f"Property ID {hotel.hotel_id} - Summary generated and saved."))
+        self.written += len(items)
+
+
+class PropertyRatingReviewSink(Sink):
+    name = 'property_rating_review'
+    requires = ('rating_review',)
+
+    def write(self, items):
+        PropertyRatingReview.objects.bulk_create(
+            [
+                PropertyRatingReview(property_id=hotel.hotel_id, rating=rating, review=review)
+                for hotel, results in items
+                for rating, review in [results['rating_review']]
+            ],
+            update_conflicts=True,
+            unique_fields=['property_id'],
+            update_fields=['rating', 'review'],
+        )
+        refresh_hotel_cards(hotel.hotel_id for hotel, _ in items)
+        for hotel, _ in items:
+            self.stdout.write(self.style.SUCCESS(f"Property ID {hotel.hotel_id} - Rating/Review generated and saved."))
+        self.written += len(items)
+
+
+# Registry used by run_pipeline --sinks
+SINKS = {sink.name: sink for sink in (HotelsTableSink, PropertySink, PropertySummarySink, PropertyRatingReviewSink)}
+
+# Where each stage is written when --sinks is not given
+DEFAULT_SINKS = {
+    'title': 'property',
+    'description': 'property',
+    'summary': 'property_summary',
+    'rating_review': 'property_rating_review',
+}
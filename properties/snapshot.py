@@ -0,0 +1,267 @@
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from properties.rows import HOTEL_COLUMNS, row_factory
+
+MAGIC = b'HOTELSNAP1\n'
+ALIGN = 8
+
+# How each hotels column is laid out: fixed-width arrays are read in place through
+# memoryview.cast; text (and price, kept exact as text) is an offsets array plus UTF-8 bytes
+COLUMN_TYPES = {
+    'hotel_id': 'q',
+    'hotelName': 'text',
+    'city_id': 'q',
+    'city_name': 'text',
+    'positionName': 'text',
+    'price': 'decimal',
+    'roomType': 'text',
+    'latitude': 'd',
+    'longitude': 'd',
+}
+
+
+class SnapshotError(Exception):
+    """The snapshot file is missing, unreadable or lacks a needed column."""
+
+
+def aligned(size):
+    return -size % ALIGN
+
+
+class ColumnWriter:
+    def __init__(self, kind):
+        self.kind = kind
+        self.nulls = bytearray()  # One byte per row; only stored if some value is NULL
+        if kind in ('q', 'd'):
+            self.values = array(kind)
+        else:
+            self.offsets = array('q', [0])
+            self.data = bytearray()
+
+    def append(self, value):
+        self.nulls.append(value is None)
+        if self.kind == 'q':
+            self.values.append(0 if value is None else int(value))
+        elif self.kind == 'd':
+            self.values.append(math.nan if value is None else float(value))
+        else:
+            if value is not None:
+                self.data += str(value).encode()
+            self.offsets.append(len(self.data))
+
+    def blocks(self):
+        """(name, bytes) of the column's regions, native arrays converted to little-endian."""
+        if self.kind in ('q', 'd'):
+            arrays = [('values', self.values)]
+        else:
+            arrays = [('offsets', self.offsets)]
+        blocks = []
+        for name, values in arrays:
+            if sys.byteorder != 'little':
+                values = array(values.typecode, values)
+                values.byteswap()
+            blocks.append((name, values.tobytes()))
+        if self.kind not in ('q', 'd'):
+            blocks.append(('data', bytes(self.data)))
+        if any(self.nulls):
+            blocks.append(('nulls', bytes(self.nulls)))
+        return blocks
+
+
+def write_snapshot(path, columns, rows):
+    """Write `rows` (tuples in `columns` order) to `path`; returns the number of rows.
+
+    Layout: MAGIC, an 8-byte header length, a JSON header locating every column's
+    regions, then the regions, each aligned to 8 bytes. The file is written next to
+    `path` and renamed into place, so readers never see a partial snapshot.
+    """
+    unknown = [name for name in columns if name not in COLUMN_TYPES]
+    if unknown:
+        raise SnapshotError(f"Unknown hotel columns: {', '.join(unknown)}")
+    writers = [ColumnWriter(COLUMN_TYPES[name]) for name in columns]
+    count = 0
+    for row in rows:
+        for writer, value in zip(writers, row):
+            writer.append(value)
+        count += 1
+
+    layout, regions, position = {}, [], 0
+    for name, writer in zip(columns, writers):
+        layout[name] = {'type': writer.kind}
+        for block, data in writer.blocks():
+            layout[name][block] = [position, len(data)]
+            regions.append(data + b'\0' * aligned(len(data)))
+            position += len(data) + aligned(len(data))
+
+    header = json.dumps({
+        'rows': count,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'columns': layout,
+    }).encode()
+    header += b' ' * aligned(len(MAGIC) + 8 + len(header))
+
+    tmp = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp, 'wb') as output:
+        output.write(MAGIC + struct.pack('<q', len(header)) + header)
+        for data in regions:
+            output.write(data)
+    os.replace(tmp, path)
+    return count
+
+
+class TextColumn:
+    """Sequence view of a text column; values are decoded only when read."""
+
+    def __init__(self, offsets, data, nulls, convert=None):
+        self.offsets = offsets
+        self.data = data
+        self.nulls = nulls
+        self.convert = convert
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        if self.nulls is not None and self.nulls[row]:
+            return None
+        value = str(self.data[self.offsets[row]:self.offsets[row + 1]], 'utf-8')
+        return self.convert(value) if self.convert else value
+
+
+class NumberColumn:
+    def __init__(self, values, nulls):
+        self.values = values
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, row):
+        if self.nulls is not None and self.nulls[row]:
+            return None
+        return self.values[row]
+
+
+class HotelSnapshot:
+    """Read-only, memory-mapped view of a snapshot_hotels file.
+
+    Columns are views into the mapping rather than copies: only the pages of the
+    columns and rows a run actually reads are loaded from disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if sys.byteorder != 'little':
+            raise SnapshotError("Hotels snapshots are little-endian and can only be read in place on such hosts.")
+        try:
+            self._file = open(path, 'rb')
+        except OSError as e:
+            raise SnapshotError(f"Cannot open hotels snapshot {path}: {e.strerror}")
+        # Sizes are checked before anything is read: an empty file cannot be mapped at all,
+        # and the regions of a truncated one would silently come out short
+        size = os.fstat(self._file.fileno()).st_size
+        start = len(MAGIC) + 8
+        if size < start:
+            self._file.close()
+            raise SnapshotError(f"Hotels snapshot {path} is empty or truncated; take a new one.")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []  # Every memoryview into the mapping, released by close()
+        self._columns = {}
+        self._index = None
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise SnapshotError(f"{path} is not a hotels snapshot.")
+        (header_length,) = struct.unpack_from('<q', self._map, len(MAGIC))
+        try:
+            if not 0 <= header_length <= size - start:
+                raise ValueError
+            header = json.loads(self._map[start:start + header_length])
+            regions = [region for layout in header['columns'].values()
+                       for block, region in layout.items() if block != 'type']
+            end = start + header_length + max((offset + length for offset, length in regions), default=0)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            end = None
+        if end is None or end > size:
+            self.close()
+            raise SnapshotError(f"Hotels snapshot {path} is empty or truncated; take a new one.")
+        self.rows = header['rows']
+        self.created_at = header['created_at']
+        self._layout = header['columns']
+        self._base = start + header_length
+
+    @property
+    def columns(self):
+        return tuple(name for name in HOTEL_COLUMNS if name in self._layout)
+
+    def _view(self, view):
+        self._views.append(view)
+        return view
+
+    def _region(self, column, block, typecode=None):
+        offset, length = self._layout[column][block]
+        start = self._base + offset
+        region = self._view(memoryview(self._map)[start:start + length])
+        return self._view(region.cast(typecode)) if typecode else region
+
+    def column(self, name):
+        if name not in self._columns:
+            if name not in self._layout:
+                raise SnapshotError(f"Snapshot {self.path} has no {name} column; take a new one.")
+            kind = self._layout[name]['type']
+            nulls = self._region(name, 'nulls') if 'nulls' in self._layout[name] else None
+            if kind in ('q', 'd'):
+                # Cast in place: reading a value touches only its page of the file
+                self._columns[name] = NumberColumn(self._region(name, 'values', kind), nulls)
+            else:
+                self._columns[name] = TextColumn(
+                    self._region(name, 'offsets', 'q'), self._region(name, 'data'), nulls,
+                    Decimal if kind == 'decimal' else None,
+                )
+        return self._columns[name]
+
+    def positions(self, hotel_ids=None):
+        if hotel_ids is None:
+            return range(self.rows)
+        if self._index is None:
+            self._index = {hotel_id: row for row, hotel_id in enumerate(self.column('hotel_id').values)}
+        return [self._index[hotel_id] for hotel_id in hotel_ids if hotel_id in self._index]
+
+    def fetch(self, columns, hotel_ids=None, limit=None):
+        """Like rows.fetch_hotels, for the snapshot: `columns` as HotelRow records."""
+        missing = [name for name in columns if name not in self._layout]
+        if missing:
+            raise SnapshotError(f"Snapshot {self.path} lacks columns {', '.join(missing)}; take a new one.")
+        views = [self.column(name) for name in columns]
+        positions = self.positions(hotel_ids)
+        if limit is not None:
+            positions = positions[:limit]
+        make = row_factory(tuple(columns))
+        return [make([view[row] for view in views]) for row in positions]
+
+    def count(self, hotel_ids=None):
+        return len(self.positions(hotel_ids))
+
+    def close(self):
+        # The mapping cannot be closed while views into it exist
+        self._columns = {}
+        self._index = None
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,270 @@
+import hashlib
+import inspect
+import json
+import re
+from functools import cached_property
+
+from properties.fallback import template_description, template_title
+
+
+class InvalidOutput(Exception):
+    """The model answered, but not with something we can store."""
+
+
+class Stage:
+    """One generated field: how to prompt for it and how to read the answer."""
+
+    name = None
+    label = None  # Used in "Skipping ID ... due to invalid <label>." messages
+    columns = ()  # HotelRow columns the prompt reads
+    fallback_columns = ()  # Extra columns fallback() reads
+    system = ''
+    # Checked by properties.validation before anything is written
+    max_length = None  # Characters
+    max_paragraphs = None
+    strict = ''  # Added to the prompt when an answer is rejected and regenerated
+
+    def prompt(self, hotel):
+        raise NotImplementedError
+
+    def payload(self, hotel, model, notes=()):
+        # `notes` say why earlier answers were rejected; the changed prompt also keeps
+        # the client from handing back its coalesced earlier answer
+        prompt = self.prompt(hotel)
+        for note in notes:
+            prompt += f"\n                    {note}"
+        return {
+            "model": model,
+            "prompt": prompt,
+            "system": self.system,
+            "stream": False
+        }
+
+    def parse(self, text):
+        text = text.strip()
+        if not text:
+            raise InvalidOutput(f"Empty {self.label} in API response.")
+        return text
+
+    def texts(self, value):
+        """The generated text in a parsed value, for validation."""
+        return [value]
+
+    def check(self, value):
+        """Stage-specific validation of a parsed value: why it is unusable, or None."""
+        return None
+
+    def finalize(self, value, hotel, results):
+        """Adjust a parsed value once every stage of the hotel has finished."""
+        return value
+
+    def fallback(self, hotel):
+        """A deterministic stand-in for when generation fails, or None if the stage has none."""
+        return None
+
+    def neighbourhood(self, hotel):
+        # Location facts precomputed by --geo-context, so the model does not invent them
+        if not hotel.neighbourhood:
+            return ''
+        return f"\n                Neighbourhood (use only these location facts): {hotel.neighbourhood}"
+
+    @cached_property
+    def prompt_version(self):
+        """Short hash of everything that shapes this stage's prompts; changes when they are edited."""
+        source = [self.system, self.batch_system or '', self.batch_instructions or '', inspect.getsource(type(self).prompt)]
+        return hashlib.sha1('\n'.join(source).encode()).hexdigest()[:12]
+
+    def prefix_key(self, hotel):
+        """Hotels with equal keys are sent back to back.
+
+        Prompts name the city and nearby location before the hotel, so consecutive
+        prompts of one city (and location) share everything up to the hotel's name.
+        """
+        return (hotel.city_name or '', hotel.positionName or '')
+
+    # Multi-hotel prompts (run_pipeline --prompt-batch). Stages that support them set
+    # batch_system/batch_instructions and implement batch_line() and batch_item().
+    batch_system = None
+    batch_instructions = None
+
+    @property
+    def batchable(self):
+        return self.batch_system is not None
+
+    def batch_line(self, hotel):
+        raise NotImplementedError
+
+    def batch_item(self, item):
+        """Turn one JSON item of a batched answer into the text parse() expects."""
+        raise NotImplementedError
+
+    def batch_payload(self, hotels, model):
+        lines = '\n'.join(f"- id {hotel.hotel_id}: {self.batch_line(hotel)}" for hotel in hotels)
+        return {
+            "model": model,
+            "prompt": f"{self.batch_instructions}\n{lines}",
+            "system": self.batch_system,
+            "format": "json",
+            "stream": False
+        }
+
+    def split_batch(self, text, hotels):
+        """Map hotel_id -> raw text for every usable item of a batched answer."""
+        try:
+            items = json.loads(text).get('hotels')
+        except (ValueError, AttributeError):
+            raise InvalidOutput(f"Invalid batched {self.label} response: {text[:200]}")
+        if not isinstance(items, list):
+            raise InvalidOutput(f"Invalid batched {self.label} response: {text[:200]}")
+
+        wanted = {hotel.hotel_id for hotel in hotels}
+        found = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            try:
+                hotel_id = int(item.get('id'))
+                raw = self.batch_item(item)
+            except (TypeError, ValueError, KeyError):
+                continue
+            if hotel_id in wanted and hotel_id not in found:
+                found[hotel_id] = raw
+        return found
+
+
+class TitleStage(Stage):
+    name = 'title'
+    label = 'rewritten title'
+    columns = ('hotelName', 'city_name', 'positionName')
+    system = ("You are a hotel branding expert. Respond only with the new hotel name without any extra descriptions "
+              "or puzzle explanations.  Do not include unrelated examples, comparisons, or extra content.")
+    unwanted_prefixes = ["New hotel name:", "TITLE:", "Rewritten:"]
+    max_length = 80
+    strict = "Answer with only the new hotel name, in English, on one line and without any explanation."
+
+    def prompt(self, hotel):
+        return f"""Change this hotel name into something new and unique:
+                    City: {hotel.city_name}
+                    Nearby Location: {hotel.positionName}
+                    Original hotel: {hotel.hotelName}"""
+
+    batch_system = ("You are a hotel branding expert. Respond only with JSON, without any extra descriptions "
+                    "or puzzle explanations.")
+    batch_instructions = ("Change each hotel name below into something new and unique. Respond with "
+                          '{"hotels": [{"id": <id>, "name": "<new hotel name>"}]}, one entry per hotel.')
+
+    def batch_line(self, hotel):
+        return f"City: {hotel.city_name}; Nearby Location: {hotel.positionName}; Original hotel: {hotel.hotelName}"
+
+    def batch_item(self, item):
+        name = item['name']
+        # str() would turn null or a number into a title; such hotels get a single-hotel call instead
+        if not isinstance(name, str):
+            raise TypeError(f"name is {type(name).__name__}, not a string")
+        if not name.strip():
+            raise ValueError("name is blank")
+        return name
+
+    def parse(self, text):
+        text = text.strip().split('\n')[0]  # Use only the first line
+
+        # Remove unwanted prefixes like "New hotel name:" or similar
+        for prefix in self.unwanted_prefixes:
+            if text.lower().startswith(prefix.lower()):
+                text = text[len(prefix):].strip()
+        return super().parse(text)
+
+    def fallback(self, hotel):
+        return template_title(hotel)
+
+
+class DescriptionStage(Stage):
+    name = 'description'
+    label = 'description'
+    columns = ('hotelName', 'city_name', 'positionName')
+    fallback_columns = ('price', 'roomType')
+    system = "You are a hotel description expert. Respond with a concise, 20-word description."
+    max_length = 400
+    max_paragraphs = 1
+    strict = "Answer with only the description: one English sentence of about 20 words, nothing else."
+
+    # The prompt uses the original name so the description does not have to wait for the
+    # title; the name is swapped for the rewritten title afterwards.
+    def prompt(self, hotel):
+        return f"""Write a concise, 20-word description for a hotel in {hotel.city_name}, near {hotel.positionName}: '{hotel.hotelName}'.
+                Include key details like amenities, price, and location. Do not include unrelated examples, comparisons, or extra content.{self.neighbourhood(hotel)}"""
+
+    def finalize(self, value, hotel, results):
+        if 'title' in results and hotel.hotelName:
+            return value.replace(hotel.hotelName, results['title'])
+        return value
+
+    def fallback(self, hotel):
+        return template_description(hotel)
+
+
+class SummaryStage(Stage):
+    name = 'summary'
+    label = 'summary'
+    columns = ('hotelName', 'city_name', 'positionName', 'price', 'roomType', 'latitude', 'longitude')
+    system = "You are a hotel summary expert. Respond with a concise summary."
+    max_length = 1200
+    max_paragraphs = 3
+    strict = "Answer with only the summary: one short English paragraph, nothing else."
+
+    def prompt(self, hotel):
+        return f"""Write a concise summary for a hotel located in {hotel.city_name}.
+                    Nearby Location: {hotel.positionName}.
+                    Hotel: '{hotel.hotelName}'.
+                    Room Type: {hotel.roomType if hotel.roomType else 'N/A'}, Price: {hotel.price if hotel.price else 'N/A'},
+                    Latitude: {hotel.latitude if hotel.latitude else 'N/A'}, Longitude: {hotel.longitude if hotel.longitude else 'N/A'}.{self.neighbourhood(hotel)}"""
+
+
+class RatingReviewStage(Stage):
+    name = 'rating_review'
+    label = 'rating/review'
+    columns = ('hotelName', 'city_name', 'positionName')
+    system = "You are a hotel review expert. Provide a rating and review."
+    max_length = 600  # Of the review
+    max_paragraphs = 1
+    strict = "Answer exactly as '<rating>/5 <review>': a rating from 1 to 5, then a 30-word English review."
+
+    def prompt(self, hotel):
+        return f"""Generate a rating and review 30-word for a hotel located in {hotel.city_name}.
+                    Nearby Location: {hotel.positionName}. Hotel: '{hotel.hotelName}'. The review should be positive and professional. Do not include unrelated examples, Question Answer or extra content."""
+
+    batch_system = "You are a hotel review expert. Respond only with JSON."
+    batch_instructions = ("Generate a rating out of 5 and a positive, professional 30-word review for each hotel "
+                          'below. Respond with {"hotels": [{"id": <id>, "rating": <rating>, "review": "<review>"}]}, '
+                          "one entry per hotel. Do not include unrelated examples, Question Answer or extra content.")
+
+    def batch_line(self, hotel):
+        return f"located in {hotel.city_name}, near {hotel.positionName}: '{hotel.hotelName}'"
+
+    def batch_item(self, item):
+        return f"{float(item['rating'])}/5 {item['review']}"
+
+    def parse(self, text):
+        text = text.strip()
+
+        # Look for 'Rating: 4.5/5 stars' or '4.5 stars' style formats; the review follows the rating
+        match = re.search(r'(\d+(\.\d+)?)(/5| stars)?(.*)', text)
+        if not match:
+            raise InvalidOutput(f"Invalid rating format: {text}")
+
+        rating, review = float(match.group(1)), match.group(4).strip()
+        if not rating or not review:
+            raise InvalidOutput(f"Invalid review format: {text}")
+        return rating, review
+
+    def texts(self, value):
+        return [value[1]]
+
+    def check(self, value):
+        if not 1 <= value[0] <= 5:
+            return f"rating {value[0]:g} is not between 1 and 5"
+        return None
+
+
+# Registry used by run_pipeline --stages
+STAGES = {stage.name: stage for stage in (TitleStage, DescriptionStage, SummaryStage, RatingReviewStage)}
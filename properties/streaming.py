@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+from collections import Counter
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from properties.cards import refresh_hotel_cards
+from properties.fallback import TEMPLATE_MODEL
+from properties.history import RewriteHistory
+from properties.models import Property
+from properties.ollama import OLLAMA_URL, OllamaError
+from properties.routing import ModelRouter
+from properties.rows import fetch_hotels, project
+from properties.search import refresh_search_vectors
+from properties.stages import DescriptionStage, InvalidOutput, TitleStage
+from properties.uniqueness import load_title_index
+from properties.validation import Validator, check_answer
+
+# The on-demand rewrite produces what rewrite_property_info does
+STREAM_STAGES = (TitleStage, DescriptionStage)
+
+
+class Broadcast:
+    """Events of one in-flight rewrite, replayed in full to every client that joins it."""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.changed = asyncio.Condition()
+        self.task = None
+
+    async def publish(self, event, final=False):
+        async with self.changed:
+            self.events.append(event)
+            self.done = self.done or final
+            self.changed.notify_all()
+
+    async def subscribe(self):
+        index = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: index < len(self.events) or self.done)
+                events, index, done = self.events[index:], len(self.events), self.done
+            for event in events:
+                yield event
+            if done:
+                return
+
+
+# hotel_id -> Broadcast of the rewrite running for it. Coalescing relies on one event
+# loop per process, i.e. serving through ASGI (daphne/uvicorn), not WSGI.
+_inflight = {}
+
+
+def make_client():
+    return httpx.AsyncClient(timeout=None)
+
+
+def load_hotel(hotel_id):
+    columns = project(*(stage.columns + stage.fallback_columns for stage in STREAM_STAGES))
+    with connections['trip'].cursor() as cursor:
+        rows = fetch_hotels(cursor, columns, [hotel_id])
+    # Cache keys and prompts follow the scraped name, not one a batch run wrote back
+    rows = RewriteHistory().restore_originals(rows)
+    return rows[0] if rows else None
+
+
+def cache_key(hotel, models):
+    # Edits to the listing or a model change make the cached rewrite stale
+    source = json.dumps([hotel.hotelName, hotel.city_name, hotel.positionName, models])
+    return f"rewrite:{hotel.hotel_id}:{hashlib.sha1(source.encode()).hexdigest()}"
+
+
+def save_rewrite(hotel, results, models, stages, provisional=False):
+    updated = Property.objects.filter(original_id=hotel.hotel_id).update(
+        rewritten_title=results['title'], description=results['description'], provisional=provisional,
+    )
+    if not updated:
+        Property.objects.create(
+            original_id=hotel.hotel_id, original_title=hotel.hotelName or 'Unknown',
+            rewritten_title=results['title'], description=results['description'], provisional=provisional,
+        )
+    refresh_search_vectors([hotel.hotel_id])
+    refresh_hotel_cards([hotel.hotel_id])
+
+    history = RewriteHistory()
+    history.add_results(hotel, results, models, stages)
+    history.flush()
+
+
+def build_checks(hotel):
+    """The Validator and TitleIndex the batch commands would apply, from the same settings."""
+    validator = None
+    if settings.VALIDATE_OUTPUT:
+        validator = Validator(settings.VALIDATION_BANNED_PHRASES, settings.VALIDATION_MIN_LATIN,
+                              settings.VALIDATION_RETRIES)
+    titles = None
+    if settings.UNIQUE_TITLES != 'off':
+        titles = load_title_index(hotel, settings.UNIQUE_TITLES, settings.TITLE_UNIQUENESS_RETRIES)
+    return validator, titles
+
+
+async def generate_stage(client, stage, hotel, model, broadcast, validator, titles):
+    """Stream a stage until its answer passes the checks; InvalidOutput once the retries run out."""
+    notes = []
+    rejections = Counter()  # kind -> answers rejected for it, each held to its own retry setting
+    while True:
+        value = await stream_stage(client, stage, hotel, model, broadcast, notes)
+        rejection = check_answer(stage, hotel, value, validator, titles)
+        if rejection is None:
+            return value
+        # Clients drop the tokens streamed so far for this stage; a regeneration follows
+        await broadcast.publish({'event': 'rejected', 'stage': stage.name, 'reason': rejection.message})
+        notes.append(rejection.note)
+        rejections[rejection.kind] += 1
+        if rejections[rejection.kind] > rejection.retries:
+            raise InvalidOutput(rejection.message)
+
+
+async def stream_stage(client, stage, hotel, model, broadcast, notes=()):
+    """Generate one stage, publishing every token as it arrives; returns the parsed value."""
+    payload = dict(stage.payload(hotel, model, notes), stream=True)
+    parts = []
+    async with client.stream('POST', OLLAMA_URL, json=payload) as response:
+        if response.status_code != 200:
+            raise OllamaError(f"Ollama API error: {(await response.aread()).decode(errors='replace')}")
+        # Ollama streams one JSON object per line
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get('error'):
+                raise OllamaError(f"Ollama API error: {data['error']}")
+            if data.get('response'):
+                parts.append(data['response'])
+                await broadcast.publish({'event': 'token', 'stage': stage.name, 'text': data['response']})
+            if data.get('done'):
+                break
+    return stage.parse(''.join(parts))
+
+
+async def publish_fallback(hotel, stages, reason, broadcast):
+    # Degraded: answer with template text now. It is saved as provisional and not cached,
+    # so the next request or watch_hotels regenerates it.
+    results = {stage.name: stage.fallback(hotel) for stage in stages}
+    try:
+        await sync_to_async(save_rewrite)(hotel, results, {name: TEMPLATE_MODEL for name in results}, stages,
+                                          provisional=True)
+    except Exception as e:
+        await broadcast.publish({'event': 'error', 'message': f"Error rewriting hotel {hotel.hotel_id}: {str(e)}"},
+                                final=True)
+        return
+    await broadcast.publish({'event': 'done', 'cached': False, 'provisional': True, 'reason': reason, **results},
+                            final=True)
+
+
+async def run_rewrite(hotel, key, models, broadcast):
+    stages = [stage() for stage in STREAM_STAGES]
+    try:
+        validator, titles = await sync_to_async(build_checks)(hotel)
+        async with make_client() as client:
+            # Both stages start at once; the title's first token is not held up by anything
+            tasks = [asyncio.ensure_future(generate_stage(client, stage, hotel, models[stage.name], broadcast,
+                                                          validator, titles))
+                     for stage in stages]
+            try:
+                values = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        results = {stage.name: value for stage, value in zip(stages, values)}
+        for stage in stages:
+            results[stage.name] = stage.finalize(results[stage.name], hotel, results)
+        await sync_to_async(save_rewrite)(hotel, results, models, stages)
+        await cache.aset(key, results, settings.REWRITE_CACHE_SECONDS)
+        await broadcast.publish({'event': 'done', 'cached': False, **results}, final=True)
+    except (OllamaError, InvalidOutput, httpx.HTTPError, ValueError) as e:
+        if settings.TEMPLATE_FALLBACK:
+            await publish_fallback(hotel, stages, str(e), broadcast)
+        else:
+            await broadcast.publish({'event': 'error', 'message': str(e)}, final=True)
+    except Exception as e:
+        await broadcast.publish({'event': 'error', 'message': f"Error rewriting hotel {hotel.hotel_id}: {str(e)}"},
+                                final=True)
+    finally:
+        _inflight.pop(hotel.hotel_id, None)
+
+
+async def rewrite_events(hotel_id):
+    """Yield the events of an on-demand rewrite: tokens, then 'done' or 'error'.
+
+    A cached rewrite is answered at once. Otherwise the first request starts the
+    generation and later requests for the same hotel join it; the generation runs
+    to the end and is saved even if its clients disconnect.
+    """
+    hotel = await sync_to_async(load_hotel)(hotel_id)
+    if hotel is None:
+        yield {'event': 'error', 'message': f"Hotel {hotel_id} not found."}
+        return
+
+    router = ModelRouter.from_settings()
+    models = {stage.name: router.model_for(stage.name) for stage in STREAM_STAGES}
+    key = cache_key(hotel, models)
+    cached = await cache.aget(key)
+    if cached is not None:
+        yield {'event': 'done', 'cached': True, **cached}
+        return
+
+    broadcast = _inflight.get(hotel_id)
+    if broadcast is None:
+        broadcast = _inflight[hotel_id] = Broadcast()
+        broadcast.task = asyncio.ensure_future(run_rewrite(hotel, key, models, broadcast))
+    async for event in broadcast.subscribe():
+        yield event
@@ -1,12 +1,95 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
 from django.test import TransactionTestCase
-from django.db import connections
+from django.db import DatabaseError, connections
 from unittest.mock import patch, MagicMock
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from io import StringIO
-from properties.models import Property, PropertySummary, PropertyRatingReview, Hotel
+from properties.models import Property, PropertySummary, PropertyRatingReview, Hotel, ChangeFeedCursor
+from properties.models import ContentBlob, HotelCard, PipelineRun, RewriteVersion, StageUsage
+from properties.models import RewriteJob
+from properties.jobs import Heartbeat, claim_job, enqueue, progress
+from properties.cancellation import RunCancelled, RunControl
+from properties.uniqueness import TitleIndex
+from properties.validation import PhraseMatcher, Validator
+from properties.management.commands.run_pipeline import Command as RunPipelineCommand
+from django.contrib.auth.models import User
+from django.utils import timezone
+from properties.cards import refresh_hotel_cards
+from properties.history import RewriteHistory
+from properties.changefeed import ChangeFeed
+from properties.ollama import OllamaClient, SingleFlight, Usage
+from properties.planning import RunEstimate
+from properties.priority import PriorityScheduler
+from properties.snapshot import HotelSnapshot, SnapshotError, write_snapshot
+from properties.management.commands.watch_hotels import Command as WatchHotelsCommand
+from properties.routers import TripRouter
+from properties.routing import ModelRouter
+from properties.search import refresh_search_vectors, search_properties
+from properties.sinks import PropertyRatingReviewSink, PropertySink, PropertySummarySink
+from properties import streaming
+from properties.bulk import CopyStream, copy_line
+from properties.embeddings import DuplicateDetector, LocalEmbedder, VectorIndex
+from properties.geo import GeoIndex, Neighbourhoods, haversine_km
+from properties.pipeline import Pipeline
+from properties.stages import DescriptionStage, InvalidOutput, RatingReviewStage, SummaryStage, TitleStage
+from properties.rows import HotelRow, fetch_hotels, project, select_hotels_sql, stream_hotels
+import asyncio
+from importlib import import_module
+from datetime import datetime, timedelta
+from decimal import Decimal
+import pstats
+import tempfile
+from pathlib import Path
+import httpx
 import requests
 import json
+import threading
+import os
+import signal
+import time
+
+
+# Hotels as the scraper's `hotels` table returns them (no city_id), for the tests that mock the trip database
+TRIP_ROWS = [
+    (1, "Hotel Sunshine", "New York", "Central Park", 200, "Deluxe Room", 40.7128, -74.0060),
+    (2, "Park View", "New York", "Central Park", 180, "Double Room", 40.7681, -73.9819),
+    (3, "Ocean Breeze", "Miami", "South Beach", 300, "Suite", 25.7617, -80.1918),
+]
+
+
+class TripHotelsTestCase(TestCase):
+    """Mocked trip database and Ollama answers shared by the pipeline command tests."""
+
+    rows = TRIP_ROWS
+
+    def mock_trip_cursor(self, mock_connections, rows=None, batches=None, total=None):
+        """Serve `rows` (default self.rows) to every fetch, or one of `batches` per fetch."""
+        mock_cursor = MagicMock()
+        if batches is not None:
+            mock_cursor.fetchall.side_effect = batches
+        else:
+            mock_cursor.fetchall.return_value = self.rows if rows is None else rows
+        if total is not None:
+            mock_cursor.fetchone.return_value = (total,)
+        mock_connections["trip"].cursor.return_value.__enter__.return_value = mock_cursor
+        return mock_cursor
+
+    def mock_generate(self, url, json=None, **kwargs):
+        system = json["system"]
+        if "branding" in system:
+            text = "Sunrise Suites"
+        elif "description" in system:
+            text = "Hotel Sunshine offers bright rooms near Central Park."
+        elif "summary" in system:
+            text = "A bright hotel."
+        else:
+            text = "4.5/5 Lovely rooms."
+        return MagicMock(status_code=200, json=lambda: {
+            "response": text, "prompt_eval_count": 100, "eval_count": 20,
+            "total_duration": 2e9, "eval_duration": 1e9,
+        })
 
 
 class RewriteHotelsCommandTest(TransactionTestCase):
@@ -103,7 +186,7 @@ class RewriteHotelsCommandTest(TransactionTestCase):
 
         # Verify error handling - looking for both title and description error messages
         output = out.getvalue()
-        self.assertIn("Error generating title: Connection error", output)
+        self.assertIn("Request error: Connection error", output)
         
         # Verify no updates were made
         property = Property.objects.get(original_id=1)
@@ -378,7 +461,7 @@ class GeneratePropertyContentCommandTest(TestCase):
     def mock_error_response(self, url, **kwargs):
         return MagicMock(status_code=500, text="API Error")
 
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.ollama.requests.post")
     def test_command_successful_execution(self, mock_post):
         mock_post.side_effect = self.mock_success_response
 
@@ -396,7 +479,7 @@ class GeneratePropertyContentCommandTest(TestCase):
         self.assertEqual(review1.rating, 4.5)
         self.assertTrue(len(review1.review) > 0)
 
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.ollama.requests.post")
     def test_command_handles_api_error(self, mock_post):
         mock_post.side_effect = self.mock_error_response
 
@@ -407,7 +490,7 @@ class GeneratePropertyContentCommandTest(TestCase):
         self.assertEqual(PropertySummary.objects.count(), 0)
         self.assertEqual(PropertyRatingReview.objects.count(), 0)
 
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.ollama.requests.post")
     def test_command_handles_invalid_rating_response(self, mock_post):
         mock_post.side_effect = self.mock_invalid_rating_response
 
@@ -528,8 +611,9 @@ class TestGeneratePropertyCommand(TestCase):
     def setUp(self):
         # Test data
         self.test_properties = [
-            (1, "Hotel Sunshine", 101, "New York", "Central Park", 200, "Deluxe Room", 40.7128, -74.0060),
-            (2, "Ocean Breeze Resort", 102, "Miami", "South Beach", 300, "Suite", 25.7617, -80.1918),
+            # Projected columns: hotel_id, hotelName, city_name, positionName, price, roomType, latitude, longitude
+            (1, "Hotel Sunshine", "New York", "Central Park", 200, "Deluxe Room", 40.7128, -74.0060),
+            (2, "Ocean Breeze Resort", "Miami", "South Beach", 300, "Suite", 25.7617, -80.1918),
         ]
         
         # Success response for summary
@@ -572,8 +656,8 @@ class TestGeneratePropertyCommand(TestCase):
     def mock_request_exception(self, *args, **kwargs):
         raise requests.exceptions.RequestException("Connection error")
 
-    @patch("properties.management.commands.generate_property_info.connections")
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
     def test_successful_generation(self, mock_post, mock_connections):
         # Mock database cursor
         mock_cursor = MagicMock()
@@ -598,8 +682,8 @@ class TestGeneratePropertyCommand(TestCase):
         rating1 = PropertyRatingReview.objects.get(property_id=1)
         self.assertEqual(rating1.rating, 4.5)
 
-    @patch("properties.management.commands.generate_property_info.connections")
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
     def test_http_error_handling(self, mock_post, mock_connections):
         # Mock database cursor
         mock_cursor = MagicMock()
@@ -618,8 +702,8 @@ class TestGeneratePropertyCommand(TestCase):
         self.assertEqual(PropertySummary.objects.count(), 0)
         self.assertEqual(PropertyRatingReview.objects.count(), 0)
 
-    @patch("properties.management.commands.generate_property_info.connections")
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
     def test_json_decode_error(self, mock_post, mock_connections):
         # Mock database cursor
         mock_cursor = MagicMock()
@@ -637,8 +721,8 @@ class TestGeneratePropertyCommand(TestCase):
         self.assertIn("JSON decode error", out.getvalue())
         self.assertEqual(PropertySummary.objects.count(), 0)
 
-    @patch("properties.management.commands.generate_property_info.connections")
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
     def test_missing_response_field(self, mock_post, mock_connections):
         # Mock database cursor
         mock_cursor = MagicMock()
@@ -656,8 +740,8 @@ class TestGeneratePropertyCommand(TestCase):
         self.assertIn("No 'response' field in API response", out.getvalue())
         self.assertEqual(PropertySummary.objects.count(), 0)
 
-    @patch("properties.management.commands.generate_property_info.connections")
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
     def test_request_exception(self, mock_post, mock_connections):
         # Mock database cursor
         mock_cursor = MagicMock()
@@ -675,8 +759,8 @@ class TestGeneratePropertyCommand(TestCase):
         self.assertIn("Request error: Connection error", out.getvalue())
         self.assertEqual(PropertySummary.objects.count(), 0)
 
-    @patch("properties.management.commands.generate_property_info.connections")
-    @patch("properties.management.commands.generate_property_info.requests.post")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
     def test_invalid_rating_format(self, mock_post, mock_connections):
         # Mock database cursor
         mock_cursor = MagicMock()
@@ -703,3 +787,1470 @@ class TestGeneratePropertyCommand(TestCase):
         self.assertEqual(PropertySummary.objects.count(), 0)
         self.assertEqual(PropertyRatingReview.objects.count(), 0)
 
+
+
+class SingleFlightTest(SimpleTestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "shared"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do("key", slow)))
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=lambda: results.append(flight.do("key", slow)))
+        follower.start()
+        release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["shared", "shared"])
+
+    def test_completed_result_is_reused(self):
+        flight = SingleFlight()
+        fn = MagicMock(return_value="value")
+        self.assertEqual(flight.do("key", fn), "value")
+        self.assertEqual(flight.do("key", fn), "value")
+        fn.assert_called_once()
+
+    def test_failures_are_retried(self):
+        flight = SingleFlight()
+        fn = MagicMock(side_effect=[ValueError("boom"), "ok"])
+        with self.assertRaises(ValueError):
+            flight.do("key", fn)
+        self.assertEqual(flight.do("key", fn), "ok")
+
+    @patch("properties.ollama.requests.post")
+    def test_client_coalesces_identical_payloads(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "Title"})
+        client = OllamaClient()
+        payload = {"model": "phi", "prompt": "Same hotel", "system": "x", "stream": False}
+
+        client.post(payload)
+        client.post(dict(payload))
+        client.post(dict(payload, prompt="Other hotel"))
+
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch("properties.ollama.requests.post")
+    def test_client_does_not_keep_error_responses(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=500, text="busy")
+        client = OllamaClient()
+        payload = {"model": "phi", "prompt": "Same hotel", "system": "x", "stream": False}
+
+        client.post(payload)
+        client.post(payload)
+
+        self.assertEqual(mock_post.call_count, 2)
+
+
+class HotelRowProjectionTest(SimpleTestCase):
+
+    def test_project_keeps_table_order_and_hotel_id(self):
+        columns = project(("city_name", "hotelName"), ("positionName", "hotelName"))
+        self.assertEqual(columns, ("hotel_id", "hotelName", "city_name", "positionName"))
+
+    def test_project_rejects_unknown_columns(self):
+        with self.assertRaises(ValueError):
+            project(("stars",))
+
+    def test_select_only_projected_columns(self):
+        sql = select_hotels_sql(("hotel_id", "hotelName", "positionName"))
+        self.assertEqual(sql, 'SELECT hotel_id, "hotelName", "positionName" FROM hotels')
+
+    def test_fetch_hotels_builds_rows(self):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [(7, "Sea View", "Miami")]
+
+        rows = fetch_hotels(cursor, ("hotel_id", "hotelName", "city_name"))
+
+        self.assertEqual(rows, [HotelRow(hotel_id=7, hotelName="Sea View", city_name="Miami")])
+        self.assertIsNone(rows[0].latitude)
+
+    def test_stream_hotels_fetches_in_chunks(self):
+        cursor = MagicMock()
+        cursor.fetchmany.side_effect = [[(1, "Hotel Sunshine"), (2, "Park View")], [(3, "Ocean Breeze")], []]
+
+        rows = list(stream_hotels(cursor, ("hotel_id", "hotelName"), 2, hotel_ids={1, 2, 3}, ordered=True))
+
+        self.assertEqual([row[0] for row in rows], [1, 2, 3])
+        self.assertEqual(cursor.execute.call_args.args,
+                         ('SELECT hotel_id, "hotelName" FROM hotels WHERE hotel_id = ANY(%s) ORDER BY hotel_id',
+                          [[1, 2, 3]]))
+        cursor.fetchmany.assert_called_with(2)
+
+
+class CopyStreamTest(SimpleTestCase):
+
+    def test_copy_line_escapes_special_characters(self):
+        line = copy_line((5, "Tab\there", "Line\nbreak", "Back\\slash", None))
+        self.assertEqual(line, "5\tTab\\there\tLine\\nbreak\tBack\\\\slash\t\\N\n")
+
+    def test_read_in_chunks_until_exhausted(self):
+        stream = CopyStream(iter([(1, "Alpha"), (2, "Beta")]))
+        chunks = []
+        while True:
+            chunk = stream.read(4)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 4)
+            chunks.append(chunk)
+
+        self.assertEqual("".join(chunks), "1\tAlpha\n2\tBeta\n")
+        self.assertEqual(stream.rows, 2)
+
+
+class ChangeFeedTest(TestCase):
+
+    def test_read_returns_last_id_and_distinct_hotels(self):
+        connection = MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [(11, 2), (12, 1), (13, 2)]
+
+        position, hotel_ids = ChangeFeed(connection).read(10, 100)
+
+        self.assertEqual(position, 13)
+        self.assertEqual(hotel_ids, [1, 2])
+
+    def test_read_without_changes_keeps_position(self):
+        connection = MagicMock()
+        connection.cursor.return_value.__enter__.return_value.fetchall.return_value = []
+
+        self.assertEqual(ChangeFeed(connection).read(10, 100), (10, []))
+
+    @patch("properties.management.commands.watch_hotels.call_command")
+    @patch("properties.management.commands.watch_hotels.ChangeFeed")
+    def test_watch_once_feeds_changed_hotels_to_commands(self, mock_feed_class, mock_call_command):
+        feed = mock_feed_class.return_value
+        feed.read.side_effect = [(42, [1, 2]), (42, [])]
+
+        call_command("watch_hotels", "--once", stdout=StringIO())
+
+        called = [c.args[0] for c in mock_call_command.call_args_list]
+        self.assertEqual(called, ["sync_properties", "rewrite_property_info", "generate_property_info"])
+        self.assertEqual(mock_call_command.call_args.kwargs["hotel_ids"], [1, 2])
+        self.assertEqual(ChangeFeedCursor.objects.get(name="rewrite").position, 42)
+        feed.prune.assert_called_once_with(42)
+        feed.wait.assert_not_called()
+
+    @patch("properties.management.commands.sync_properties.Command.iter_hotels")
+    @patch("properties.management.commands.watch_hotels.call_command")
+    @patch("properties.management.commands.watch_hotels.ChangeFeed")
+    def test_hotels_new_to_the_feed_get_a_row_before_the_rewrite(self, mock_feed_class, mock_call_command,
+                                                                 mock_iter_hotels):
+        Property.objects.create(original_id=1, original_title="Old Name")
+        mock_feed_class.return_value.read.side_effect = [(7, [1, 2]), (7, [])]
+        mock_iter_hotels.return_value = iter([(1, "Hotel Sunshine"), (2, "Park View")])
+        titles = {}
+
+        def run(name, **options):
+            if name == "sync_properties":
+                return call_command(name, **options)
+            # What the rewrite commands find when they run
+            titles.update(Property.objects.filter(original_id__in=options["hotel_ids"])
+                          .values_list("original_id", "original_title"))
+
+        mock_call_command.side_effect = run
+        call_command("watch_hotels", "--once", stdout=StringIO())
+
+        self.assertEqual(mock_iter_hotels.call_args.args[1], [1, 2])
+        self.assertEqual(titles, {1: "Hotel Sunshine", 2: "Park View"})
+
+
+class PlanningModesTest(TripHotelsTestCase):
+    rows = TRIP_ROWS[:2]
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_dry_run_renders_prompts_without_calling_ollama(self, mock_post, mock_connections):
+        self.mock_trip_cursor(mock_connections)
+
+        out = StringIO()
+        call_command("generate_property_info", "--dry-run", stdout=out)
+
+        mock_post.assert_not_called()
+        self.assertEqual(PropertySummary.objects.count(), 0)
+        self.assertIn("Measured 2 of 2 hotels: 4 requests", out.getvalue())
+        self.assertIn("rating_review: 2 prompts", out.getvalue())
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_sample_times_real_calls_and_extrapolates(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, total=1000)
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {
+            "response": "4.5/5 Lovely stay",
+            "prompt_eval_count": 50,
+            "eval_count": 10,
+            "total_duration": 2 * 10**9,
+        })
+
+        out = StringIO()
+        call_command("generate_property_info", "--sample", "2", "--concurrency", "2", stdout=out)
+
+        self.assertEqual(PropertySummary.objects.count(), 0)
+        self.assertEqual(PropertyRatingReview.objects.count(), 0)
+        self.assertEqual(mock_cursor.execute.call_args_list[-1].args[1], [2])  # LIMIT of the sample
+        self.assertIn("Measured 2 of 1000 hotels: 4 requests, 200 prompt + 40 generated tokens.", out.getvalue())
+        self.assertIn("Estimated full run: 2000 requests, 100000 prompt tokens, 20000 generated tokens.", out.getvalue())
+        self.assertIn("Estimated GPU time: 1h 06m", out.getvalue())
+
+    def test_estimate_divides_wall_clock_by_concurrency(self):
+        usage = Usage()
+        usage.add({"prompt_eval_count": 10, "eval_count": 5, "total_duration": 60 * 10**9}, 60)
+        estimate = RunEstimate(total_hotels=10, concurrency=4)
+        estimate.hotels = 1
+        estimate.add_usage(usage)
+
+        self.assertIn("wall clock at concurrency 4: 2m 30s.", estimate.report()[-1])
+
+
+class RunPipelineCommandTest(TripHotelsTestCase):
+    rows = TRIP_ROWS[:2]
+
+    def setUp(self):
+        Property.objects.create(original_id=1, original_title="Hotel Sunshine")
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_all_stages_in_one_pass(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections)
+        mock_post.side_effect = self.mock_generate
+
+        out = StringIO()
+        call_command("run_pipeline", "--concurrency", "4", stdout=out)
+
+        mock_cursor.execute.assert_called_once()  # Hotels are read once for every stage
+        self.assertEqual(mock_post.call_count, 8)
+        property_obj = Property.objects.get(original_id=1)
+        self.assertEqual(property_obj.rewritten_title, "Sunrise Suites")
+        self.assertEqual(property_obj.description, "Sunrise Suites offers bright rooms near Central Park.")
+        self.assertIn("No existing record for Original ID 2", out.getvalue())
+        self.assertEqual(PropertySummary.objects.count(), 2)
+        self.assertEqual(PropertyRatingReview.objects.get(property_id=2).rating, 4.5)
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_only_requested_stages_run(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections)
+        mock_post.side_effect = self.mock_generate
+
+        call_command("run_pipeline", "--stages", "summary", stdout=StringIO())
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(PropertySummary.objects.count(), 2)
+        self.assertEqual(PropertyRatingReview.objects.count(), 0)
+        self.assertNotIn('"roomType"', mock_cursor.execute.call_args.args[0].split("FROM")[1])
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_failed_stage_skips_only_its_sinks(self, mock_post, mock_connections):
+        self.mock_trip_cursor(mock_connections)
+
+        def summary_fails(url, json=None, **kwargs):
+            if "summary" in json["system"]:
+                return MagicMock(status_code=500, text="busy")
+            return self.mock_generate(url, json=json)
+        mock_post.side_effect = summary_fails
+
+        out = StringIO()
+        call_command("generate_property_info", stdout=out)
+
+        self.assertIn("Ollama API error: busy", out.getvalue())
+        self.assertIn("Skipping ID 1 due to invalid summary.", out.getvalue())
+        self.assertEqual(PropertySummary.objects.count(), 0)
+        self.assertEqual(PropertyRatingReview.objects.count(), 2)
+
+    def test_sink_without_its_stages_is_rejected(self):
+        with self.assertRaises(CommandError):
+            call_command("run_pipeline", "--stages", "summary", "--sinks", "property", stdout=StringIO())
+
+    def test_unknown_stage_is_rejected(self):
+        with self.assertRaises(CommandError):
+            call_command("run_pipeline", "--stages", "slogan", stdout=StringIO())
+
+
+class ModelRouterTest(SimpleTestCase):
+    routes = {
+        "title": {"model": "tinyllama"},
+        "summary": {"model": "phi", "fast": "tinyllama"},
+    }
+
+    def observe(self, router, queued_seconds):
+        router.observe_response({}, {"total_duration": 2 * 10**9}, 2 + queued_seconds)
+
+    def test_primary_models_per_stage(self):
+        router = ModelRouter(self.routes, "phi", threshold_seconds=10)
+        self.assertEqual(router.model_for("title"), "tinyllama")
+        self.assertEqual(router.model_for("summary"), "phi")
+        self.assertEqual(router.model_for("rating_review"), "phi")
+
+    def test_falls_back_while_queue_latency_is_high(self):
+        router = ModelRouter(self.routes, "phi", threshold_seconds=10, smoothing=1.0)
+
+        self.observe(router, 30)
+        self.assertEqual(router.model_for("summary"), "tinyllama")
+        self.assertEqual(router.model_for("rating_review"), "phi")  # No fast model configured
+
+        self.observe(router, 8)  # Below the threshold but above the hysteresis band
+        self.assertEqual(router.model_for("summary"), "tinyllama")
+
+        self.observe(router, 1)
+        self.assertEqual(router.model_for("summary"), "phi")
+        self.assertEqual(router.fallbacks, 2)
+
+    @override_settings(OLLAMA_STAGE_MODELS={"summary": {"model": "phi", "fast": "tinyllama"}})
+    def test_command_line_override_disables_fallback(self):
+        router = ModelRouter.from_settings({"summary": "mistral"})
+        router.congested = True
+        self.assertEqual(router.model_for("summary"), "mistral")
+
+
+class PromptBatchingTest(TripHotelsTestCase):
+    hotels = [
+        HotelRow(hotel_id=1, hotelName="Hotel Sunshine", city_name="New York", positionName="Central Park"),
+        HotelRow(hotel_id=2, hotelName="Ocean Breeze Resort", city_name="Miami", positionName="South Beach"),
+    ]
+
+    def test_batch_payload_lists_every_hotel(self):
+        payload = TitleStage().batch_payload(self.hotels, "tinyllama")
+        self.assertEqual(payload["format"], "json")
+        self.assertIn("- id 1: City: New York; Nearby Location: Central Park; Original hotel: Hotel Sunshine",
+                      payload["prompt"])
+        self.assertIn("- id 2: City: Miami; Nearby Location: South Beach; Original hotel: Ocean Breeze Resort",
+                      payload["prompt"])
+
+    def test_split_batch_keeps_only_known_well_formed_items(self):
+        text = json.dumps({"hotels": [
+            {"id": 1, "rating": "4.5", "review": "Bright rooms."},
+            {"id": 2, "rating": "great"},
+            {"id": 99, "rating": 3, "review": "Unknown hotel."},
+        ]})
+        stage = RatingReviewStage()
+        items = stage.split_batch(text, self.hotels)
+
+        self.assertEqual(list(items), [1])
+        self.assertEqual(stage.parse(items[1]), (4.5, "Bright rooms."))
+
+    def test_split_batch_skips_names_that_are_not_text(self):
+        text = json.dumps({"hotels": [
+            {"id": 1, "name": None},
+            {"id": 2, "name": "  "},
+            {"id": 3, "name": 42},
+        ]})
+        hotels = self.hotels + [HotelRow(hotel_id=3, hotelName="Hotel Sunshine.")]
+
+        self.assertEqual(TitleStage().split_batch(text, hotels), {})
+        self.assertEqual(TitleStage().split_batch(json.dumps({"hotels": [{"id": 1, "name": "Sunrise Suites"}]}),
+                                                  hotels), {1: "Sunrise Suites"})
+
+    def test_split_batch_rejects_non_json(self):
+        with self.assertRaises(InvalidOutput):
+            TitleStage().split_batch("Here are your names: ...", self.hotels)
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_missing_items_fall_back_to_single_calls(self, mock_post, mock_connections):
+        Property.objects.create(original_id=1)
+        Property.objects.create(original_id=2)
+        mock_cursor = self.mock_trip_cursor(
+            mock_connections, [(h.hotel_id, h.hotelName, h.city_name, h.positionName) for h in self.hotels])
+
+        def respond(url, json=None, **kwargs):
+            if json.get("format") == "json":
+                text = '{"hotels": [{"id": 1, "name": "Sunrise Suites"}]}'
+            else:
+                text = "Coral Bay Inn"
+            return MagicMock(status_code=200, json=lambda: {"response": text})
+        mock_post.side_effect = respond
+
+        out = StringIO()
+        call_command("run_pipeline", "--stages", "title", "--prompt-batch", "title", stdout=out)
+
+        self.assertEqual(mock_post.call_count, 2)  # One packed prompt, one retry for hotel 2
+        self.assertIn("Batched title: 1 of 2 hotels unusable, retrying individually.", out.getvalue())
+        single = mock_post.call_args_list[1].kwargs["json"]
+        self.assertIn("Original hotel: Ocean Breeze Resort", single["prompt"])
+
+    def test_stage_without_batch_support_is_rejected(self):
+        with self.assertRaises(CommandError):
+            call_command("run_pipeline", "--stages", "summary", "--prompt-batch", "summary", stdout=StringIO())
+
+
+class PrefixOrderingTest(SimpleTestCase):
+    hotels = [
+        HotelRow(hotel_id=1, hotelName="Hotel Sunshine", city_name="New York"),
+        HotelRow(hotel_id=2, hotelName="Ocean Breeze Resort", city_name="Miami"),
+        HotelRow(hotel_id=3, hotelName="Park Lane", city_name="New York"),
+    ]
+
+    def make_pipeline(self, **kwargs):
+        return Pipeline([TitleStage(), DescriptionStage()], [], MagicMock(), MagicMock(), StringIO(), MagicMock(), **kwargs)
+
+    def test_calls_are_grouped_by_stage_then_city(self):
+        order = [(stage.name, hotel.hotel_id) for stage, hotel in self.make_pipeline().schedule(self.hotels)]
+        self.assertEqual(order, [
+            ("title", 2), ("title", 1), ("title", 3),
+            ("description", 2), ("description", 1), ("description", 3),
+        ])
+
+    def test_packed_prompts_keep_cities_together(self):
+        pipeline = self.make_pipeline(prompt_batch=["title"], prompt_batch_size=2)
+        groups = [[hotel.hotel_id for hotel in target] for stage, target in pipeline.schedule(self.hotels)
+                  if stage.name == "title"]
+        self.assertEqual(groups, [[2, 1], [3]])
+
+    def test_prompts_of_one_location_share_everything_before_the_hotel_name(self):
+        first = HotelRow(hotel_id=1, hotelName="Hotel Sunshine", city_name="New York", positionName="Central Park")
+        second = first._replace(hotel_id=3, hotelName="Park Lane")
+        for stage in (TitleStage(), DescriptionStage(), SummaryStage(), RatingReviewStage()):
+            prompt = stage.prompt(first)
+            shared = os.path.commonprefix([prompt, stage.prompt(second)])
+            self.assertEqual(len(shared), prompt.index("Hotel Sunshine"), stage.name)
+        self.assertEqual(TitleStage().prefix_key(first), TitleStage().prefix_key(second))
+
+
+class DuplicateDetectionTest(TripHotelsTestCase):
+    hotels = [
+        HotelRow(hotel_id=1, hotelName="Hotel Sunshine", city_name="New York", positionName="Central Park"),
+        HotelRow(hotel_id=2, hotelName="Ocean Breeze Resort", city_name="Miami", positionName="South Beach"),
+        HotelRow(hotel_id=3, hotelName="Hotel Sunshine.", city_name="New York", positionName="Central Park"),
+    ]
+
+    def test_index_finds_nearest_vector(self):
+        index = VectorIndex()
+        index.add("a", [1.0, 0.0, 0.0])
+        index.add("b", [0.0, 1.0, 0.0])
+        key, similarity = index.nearest([0.9, 0.1, 0.0])
+        self.assertEqual(key, "a")
+        self.assertGreater(similarity, 0.99)
+        with self.assertRaises(ValueError):
+            index.nearest([1.0, 0.0])
+
+    def test_near_duplicates_point_at_the_first_listing(self):
+        detector = DuplicateDetector(LocalEmbedder(), threshold=0.9)
+        vectors = {hotel.hotel_id: detector.embed(hotel) for hotel in self.hotels}
+        duplicates = detector.assign(self.hotels, vectors)
+        self.assertEqual(list(duplicates), [3])
+        self.assertEqual(duplicates[3][0], 1)
+
+    @override_settings(OLLAMA_EMBEDDING_MODEL="")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_duplicates_reuse_the_rewrite(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(
+            mock_connections, [(h.hotel_id, h.hotelName, h.city_name, h.positionName) for h in self.hotels])
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "Great stay. 4.5/5 Lovely rooms."})
+
+        out = StringIO()
+        call_command("run_pipeline", "--stages", "rating_review", "--dedupe", "reuse", stdout=out)
+
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertIn("ID 3 looks like a duplicate of ID 1", out.getvalue())
+        self.assertEqual(PropertyRatingReview.objects.get(property_id=3).review,
+                         PropertyRatingReview.objects.get(property_id=1).review)
+
+    @override_settings(OLLAMA_EMBEDDING_MODEL="")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_reused_titles_are_recognised_on_the_next_run(self, mock_post, mock_connections):
+        for hotel_id in (1, 2):
+            Property.objects.create(original_id=hotel_id)
+        scraped = [(1, "Sea View Hotel", "Miami", "South Beach", 200, "Suite"),
+                   (2, "Sea View Hotel.", "Miami", "South Beach", 200, "Suite")]
+        # rewrite_hotels has since written the generated title over both names
+        rewritten = [row[:1] + ("Sunrise Suites",) + row[2:] for row in scraped]
+        self.mock_trip_cursor(mock_connections, batches=[scraped, rewritten])
+        mock_post.side_effect = self.mock_generate
+
+        for _ in range(2):
+            call_command("rewrite_property_info", "--dedupe", "reuse", stdout=StringIO())
+
+        self.assertEqual(RewriteVersion.objects.filter(hotel_id=2, field="title", kind=RewriteVersion.GENERATED)
+                         .get().content.text, "Sunrise Suites")
+        originals = RewriteVersion.objects.filter(field="title", kind=RewriteVersion.ORIGINAL)
+        self.assertEqual(sorted(originals.values_list("hotel_id", "content__text")),
+                         [(1, "Sea View Hotel"), (2, "Sea View Hotel.")])
+        prompts = [c.kwargs["json"]["prompt"] for c in mock_post.call_args_list]
+        self.assertFalse([prompt for prompt in prompts if "Sunrise Suites" in prompt])
+        self.assertEqual(mock_post.call_count, 4)  # Hotel 1's title and description, once per run
+
+
+class PropertySearchTest(TestCase):
+    def setUp(self):
+        Property.objects.create(original_id=1, original_title="Hotel Sunshine",
+                                rewritten_title="Sunrise Harbour Suites", description="Quiet rooms by the marina.")
+        Property.objects.create(original_id=2, original_title="Ocean Breeze Resort",
+                                rewritten_title="Coral Bay Inn", description="Steps from the harbour promenade.")
+        PropertySummary.objects.create(property_id=2, summary="Family rooms with a rooftop pool.")
+        refresh_search_vectors()
+
+    def test_title_matches_rank_above_description_matches(self):
+        results = list(search_properties("harbour"))
+        self.assertEqual([p.original_id for p in results], [1, 2])
+        self.assertGreater(results[0].rank, results[1].rank)
+
+    def test_summaries_are_searchable(self):
+        results = list(search_properties("rooftop pool"))
+        self.assertEqual([(p.original_id, p.summary) for p in results], [(2, "Family rooms with a rooftop pool.")])
+
+    def test_sink_write_refreshes_the_index(self):
+        sink = PropertySink(MagicMock(), MagicMock())
+        sink.add(HotelRow(hotel_id=1), {"title": "Lantern House", "description": "A calm stay."})
+        sink.flush()
+        self.assertEqual([p.original_id for p in search_properties("lantern")], [1])
+        self.assertEqual(list(search_properties("harbour suites")), [])
+
+    def test_admin_search_finds_rows_not_indexed_yet(self):
+        Property.objects.create(original_id=3, original_title="Harbour Lights")  # search_vector is NULL
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+
+        response = self.client.get("/admin/properties/property/", {"q": "harbour"})
+
+        self.assertEqual(sorted(p.original_id for p in response.context["cl"].result_list), [1, 2, 3])
+
+    def test_migration_backfills_rows_not_indexed_yet(self):
+        backfill = import_module("properties.migrations.0015_backfill_search_vector").BACKFILL_SQL
+        Property.objects.create(original_id=3, original_title="Harbour Lights")
+        with connections["default"].cursor() as cursor:
+            cursor.execute(backfill)
+
+        self.assertEqual([p.original_id for p in search_properties("lights")], [3])
+
+    def test_admin_edits_refresh_the_index(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        hotel = Property.objects.get(original_id=1)
+
+        response = self.client.post(f"/admin/properties/property/{hotel.pk}/change/", {
+            "original_id": 1, "original_title": "Hotel Sunshine", "rewritten_title": "Lantern House",
+            "description": "A calm stay.",
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([p.original_id for p in search_properties("lantern")], [1])
+
+    def test_search_endpoint(self):
+        response = self.client.get("/api/properties/search/", {"q": "coral", "limit": 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["original_id"] for r in response.json()["results"]], [2])
+        self.assertEqual(self.client.get("/api/properties/search/").status_code, 400)
+
+
+@override_settings(GEO_LANDMARK_RADIUS_KM=2, GEO_HOTEL_RADIUS_KM=1)
+class GeoIndexTest(SimpleTestCase):
+    hotels = [
+        HotelRow(hotel_id=1, hotelName="Hotel Sunshine", city_name="New York", positionName="Central Park",
+                 latitude=40.7812, longitude=-73.9665),
+        HotelRow(hotel_id=2, hotelName="Park View", city_name="New York", positionName="Central Park",
+                 latitude=40.7850, longitude=-73.9650),
+        HotelRow(hotel_id=3, hotelName="Harbour Lights", city_name="New York", positionName="Battery Park",
+                 latitude=40.7033, longitude=-74.0170),
+        HotelRow(hotel_id=4, hotelName="No Coordinates", city_name="New York", positionName="Central Park"),
+    ]
+
+    def test_near_matches_a_full_scan(self):
+        index = GeoIndex()
+        points = [(i, 40.6 + (i % 20) * 0.013, -74.1 + (i // 20) * 0.017) for i in range(400)]
+        for key, lat, lon in points:
+            index.add(key, str(key), lat, lon)
+
+        found = index.near(40.75, -73.98, radius_km=3, limit=None)
+        expected = sorted((haversine_km(40.75, -73.98, lat, lon), key) for key, lat, lon in points
+                          if haversine_km(40.75, -73.98, lat, lon) <= 3)
+        self.assertEqual([key for key, _, _ in found], [key for _, key in expected])
+
+    def test_describe_lists_landmarks_and_hotel_density(self):
+        neighbourhoods = Neighbourhoods(self.hotels)
+        self.assertEqual(
+            neighbourhoods.describe(1),
+            "Nearby landmarks: Central Park (0.2 km). Other hotels within 1 km: 1.",
+        )
+        self.assertIsNone(neighbourhoods.describe(4))
+
+    def test_decimal_coordinates_from_the_scraper_are_accepted(self):
+        hotels = [hotel._replace(latitude=Decimal(str(hotel.latitude)), longitude=Decimal(str(hotel.longitude)))
+                  for hotel in self.hotels[:3]]
+        neighbourhoods = Neighbourhoods(hotels)
+        self.assertEqual(neighbourhoods.describe(1), Neighbourhoods(self.hotels).describe(1))
+        self.assertEqual([key for key, _, _ in neighbourhoods.hotels_near(40.7812, -73.9665)], [1, 2])
+
+    def test_prompts_only_change_when_context_is_present(self):
+        hotel = self.hotels[0]
+        self.assertNotIn("Neighbourhood", SummaryStage().prompt(hotel))
+        prompt = DescriptionStage().prompt(hotel._replace(neighbourhood="Nearby landmarks: Central Park (0.2 km)."))
+        self.assertIn("Neighbourhood (use only these location facts): Nearby landmarks: Central Park", prompt)
+
+
+class RewriteStreamTest(TestCase):
+    hotel = HotelRow(hotel_id=7, hotelName="Hotel Sunshine", city_name="New York", positionName="Central Park")
+
+    def setUp(self):
+        self.requests = []
+
+        def handler(request):
+            payload = json.loads(request.content)
+            self.requests.append(payload)
+            words = ["Sunrise ", "Suites"] if "branding" in payload["system"] else ["Hotel Sunshine ", "is bright."]
+            body = "".join(json.dumps({"response": word, "done": False}) + "\n" for word in words)
+            return httpx.Response(200, content=body + json.dumps({"done": True}) + "\n")
+
+        transport = httpx.MockTransport(handler)
+        patches = [
+            patch("properties.streaming.make_client", lambda: httpx.AsyncClient(transport=transport)),
+            patch("properties.streaming.load_hotel", lambda hotel_id: self.hotel if hotel_id == 7 else None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        streaming.cache.clear()
+
+    async def read_events(self, hotel_id=7):
+        response = await self.async_client.get(f"/api/properties/{hotel_id}/rewrite/stream/")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        events = []
+        for block in body.strip().split("\n\n"):
+            name, data = block.split("\n")
+            events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+        return events
+
+    async def test_streams_tokens_then_saves_the_result(self):
+        events = await self.read_events()
+
+        self.assertIn(("token", {"stage": "title", "text": "Sunrise "}), events)
+        self.assertEqual(events[-1], ("done", {"cached": False, "title": "Sunrise Suites",
+                                               "description": "Sunrise Suites is bright."}))
+        saved = await Property.objects.aget(original_id=7)
+        self.assertEqual(saved.rewritten_title, "Sunrise Suites")
+
+    async def test_concurrent_requests_share_one_generation_and_repeats_hit_the_cache(self):
+        first, second = await asyncio.gather(self.read_events(), self.read_events())
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.requests), 2)  # One title and one description call in total
+
+        cached = await self.read_events()
+        self.assertEqual(cached, [("done", {"cached": True, "title": "Sunrise Suites",
+                                            "description": "Sunrise Suites is bright."})])
+        self.assertEqual(len(self.requests), 2)
+
+    async def test_unknown_hotel(self):
+        self.assertEqual(await self.read_events(8), [("error", {"message": "Hotel 8 not found."})])
+
+    async def test_unavailable_ollama_answers_with_provisional_text(self):
+        transport = httpx.MockTransport(lambda request: httpx.Response(503, content=b"overloaded"))
+        with patch("properties.streaming.make_client", lambda: httpx.AsyncClient(transport=transport)):
+            events = await self.read_events()
+
+        self.assertEqual(events, [("done", {"cached": False, "provisional": True,
+                                            "reason": "Ollama API error: overloaded",
+                                            "title": "Hotel Sunshine near Central Park",
+                                            "description": "Hotel Sunshine is in New York, near Central Park."})])
+        self.assertTrue((await Property.objects.aget(original_id=7)).provisional)
+
+    def echo_transport(self, fixed=True):
+        # Titles echo the prompt; after a rejection the stricter prompt gets a clean one, if `fixed`
+        def handler(request):
+            payload = json.loads(request.content)
+            self.requests.append(payload)
+            if "branding" not in payload["system"]:
+                text = "A bright hotel."
+            elif fixed and "previous answer was rejected" in payload["prompt"]:
+                text = "Sunrise Suites"
+            else:
+                text = "Original hotel: Hotel Sunshine"
+            return httpx.Response(200, content=json.dumps({"response": text, "done": True}) + "\n")
+        return httpx.MockTransport(handler)
+
+    async def test_rejected_answers_are_regenerated_before_saving(self):
+        transport = self.echo_transport()
+        with patch("properties.streaming.make_client", lambda: httpx.AsyncClient(transport=transport)):
+            events = await self.read_events()
+
+        self.assertIn(("rejected", {"stage": "title",
+                                    "reason": "Rejected rewritten title for ID 7: contains 'original hotel:'."}),
+                      events)
+        self.assertEqual(events[-1], ("done", {"cached": False, "title": "Sunrise Suites",
+                                               "description": "A bright hotel."}))
+        titles = [payload["prompt"] for payload in self.requests if "branding" in payload["system"]]
+        self.assertEqual(len(titles), 2)
+        self.assertIn("previous answer was rejected", titles[1])
+        self.assertEqual((await Property.objects.aget(original_id=7)).rewritten_title, "Sunrise Suites")
+
+    async def test_answers_still_rejected_after_the_retries_fall_back(self):
+        transport = self.echo_transport(fixed=False)
+        with patch("properties.streaming.make_client", lambda: httpx.AsyncClient(transport=transport)):
+            events = await self.read_events()
+
+        self.assertEqual(events[-1][1]["title"], "Hotel Sunshine near Central Park")
+        self.assertTrue(events[-1][1]["provisional"])
+        saved = await Property.objects.aget(original_id=7)
+        self.assertEqual((saved.rewritten_title, saved.provisional), ("Hotel Sunshine near Central Park", True))
+
+
+class TripRouterTest(SimpleTestCase):
+    def test_hotel_goes_to_trip_and_the_rest_to_default(self):
+        router = TripRouter()
+        self.assertEqual(router.db_for_read(Hotel), "trip")
+        self.assertEqual(router.db_for_write(Hotel), "trip")
+        self.assertIsNone(router.db_for_read(Property))
+        self.assertEqual(Hotel.objects.all().db, "trip")
+        self.assertEqual(Property.objects.all().db, "default")
+
+    def test_nothing_is_migrated_on_trip(self):
+        router = TripRouter()
+        self.assertFalse(router.allow_migrate("trip", "properties", "property"))
+        self.assertFalse(router.allow_migrate("default", "properties", "hotel"))
+        self.assertIsNone(router.allow_migrate("default", "properties", "property"))
+
+
+class ProfilingTest(TripHotelsTestCase):
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_profile_writes_artifacts_and_step_timings(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, self.rows[:1])
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "4.5/5 Lovely rooms."})
+
+        for mode in ("cprofile", "sample"):
+            with self.subTest(mode=mode), tempfile.TemporaryDirectory() as directory:
+                out = StringIO()
+                call_command("run_pipeline", "--stages", "rating_review", "--profile", mode,
+                             "--profile-dir", directory, stdout=out)
+
+                output = out.getvalue()
+                self.assertIn("ollama rating_review: 1 x", output)
+                self.assertIn("default: ", output)  # PropertyRatingReview upsert
+                suffixes = sorted(path.suffix for path in Path(directory).iterdir())
+                self.assertEqual(suffixes, [".prof", ".txt"] if mode == "cprofile" else [".folded", ".txt"])
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_cprofile_covers_the_worker_threads(self, mock_post, mock_connections):
+        self.mock_trip_cursor(mock_connections, self.rows[:1])
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "4.5/5 Lovely rooms."})
+
+        with tempfile.TemporaryDirectory() as directory:
+            call_command("run_pipeline", "--stages", "rating_review", "--profile", "--profile-dir", directory,
+                         stdout=StringIO())
+            (prof,) = Path(directory).glob("*.prof")
+            functions = {(Path(filename).name, name) for filename, _, name in pstats.Stats(str(prof)).stats}
+
+        # Pipeline.call only ever runs on the executor's threads
+        self.assertIn(("pipeline.py", "call"), functions)
+
+    @patch("properties.profiling.datetime")
+    def test_runs_in_the_same_second_keep_their_own_artifacts(self, mock_datetime):
+        mock_datetime.now.return_value = datetime(2026, 1, 1, 12, 0, 0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for _ in range(2):
+                with patch("properties.management.commands.sync_properties.Command.handle", return_value=None):
+                    call_command("sync_properties", "--profile", "sample", "--profile-dir", directory,
+                                 stdout=StringIO())
+            self.assertEqual(len(list(Path(directory).glob("*.txt"))), 2)
+
+    def test_commands_run_unchanged_without_profile(self):
+        out = StringIO()
+        with patch("properties.management.commands.sync_properties.Command.handle", return_value=None) as mock_handle:
+            call_command("sync_properties", stdout=out)
+        self.assertEqual(mock_handle.call_args.kwargs["profile"], None)
+        self.assertNotIn("Profile", out.getvalue())
+
+
+class RewriteHistoryTest(TripHotelsTestCase):
+    def test_generated_names_are_swapped_back_to_the_original(self):
+        history = RewriteHistory()
+        scraped = [HotelRow(hotel_id=1, hotelName="Hotel Sunshine")]
+        self.assertEqual(history.restore_originals(scraped), scraped)
+
+        history.add_results(scraped[0], {"title": "Sunrise Suites"}, {"title": "tinyllama"}, [TitleStage()])
+        history.flush()
+        overwritten = [HotelRow(hotel_id=1, hotelName="Sunrise Suites")]
+        self.assertEqual(history.restore_originals(overwritten)[0].hotelName, "Hotel Sunshine")
+
+        # A name the scraper changed is a new original, not ours
+        renamed = [HotelRow(hotel_id=1, hotelName="Hotel Sunshine Midtown")]
+        self.assertEqual(history.restore_originals(renamed), renamed)
+        self.assertEqual(RewriteVersion.objects.filter(kind=RewriteVersion.ORIGINAL).count(), 2)
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_pipeline_records_each_distinct_output_once(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, self.rows[:2])
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "4.5/5 Lovely rooms."})
+
+        for _ in range(2):
+            call_command("run_pipeline", "--stages", "rating_review", stdout=StringIO())
+
+        generated = RewriteVersion.objects.filter(kind=RewriteVersion.GENERATED)
+        self.assertEqual(generated.count(), 2)  # One per hotel, not per run
+        self.assertEqual(ContentBlob.objects.filter(rewriteversion__kind=RewriteVersion.GENERATED).distinct().count(), 1)
+        version = generated.first()
+        self.assertEqual((version.field, version.model), ("rating_review", "phi"))
+        self.assertEqual(version.prompt_version, RatingReviewStage().prompt_version)
+
+    @patch("properties.sinks.execute_values")
+    @patch("properties.sinks.connections")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_names_are_not_overwritten_when_the_history_cannot_be_saved(self, mock_post, mock_connections,
+                                                                        mock_sink_connections, mock_execute_values):
+        self.mock_trip_cursor(mock_connections, self.rows[:1])
+        mock_post.side_effect = self.mock_generate
+
+        # The originals are saved when the hotels are fetched; the generated values are not
+        with patch.object(RewriteHistory, "flush", side_effect=[None, DatabaseError("disk full")]):
+            out = StringIO()
+            call_command("rewrite_hotels", stdout=out)
+
+        mock_execute_values.assert_not_called()
+        self.assertIn("Error writing rewrite history: disk full", out.getvalue())
+        self.assertIn("Not writing 1 hotels to hotels: their original values could not be saved.", out.getvalue())
+
+
+class RunAccountingTest(TripHotelsTestCase):
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_usage_is_recorded_per_hotel_and_stage(self, mock_post, mock_connections):
+        self.mock_trip_cursor(mock_connections)
+        mock_post.side_effect = self.mock_generate
+
+        call_command("generate_property_info", stdout=StringIO())
+
+        run = PipelineRun.objects.get()
+        self.assertEqual((run.status, run.hotels, run.requests), (PipelineRun.COMPLETED, 3, 6))
+        self.assertEqual((run.prompt_tokens, run.eval_tokens), (600, 120))
+        self.assertEqual(StageUsage.objects.filter(run=run).count(), 6)
+        usage = StageUsage.objects.get(hotel_id=2, stage="rating_review")
+        self.assertEqual((usage.model, usage.prompt_tokens, usage.eval_seconds), ("phi", 100, 1.0))
+
+        out = StringIO()
+        call_command("run_stats", stdout=out)
+        self.assertIn(f"#{run.pk} generate_property_info [summary,rating_review]", out.getvalue())
+        self.assertIn("rating_review phi: 3 hotels, 100 prompt tokens/call, 20.0 generated tokens/s", out.getvalue())
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_packed_prompt_usage_is_split_between_its_hotels(self, mock_post, mock_connections):
+        self.mock_trip_cursor(mock_connections)
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {
+            "response": json.dumps({"hotels": [{"id": i, "rating": 4.5, "review": "Lovely."} for i in (1, 2, 3)]}),
+            "prompt_eval_count": 300, "eval_count": 60, "total_duration": 3e9, "eval_duration": 3e9,
+        })
+
+        call_command("run_pipeline", "--stages", "rating_review", "--prompt-batch", "rating_review",
+                     stdout=StringIO())
+
+        rows = StageUsage.objects.order_by("hotel_id")
+        self.assertEqual([(row.hotels_in_prompt, row.prompt_tokens, row.eval_tokens) for row in rows],
+                         [(3, 100, 20)] * 3)
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_token_budget_stops_after_the_current_batch(self, mock_post, mock_connections):
+        self.mock_trip_cursor(mock_connections)
+        mock_post.side_effect = self.mock_generate
+
+        out = StringIO()
+        call_command("run_pipeline", "--stages", "rating_review", "--batch-size", "2",
+                     "--max-tokens", "200", stdout=out)
+
+        # The first batch (2 hotels, 240 tokens) is written; the second never starts
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(PropertyRatingReview.objects.count(), 2)
+        run = PipelineRun.objects.get()
+        self.assertEqual((run.status, run.hotels), (PipelineRun.BUDGET_REACHED, 2))
+        self.assertIn("token budget reached (240 of 200 tokens)", run.stop_reason)
+        self.assertIn("Stopped early", out.getvalue())
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_planning_runs_are_not_recorded(self, mock_post, mock_connections):
+        self.mock_trip_cursor(mock_connections)
+        mock_post.side_effect = self.mock_generate
+
+        call_command("run_pipeline", "--stages", "rating_review", "--sample", "1", "--limit", "3", stdout=StringIO())
+
+        self.assertFalse(PipelineRun.objects.exists())
+
+
+class PrioritySchedulerTest(TripHotelsTestCase):
+    hotels = [
+        HotelRow(hotel_id=1, city_name="Miami", price=Decimal("90")),
+        HotelRow(hotel_id=2, city_name="Paris", price=Decimal("250")),
+        HotelRow(hotel_id=3, city_name="Miami", price=Decimal("300")),
+        HotelRow(hotel_id=4, city_name="Miami", price=Decimal("220")),
+        HotelRow(hotel_id=5, city_name="Paris", price=None),
+        HotelRow(hotel_id=6, city_name="Lyon", price=Decimal("400")),
+    ]
+
+    def ids(self, scheduler):
+        return [hotel.hotel_id for hotel in scheduler.order(self.hotels)]
+
+    def test_cities_take_turns_within_a_tier(self):
+        # Every city gets its first priced hotel in before any second one; unpriced hotels come last
+        self.assertEqual(self.ids(PriorityScheduler.from_rules(["price=-"])), [1, 2, 6, 3, 4, 5])
+        self.assertEqual(self.ids(PriorityScheduler.from_rules(["price=-"], fair=False)), [1, 2, 3, 4, 6, 5])
+
+    def test_rules_form_tiers_in_order(self):
+        scheduler = PriorityScheduler.from_rules(["city=paris", "price=200-"])
+        self.assertEqual(self.ids(scheduler), [2, 5, 3, 6, 4, 1])
+
+    def test_recent_orders_within_each_city(self):
+        scheduler = PriorityScheduler.from_rules(["recent", "city=Miami"])
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (True,)
+        cursor.fetchall.return_value = [(1, 10), (4, 12), (5, 11)]
+        scheduler.load(cursor)
+        self.assertEqual(self.ids(scheduler), [4, 1, 3, 5, 6, 2])
+
+    def test_recent_is_stable_for_hotels_whose_entries_were_pruned(self):
+        scheduler = PriorityScheduler.from_rules(["recent"], fair=False)
+        cursor = MagicMock()
+        cursor.fetchone.return_value = (True,)
+        cursor.fetchall.return_value = [(4, 12)]  # What watch_hotels left after pruning
+        scheduler.load(cursor)
+
+        for hotels in (self.hotels, self.hotels[::-1]):
+            self.assertEqual([hotel.hotel_id for hotel in scheduler.order(hotels)], [4, 6, 5, 3, 2, 1])
+
+    def test_invalid_rules_are_rejected(self):
+        for rule in ["city=", "price=cheap", "price=10-x", "stars=5"]:
+            with self.assertRaises(ValueError):
+                PriorityScheduler.from_rules([rule])
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_limit_keeps_the_highest_priority_hotels(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, [(1, "Hotel Sunshine", "Miami", "South Beach"),
+                                                               (2, "Park View", "Paris", "Louvre")])
+
+        out = StringIO()
+        call_command("run_pipeline", "--stages", "title", "--dry-run", "--limit", "1",
+                     "--priority", "city=Paris", stdout=out)
+
+        self.assertNotIn("LIMIT", mock_cursor.execute.call_args.args[0])
+        self.assertIn("Measured 1 of", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("run_pipeline", "--priority", "stars=5", "--dry-run", stdout=StringIO())
+
+
+class TemplateFallbackTest(TripHotelsTestCase):
+    rows = [(1, "Hotel Sunshine", "New York", "Central Park", Decimal("199.50"), "Deluxe")]
+
+    def setUp(self):
+        Property.objects.create(original_id=1, original_title="Hotel Sunshine")
+
+    def test_templates_use_only_listing_facts(self):
+        hotel = HotelRow(hotel_id=1, hotelName="Hotel Sunshine", city_name="New York", positionName="Central Park",
+                         price=Decimal("199.50"), roomType="Deluxe")
+        self.assertEqual(TitleStage().fallback(hotel), "Hotel Sunshine near Central Park")
+        self.assertEqual(DescriptionStage().fallback(hotel),
+                         "Hotel Sunshine is in New York, near Central Park, offering Deluxe rooms from 200 per night.")
+        self.assertEqual(DescriptionStage().fallback(HotelRow(hotel_id=2, hotelName="Inn")), "Inn is available to book.")
+        self.assertIsNone(SummaryStage().fallback(hotel))
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_failed_rewrite_is_provisional_until_regenerated(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections)
+        mock_post.return_value = MagicMock(status_code=500, text="overloaded")
+
+        out = StringIO()
+        call_command("rewrite_property_info", stdout=out)
+
+        saved = Property.objects.get(original_id=1)
+        self.assertEqual(saved.rewritten_title, "Hotel Sunshine near Central Park")
+        self.assertTrue(saved.provisional)
+        self.assertIn("1 hotels got provisional template text", out.getvalue())
+        self.assertEqual(RewriteVersion.objects.get(field="title", kind=RewriteVersion.GENERATED).model, "template")
+
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "Sunrise Suites"})
+        call_command("rewrite_property_info", "--provisional", stdout=StringIO())
+
+        saved.refresh_from_db()
+        self.assertEqual(saved.rewritten_title, "Sunrise Suites")
+        self.assertFalse(saved.provisional)
+        out = StringIO()
+        call_command("rewrite_property_info", "--provisional", stdout=out)
+        self.assertIn("No provisional hotels to regenerate.", out.getvalue())
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_disabled_fallback_skips_the_hotel(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, [row[:4] for row in self.rows])
+        mock_post.return_value = MagicMock(status_code=500, text="overloaded")
+
+        out = StringIO()
+        call_command("rewrite_property_info", "--no-fallback", stdout=out)
+
+        self.assertIn("Skipping ID 1 due to invalid rewritten title.", out.getvalue())
+        self.assertEqual(Property.objects.get(original_id=1).rewritten_title, "Not rewritten")
+
+    @patch("properties.management.commands.watch_hotels.call_command")
+    @patch("properties.management.commands.watch_hotels.ollama_available", return_value=True)
+    def test_watcher_requeues_provisional_hotels_once_ollama_answers(self, mock_available, mock_call_command):
+        Property.objects.filter(original_id=1).update(provisional=True)
+        command = WatchHotelsCommand(stdout=StringIO())
+
+        self.assertEqual(command.requeue_provisional(50), 0)  # Still provisional afterwards: no progress
+        mock_call_command.assert_called_once_with("rewrite_property_info", hotel_ids=[1], fallback=False,
+                                                  stdout=command.stdout, stderr=command.stderr)
+        mock_available.return_value = False
+        mock_call_command.reset_mock()
+        self.assertEqual(command.requeue_provisional(50), 0)
+        mock_call_command.assert_not_called()
+
+
+class HotelCardTest(TestCase):
+    def test_cards_follow_each_stage(self):
+        Property.objects.create(original_id=1, original_title="Hotel Sunshine", rewritten_title="Sunrise Suites",
+                                description="Bright rooms.")
+        self.assertEqual(refresh_hotel_cards([1]), 1)
+        self.assertIsNone(HotelCard.objects.get(hotel_id=1).summary)
+
+        hotel = HotelRow(hotel_id=1)
+        sink = PropertySummarySink(MagicMock(), MagicMock())
+        sink.add(hotel, {"summary": "A bright hotel."})
+        sink.flush()
+        sink = PropertyRatingReviewSink(MagicMock(), MagicMock())
+        sink.add(hotel, {"rating_review": (4.5, "Lovely.")})
+        sink.flush()
+
+        card = HotelCard.objects.get(hotel_id=1)
+        self.assertEqual((card.title, card.summary, card.rating, card.review),
+                         ("Sunrise Suites", "A bright hotel.", 4.5, "Lovely."))
+        self.assertEqual(refresh_hotel_cards([1]), 0)  # Unchanged cards are not rewritten
+
+        response = self.client.get("/api/properties/1/")
+        self.assertEqual(response.json()["description"], "Bright rooms.")
+        self.assertEqual(self.client.get("/api/properties/2/").status_code, 404)
+
+    def test_full_refresh_adds_and_removes_cards(self):
+        PropertySummary.objects.create(property_id=2, summary="Only a summary.")
+        Property.objects.create(original_id=3, original_title="Gone")
+        refresh_hotel_cards()
+        self.assertEqual(sorted(HotelCard.objects.values_list("hotel_id", flat=True)), [2, 3])
+
+        Property.objects.filter(original_id=3).delete()
+        refresh_hotel_cards()
+        self.assertEqual(list(HotelCard.objects.values_list("hotel_id", flat=True)), [2])
+
+
+class HotelSnapshotTest(TestCase):
+    rows = [(1, "Hotel Sunshine", 10, "New York", "Central Park", Decimal("199.99"), "Deluxe", 40.7128, -74.006),
+            (2, "Café Bleu", 20, "Paris", None, None, None, None, None)]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "hotels.snap"
+
+    @patch("properties.management.commands.snapshot_hotels.connections")
+    def test_snapshot_round_trips_every_column(self, mock_connections):
+        mock_cursor = mock_connections["trip"].chunked_cursor.return_value.__enter__.return_value
+        mock_cursor.fetchmany.side_effect = [self.rows[:1], self.rows[1:], []]
+
+        out = StringIO()
+        call_command("snapshot_hotels", "--output", str(self.path), "--chunk-size", "1", stdout=out)
+
+        self.assertIn("Wrote 2 hotels (9 columns", out.getvalue())
+        with HotelSnapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.fetch(snapshot.columns), [HotelRow(*row) for row in self.rows])
+            self.assertEqual(snapshot.fetch(("hotel_id", "city_name"), hotel_ids=[2, 3]),
+                             [HotelRow(hotel_id=2, city_name="Paris")])
+            self.assertEqual(snapshot.count(), 2)
+            self.assertIsInstance(snapshot.column("latitude").values, memoryview)  # Read in place
+
+    def test_empty_or_truncated_snapshots_are_reported_with_their_path(self):
+        write_snapshot(self.path, ("hotel_id", "hotelName"), [row[:2] for row in self.rows])
+        data = self.path.read_bytes()
+
+        for length in (0, 5, 30, len(data) - 16):
+            self.path.write_bytes(data[:length])
+            with self.assertRaisesMessage(SnapshotError, f"Hotels snapshot {self.path} is empty or truncated"):
+                HotelSnapshot(self.path)
+
+        self.path.write_bytes(b"x" * len(data))
+        with self.assertRaisesMessage(SnapshotError, f"{self.path} is not a hotels snapshot."):
+            HotelSnapshot(self.path)
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_pipeline_reads_the_snapshot_instead_of_the_trip_database(self, mock_post, mock_connections):
+        write_snapshot(self.path, ("hotel_id", "hotelName", "city_name", "positionName"),
+                       [row[:2] + row[3:5] for row in self.rows])
+
+        out = StringIO()
+        call_command("run_pipeline", "--stages", "title", "--dry-run", "--snapshot", str(self.path), stdout=out)
+
+        mock_connections["trip"].cursor.assert_not_called()
+        self.assertIn("Measured 2 of 2 hotels", out.getvalue())
+        with self.assertRaisesMessage(CommandError, "lacks columns"):
+            call_command("run_pipeline", "--stages", "summary", "--dry-run", "--snapshot", str(self.path),
+                         stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "Cannot open hotels snapshot"):
+            call_command("run_pipeline", "--dry-run", "--snapshot", str(self.path) + ".missing", stdout=StringIO())
+
+
+class RewriteJobTest(TripHotelsTestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(self.admin)
+
+    @patch("properties.ollama.requests.post")
+    def test_admin_action_queues_a_job_without_generating(self, mock_post):
+        for hotel_id in (3, 1, 1):
+            Property.objects.create(original_id=hotel_id, original_title=f"Hotel {hotel_id}")
+
+        response = self.client.post("/admin/properties/property/", {
+            "action": "regenerate_summary",
+            "_selected_action": list(Property.objects.values_list("pk", flat=True)),
+        }, follow=True)
+
+        mock_post.assert_not_called()
+        job = RewriteJob.objects.get()
+        self.assertEqual((job.stages, job.hotel_ids, job.status, job.requested_by),
+                         ("summary", [1, 3], RewriteJob.QUEUED, "admin"))
+        self.assertContains(response, f"rewrite job {job.pk}</a> for 2 hotels")
+        self.assertContains(self.client.get("/admin/properties/rewritejob/"), "0/2 (0%)")
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_worker_processes_the_job_in_batches(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, batches=[self.rows[:2], self.rows[2:]])
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "4.5/5 Lovely rooms."})
+        job = enqueue(["rating_review"], [3, 2, 1])
+
+        call_command("run_jobs", "--once", "--batch-size", "2", stdout=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.position, job.failed_stages), (RewriteJob.DONE, 3, 0))
+        self.assertEqual(progress(job), (3, 3, 100.0))
+        self.assertEqual(job.runs.count(), 2)
+        self.assertEqual(PropertyRatingReview.objects.count(), 3)
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_stopped_worker_returns_the_job_to_the_queue(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, self.rows[:2])
+
+        def generate(url, json=None, timeout=None):
+            os.kill(os.getpid(), signal.SIGTERM)
+            time.sleep(0.2)  # Let the main thread handle it before the next call starts
+            return MagicMock(status_code=200, json=lambda: {"response": "4.5/5 Lovely rooms."})
+
+        mock_post.side_effect = generate
+        job = enqueue(["rating_review"], [1, 2, 3])
+
+        out = StringIO()
+        call_command("run_jobs", "--batch-size", "2", stdout=out)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.position, job.hotel_ids), (RewriteJob.QUEUED, 1, [1, 2, 3]))
+        self.assertIn("Worker stopped: SIGTERM received.", out.getvalue())
+
+    def test_cancelled_jobs_are_not_claimed(self):
+        job = enqueue(["title"], [1, 2])
+        self.client.post("/admin/properties/rewritejob/", {"action": "cancel", "_selected_action": [job.pk]})
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, RewriteJob.CANCELLED)
+        self.assertIsNone(claim_job(1800))
+
+    def test_heartbeat_keeps_a_long_batch_from_being_reclaimed(self):
+        enqueue(["title"], [1, 2])
+        job = claim_job(1800)
+        RewriteJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        Heartbeat(job, 3600)()  # Not due yet
+        self.assertEqual(claim_job(60), job)
+        RewriteJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        Heartbeat(job, 0)()
+        self.assertIsNone(claim_job(60))
+
+        RewriteJob.objects.filter(pk=job.pk).update(status=RewriteJob.CANCELLED)
+        Heartbeat(job, 0)()
+        self.assertEqual(RewriteJob.objects.get(pk=job.pk).status, RewriteJob.CANCELLED)
+
+    @patch("properties.management.commands.run_jobs.Heartbeat")
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_worker_beats_while_the_batch_runs(self, mock_post, mock_connections, mock_heartbeat):
+        self.mock_trip_cursor(mock_connections, self.rows[:2])
+        mock_post.side_effect = self.mock_generate
+        job = enqueue(["rating_review"], [1, 2])
+
+        call_command("run_jobs", "--once", "--stale-after", "120", stdout=StringIO())
+
+        self.assertEqual(mock_heartbeat.call_args.args, (job, 30))
+        self.assertTrue(mock_heartbeat.return_value.called)  # From the pipeline, between results
+
+
+class RunCancellationTest(TripHotelsTestCase):
+    @patch("properties.ollama.requests.post")
+    def test_requests_only_get_the_time_left_before_the_deadline(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "Sunrise Suites"})
+        client = OllamaClient()
+        client.control = RunControl(deadline=60)
+
+        self.assertEqual(client.generate({"prompt": "a"}), "Sunrise Suites")
+        self.assertTrue(0 < mock_post.call_args.kwargs["timeout"] <= 60)
+
+        client.control.deadline = time.monotonic()
+        with self.assertRaisesMessage(RunCancelled, "deadline reached"):
+            client.generate({"prompt": "b"})
+        self.assertEqual(mock_post.call_count, 1)  # Never sent
+
+    @patch("properties.ollama.requests.post")
+    def test_embeddings_follow_the_deadline_too(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"embedding": [0.1, 0.2]})
+        client = OllamaClient()
+        client.control = RunControl(deadline=60)
+
+        self.assertEqual(client.embed("Hotel Sunshine", "nomic-embed-text"), [0.1, 0.2])
+        self.assertTrue(0 < mock_post.call_args.kwargs["timeout"] <= 60)
+
+        client.control.cancel("SIGTERM received")
+        with self.assertRaisesMessage(RunCancelled, "SIGTERM received"):
+            client.embed("Park View", "nomic-embed-text")
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_cancelling_while_checking_duplicates_stops_the_batch(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, [row[:4] for row in self.rows])
+        command = RunPipelineCommand()
+
+        def embed(url, json=None, timeout=None):
+            command.control.cancel("SIGTERM received")
+            return MagicMock(status_code=200, json=lambda: {"embedding": [0.1, 0.2]})
+
+        mock_post.side_effect = embed
+        call_command(command, "--stages", "rating_review", "--dedupe", "reuse", "--concurrency", "1",
+                     stdout=StringIO())
+
+        # Neither the other embeddings nor any generation were sent
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertFalse(PropertyRatingReview.objects.exists())
+        self.assertEqual(PipelineRun.objects.get().unfinished, [1, 2, 3])
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_sigterm_writes_finished_hotels_and_records_the_rest(self, mock_post, mock_connections):
+        mock_cursor = self.mock_trip_cursor(mock_connections, batches=[self.rows, self.rows[1:]])
+        command = RunPipelineCommand()
+        handler = signal.getsignal(signal.SIGTERM)
+
+        def generate(url, json=None, timeout=None):
+            # A container stop while the first call is running
+            os.kill(os.getpid(), signal.SIGTERM)
+            for _ in range(100):
+                if command.control.cancelled:
+                    break
+                time.sleep(0.01)
+            return MagicMock(status_code=200, json=lambda: {"response": "4.5/5 Lovely rooms."})
+
+        mock_post.side_effect = generate
+        out = StringIO()
+        call_command(command, "--stages", "rating_review", "--batch-size", "2", stdout=out)
+
+        # The first call finished and was written; the second was never sent
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(list(PropertyRatingReview.objects.values_list("property_id", flat=True)), [1])
+        run = PipelineRun.objects.get()
+        self.assertEqual((run.status, run.stop_reason, run.unfinished),
+                         (PipelineRun.CANCELLED, "SIGTERM received", [2, 3]))
+        self.assertIn(f"2 hotels left, run_pipeline --resume {run.pk} processes them", out.getvalue())
+        self.assertIs(signal.getsignal(signal.SIGTERM), handler)
+
+        mock_post.side_effect = None
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {"response": "4.5/5 Lovely rooms."})
+        call_command("run_pipeline", "--stages", "rating_review", "--resume", str(run.pk), stdout=StringIO())
+
+        self.assertEqual(PropertyRatingReview.objects.count(), 3)
+        self.assertEqual(PipelineRun.objects.latest("pk").status, PipelineRun.COMPLETED)
+        self.assertEqual(mock_cursor.execute.call_args.args[1][0], [2, 3])
+
+
+class TitleUniquenessTest(TripHotelsTestCase):
+    names = [(1, "New York", "Hotel Sunshine"), (2, "New York", "Park View"), (3, "New York", "Sunrise Suites")]
+
+    def test_titles_are_unique_per_city_ignoring_case_and_accents(self):
+        index = TitleIndex("city")
+        index.load(self.names + [(4, "Paris", "Hôtel Lumière")], [(2, "Le Petit Palais"), (9, "Not loaded")])
+        paris, new_york = HotelRow(hotel_id=5, city_name="Paris"), HotelRow(hotel_id=6, city_name="New York")
+
+        self.assertFalse(index.claim(paris, "hotel lumiere!"))
+        self.assertFalse(index.claim(new_york, "Le  Petit-Palais"))
+        self.assertTrue(index.claim(HotelRow(hotel_id=2, city_name="New York"), "Le Petit Palais"))  # Its own
+        self.assertFalse(index.claim(HotelRow(hotel_id=1, hotelName="Hotel Sunshine", city_name="New York"),
+                                     "HOTEL SUNSHINE"))  # Its own original name is not a new one
+        self.assertTrue(index.claim(paris, "Sunrise Suites"))
+        self.assertFalse(index.claim(HotelRow(hotel_id=7, city_name="Paris"), "Sunrise Suites"))  # Claimed above
+
+        index = TitleIndex("all")
+        index.load(self.names, [])
+        self.assertFalse(index.claim(paris, "Park View"))
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_colliding_titles_are_regenerated_before_writing(self, mock_post, mock_connections):
+        for hotel_id, _, name in self.names[:2]:
+            Property.objects.create(original_id=hotel_id, original_title=name)
+        mock_cursor = self.mock_trip_cursor(mock_connections, batches=[self.rows[:2], self.names])
+
+        def generate(url, json=None, timeout=None):
+            prompt = json["prompt"]
+            if "branding" not in json["system"]:
+                text = "A bright hotel."
+            elif "Already used" in prompt:
+                text = "Moonrise Inn" if "Hotel Sunshine" in prompt else "Parkside Lodge"
+            else:
+                text = "Sunrise Suites" if "Hotel Sunshine" in prompt else "Park View"
+            return MagicMock(status_code=200, json=lambda: {"response": text})
+
+        mock_post.side_effect = generate
+        out = StringIO()
+        call_command("rewrite_property_info", "--unique-titles", "city", stdout=out)
+
+        self.assertEqual(dict(Property.objects.values_list("original_id", "rewritten_title")),
+                         {1: "Moonrise Inn", 2: "Parkside Lodge"})
+        self.assertIn("Title 'Sunrise Suites' for ID 1 is already used in New York.", out.getvalue())
+        self.assertIn("2 generated titles were already in use and were regenerated.", out.getvalue())
+        self.assertEqual(mock_cursor.execute.call_args.args[1], [["New York"]])
+
+
+class OutputValidationTest(TripHotelsTestCase):
+    def test_phrase_matcher_finds_whole_phrases_in_one_pass(self):
+        matcher = PhraseMatcher(["near the park", "the park", "note:", "As an AI"])
+        self.assertEqual(matcher.find("Close to near the pub, by THE PARK."), "the park")
+        self.assertEqual(matcher.find("Rooms near the park"), "near the park")
+        self.assertEqual(matcher.find("as an AI language model, I"), "as an ai")
+        self.assertIsNone(matcher.find("Keynote: a hotel by theparks"))
+        self.assertIsNone(PhraseMatcher([]).find("anything"))
+
+    def test_validator_applies_stage_limits(self):
+        validator = Validator(settings.VALIDATION_BANNED_PHRASES)
+        self.assertIsNone(validator.check(TitleStage(), "Café Lumière"))
+        self.assertEqual(validator.check(TitleStage(), "x" * 81), "longer than 80 characters")
+        self.assertEqual(validator.check(DescriptionStage(), "Bright rooms.\n\nQuestion: why?"),
+                         "more than 1 paragraphs")
+        self.assertEqual(validator.check(DescriptionStage(), "Nearby Location: Central Park"),
+                         "contains 'nearby location:'")
+        self.assertEqual(validator.check(TitleStage(), "阳光酒店"), "not in a Latin-script language")
+        self.assertEqual(validator.check(TitleStage(), "Sun\x00rise"), "contains control or undecodable characters")
+        self.assertEqual(validator.check(RatingReviewStage(), RatingReviewStage().parse("30-word review: fine")),
+                         "rating 30 is not between 1 and 5")
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_rejected_answers_are_retried_with_a_stricter_prompt(self, mock_post, mock_connections):
+        Property.objects.create(original_id=1, original_title="Hotel Sunshine")
+        mock_cursor = self.mock_trip_cursor(mock_connections, self.rows[:1])
+
+        def generate(url, json=None, timeout=None):
+            if "branding" not in json["system"]:
+                text = "A bright hotel."
+            elif "previous answer was rejected" in json["prompt"]:
+                text = "Sunrise Suites"
+            else:
+                text = "Original hotel: Hotel Sunshine, City: New York"
+            return MagicMock(status_code=200, json=lambda: {"response": text})
+
+        mock_post.side_effect = generate
+        out = StringIO()
+        call_command("rewrite_property_info", stdout=out)
+
+        self.assertEqual(Property.objects.get(original_id=1).rewritten_title, "Sunrise Suites")
+        self.assertIn("Rejected rewritten title for ID 1: contains 'original hotel:'.", out.getvalue())
+        self.assertIn("1 answers failed validation", out.getvalue())
+        self.assertIn("2 fields generated, 0 failed", out.getvalue())
+        self.assertEqual(mock_post.call_count, 3)
+
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_answers_rejected_after_the_retries_only_count_as_failed(self, mock_post, mock_connections):
+        Property.objects.create(original_id=1, original_title="Hotel Sunshine")
+        mock_cursor = self.mock_trip_cursor(mock_connections, self.rows[:1])
+
+        def generate(url, json=None, timeout=None):
+            text = "Original hotel: Hotel Sunshine" if "branding" in json["system"] else "A bright hotel."
+            return MagicMock(status_code=200, json=lambda: {"response": text})
+
+        mock_post.side_effect = generate
+        out = StringIO()
+        call_command("rewrite_property_info", stdout=out)
+
+        self.assertIn("2 answers failed validation", out.getvalue())
+        self.assertIn("1 fields generated, 1 failed", out.getvalue())
+
+    @override_settings(VALIDATION_RETRIES=1, TITLE_UNIQUENESS_RETRIES=2)
+    @patch("properties.management.base.connections")
+    @patch("properties.ollama.requests.post")
+    def test_each_kind_of_rejection_has_its_own_retries(self, mock_post, mock_connections):
+        Property.objects.create(original_id=1, original_title="Hotel Sunshine")
+        self.mock_trip_cursor(mock_connections, batches=[self.rows[:1], [(2, "New York", "Park View")]])
+        titles = iter(["Original hotel: Hotel Sunshine", "Park View", "Park View", "Sunrise Suites"])
+
+        def generate(url, json=None, timeout=None):
+            text = next(titles) if "branding" in json["system"] else "A bright hotel."
+            return MagicMock(status_code=200, json=lambda: {"response": text})
+
+        mock_post.side_effect = generate
+        out = StringIO()
+        call_command("rewrite_property_info", "--unique-titles", "city", stdout=out)
+
+        # One invalid answer and two collisions stay within their own limits
+        self.assertEqual(Property.objects.get(original_id=1).rewritten_title, "Sunrise Suites")
+        self.assertNotIn("No usable", out.getvalue())
+
+        Property.objects.filter(original_id=1).update(rewritten_title="Not rewritten")
+        titles = iter(["Park View"] * 3)
+        self.mock_trip_cursor(mock_connections, batches=[self.rows[:1], [(2, "New York", "Park View")]])
+        out = StringIO()
+        call_command("rewrite_property_info", "--unique-titles", "city", stdout=out)
+
+        self.assertIn("No usable rewritten title for ID 1 after 2 regenerations (3 rejected as taken).",
+                      out.getvalue())
+
+
+class SyncPropertiesTest(TestCase):
+    def test_new_hotels_are_inserted_and_renamed_ones_updated(self):
+        Property.objects.create(original_id=1, original_title="Old Name", rewritten_title="Sunrise Suites")
+
+        with patch("properties.management.commands.sync_properties.Command.iter_hotels",
+                   return_value=iter([(1, "Hotel Sunshine"), (2, "Park View")])):
+            out = StringIO()
+            call_command("sync_properties", stdout=out)
+
+        self.assertIn("1 inserted, 1 updated", out.getvalue())
+        new = Property.objects.get(original_id=2)
+        self.assertEqual((new.original_title, new.rewritten_title, new.provisional),
+                         ("Park View", "Not rewritten", False))
+        self.assertEqual(Property.objects.get(original_id=1).original_title, "Hotel Sunshine")
+
+    def test_names_overwritten_by_rewrite_hotels_keep_their_original(self):
+        Property.objects.create(original_id=1, original_title="Hotel Sunshine", rewritten_title="Sunrise Suites")
+        history = RewriteHistory()
+        hotel = HotelRow(hotel_id=1, hotelName="Hotel Sunshine")
+        history.restore_originals([hotel])
+        history.add_results(hotel, {"title": "Sunrise Suites"}, {"title": "mistral"}, [TitleStage()])
+        history.flush()
+
+        with patch("properties.management.commands.sync_properties.Command.iter_hotels",
+                   return_value=iter([(1, "Sunrise Suites"), (2, "Park View")])):
+            out = StringIO()
+            call_command("sync_properties", "--chunk-size", "1", stdout=out)
+
+        self.assertIn("Synced 2 hotels: 1 inserted, 0 updated", out.getvalue())
+        self.assertEqual(Property.objects.get(original_id=1).original_title, "Hotel Sunshine")
+        self.assertFalse(RewriteVersion.objects.filter(hotel_id=2).exists())  # Recorded by the pipeline instead
@@ -0,0 +1,102 @@
+import re
+import unicodedata
+
+from django.db import connections
+from properties.models import Property
+
+# Owner recorded for a title that several hotels already use
+SHARED = -1
+
+CITY_NAMES_SQL = (
+    'SELECT hotel_id, city_name, "hotelName" FROM hotels WHERE coalesce(city_name, \'\') = ANY(%s)'
+)
+ALL_NAMES_SQL = 'SELECT hotel_id, city_name, "hotelName" FROM hotels'
+
+
+def normalize_title(title):
+    """Compare titles ignoring case, accents, punctuation and spacing."""
+    text = unicodedata.normalize('NFKD', title or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return ' '.join(re.sub(r'[\W_]+', ' ', text).split())
+
+
+class TitleIndex:
+    """Normalized hotel names in use, per city (or across all hotels with scope 'all').
+
+    A plain dict per city rather than a Bloom filter: a false positive would
+    throw away a good title and cost another generation, and the names of the
+    cities in one run fit in memory. Each check is one hash lookup.
+    """
+
+    def __init__(self, scope='city', retries=2):
+        self.scope = scope
+        self.retries = retries  # Regenerations per hotel before its title counts as failed
+        self.titles = {}  # City key -> {normalized title: owning hotel id, or SHARED}
+
+    def key(self, city):
+        return (city or '') if self.scope == 'city' else ''
+
+    def add(self, city, title, hotel_id):
+        normalized = normalize_title(title)
+        if not normalized:
+            return
+        titles = self.titles.setdefault(self.key(city), {})
+        owner = titles.get(normalized)
+        titles[normalized] = hotel_id if owner in (None, hotel_id) else SHARED
+
+    def taken(self, hotel, title):
+        """Whether `title` is the hotel's own original name or belongs to another hotel."""
+        normalized = normalize_title(title)
+        if normalized == normalize_title(hotel.hotelName):
+            return True  # Not a new name
+        owner = self.titles.get(self.key(hotel.city_name), {}).get(normalized)
+        return owner is not None and owner != hotel.hotel_id
+
+    def claim(self, hotel, title):
+        """Reserve `title` for the hotel; False when it is taken."""
+        if self.taken(hotel, title):
+            return False
+        self.add(hotel.city_name, title, hotel.hotel_id)
+        return True
+
+    def load(self, names, rewritten):
+        """Index `names`, (hotel_id, city_name, hotelName) of the hotels to compare against,
+        and `rewritten`, (original_id, rewritten_title) of the stored rewrites; rewrites of
+        hotels outside `names` are ignored.
+        """
+        city_of = {}
+        for hotel_id, city, name in names:
+            city_of[hotel_id] = city
+            self.add(city, name, hotel_id)
+        for hotel_id, title in rewritten:
+            if hotel_id in city_of:
+                self.add(city_of[hotel_id], title, hotel_id)
+
+    def __len__(self):
+        return sum(len(titles) for titles in self.titles.values())
+
+
+def fetch_hotel_names(cursor, cities=None):
+    """(hotel_id, city_name, hotelName) of the hotels in `cities`, or of all hotels."""
+    if cities is None:
+        cursor.execute(ALL_NAMES_SQL)
+    else:
+        cursor.execute(CITY_NAMES_SQL, [[city or '' for city in cities]])
+    return cursor.fetchall()
+
+
+def stored_titles(hotel_ids=None):
+    """(original_id, rewritten_title) of every rewritten Property row, or of those of `hotel_ids`."""
+    queryset = Property.objects.exclude(rewritten_title__in=['', Property._meta.get_field('rewritten_title').default])
+    if hotel_ids is not None:
+        queryset = queryset.filter(original_id__in=list(hotel_ids))
+    return queryset.values_list('original_id', 'rewritten_title').iterator(chunk_size=10000)
+
+
+def load_title_index(hotel, scope, retries):
+    """TitleIndex for one hotel's city (all hotels with scope 'all'), for the on-demand rewrite."""
+    index = TitleIndex(scope, retries)
+    with connections['trip'].cursor() as cursor:
+        names = fetch_hotel_names(cursor, None if scope == 'all' else [hotel.city_name])
+    index.load(names, stored_titles(None if scope == 'all' else [hotel_id for hotel_id, _, _ in names]))
+    return index
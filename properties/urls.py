@@ -0,0 +1,9 @@
+from django.urls import path
+from properties import views
+
+urlpatterns = [
+    path('search/', views.search, name='property-search'),
+    path('nearby/', views.nearby, name='property-nearby'),
+    path('<int:hotel_id>/', views.card, name='property-card'),
+    path('<int:hotel_id>/rewrite/stream/', views.rewrite_stream, name='property-rewrite-stream'),
+]
@@ -0,0 +1,131 @@
+import unicodedata
+from collections import deque
+from typing import NamedTuple
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton over the banned phrases.
+
+    One pass over an answer finds any of them, however many there are.
+    Matching ignores case and only counts whole words at the phrase's edges.
+    """
+
+    def __init__(self, phrases):
+        self.goto = [{}]  # State -> {character: next state}; state 0 is the root
+        self.fail = [0]  # Longest proper suffix of a state that is also a state
+        self.out = [()]  # Phrases ending at a state, including through its fail links
+        for phrase in phrases:
+            phrase = phrase.casefold().strip()
+            if not phrase:
+                continue
+            state = 0
+            for char in phrase:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = self.goto[state][char]
+            self.out[state] += (phrase,)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, target in self.goto[state].items():
+                queue.append(target)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                suffix = self.goto[fallback].get(char, 0)
+                self.fail[target] = suffix if suffix != target else 0
+                self.out[target] += self.out[self.fail[target]]
+
+    def find(self, text):
+        """The first banned phrase in `text`, or None."""
+        text = text.casefold()
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for phrase in self.out[state]:
+                if whole_words(text, end - len(phrase), end):
+                    return phrase
+        return None
+
+
+def whole_words(text, start, end):
+    # A phrase edge that is a letter or digit must not continue a longer word ("note:" in "keynote:")
+    before = start > 0 and text[start].isalnum() and text[start - 1].isalnum()
+    after = end < len(text) and text[end - 1].isalnum() and text[end].isalnum()
+    return not (before or after)
+
+
+def charset_problem(text, min_latin):
+    """Why `text` is not plain text in a Latin-script language, or None."""
+    letters = latin = 0
+    for char in text:
+        if char == '\ufffd' or (unicodedata.category(char) in ('Cc', 'Co', 'Cs') and char not in '\r\n\t'):
+            return "contains control or undecodable characters"
+        if char.isalpha():
+            letters += 1
+            if char.isascii() or unicodedata.name(char, '').startswith('LATIN'):
+                latin += 1
+    if letters and latin / letters < min_latin:
+        return "not in a Latin-script language"
+    return None
+
+
+class Validator:
+    """Checks a parsed answer before it can be written; see Stage.max_length and friends."""
+
+    def __init__(self, banned_phrases, min_latin=0.8, retries=1):
+        self.banned = PhraseMatcher(banned_phrases)
+        self.min_latin = min_latin
+        self.retries = retries  # Stricter regenerations per hotel and stage before the answer counts as failed
+
+    def check(self, stage, value):
+        """Why `value` cannot be used, or None."""
+        reason = stage.check(value)
+        if reason:
+            return reason
+        for text in stage.texts(value):
+            if stage.max_length and len(text) > stage.max_length:
+                return f"longer than {stage.max_length} characters"
+            paragraphs = [part for part in text.split('\n\n') if part.strip()]
+            if stage.max_paragraphs and len(paragraphs) > stage.max_paragraphs:
+                return f"more than {stage.max_paragraphs} paragraphs"
+            phrase = self.banned.find(text)
+            if phrase:
+                return f"contains '{phrase}'"
+            reason = charset_problem(text, self.min_latin)
+            if reason:
+                return reason
+        return None
+
+
+class Rejection(NamedTuple):
+    kind: str  # 'invalid' (failed validation) or 'taken' (title already used)
+    message: str  # For the operator
+    note: str  # Added to the prompt of the regeneration
+    retries: int  # Regenerations allowed for this kind of rejection
+
+
+def check_answer(stage, hotel, value, validator=None, titles=None):
+    """Why a parsed answer cannot be written, as a Rejection, or None.
+
+    Shared by the pipeline and the streaming rewrite, so both write only
+    answers that passed the same checks.
+    """
+    if validator:
+        reason = validator.check(stage, value)
+        if reason:
+            return Rejection('invalid', f"Rejected {stage.label} for ID {hotel.hotel_id}: {reason}.",
+                             f"Your previous answer was rejected ({reason}). {stage.strict}", validator.retries)
+    # Claimed only once valid, so a rejected title does not block the hotel's next answer
+    if titles is not None and stage.name == 'title' and not titles.claim(hotel, value):
+        return Rejection('taken',
+                         f"Title '{value}' for ID {hotel.hotel_id} is already used in "
+                         f"{hotel.city_name or 'the dataset'}.",
+                         f"Already used by other hotels, do not reuse: {value}", titles.retries)
+    return None
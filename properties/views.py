@@ -1,3 +1,92 @@
-from django.shortcuts import render
+import json
 
-# Create your views here.
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from properties.geo import get_neighbourhoods
+from properties.models import HotelCard
+from properties.search import search_properties
+from properties.streaming import rewrite_events
+
+MAX_SEARCH_RESULTS = 100
+MAX_NEARBY_RADIUS_KM = 50  # Keeps grid scans of /nearby/ small
+
+
+@require_GET
+def search(request):
+    """Ranked full-text search over rewritten titles, descriptions and summaries."""
+    text = request.GET.get('q', '').strip()
+    if not text:
+        return JsonResponse({'error': "Missing 'q' parameter."}, status=400)
+    try:
+        limit = min(int(request.GET.get('limit', 20)), MAX_SEARCH_RESULTS)
+    except ValueError:
+        return JsonResponse({'error': "'limit' must be an integer."}, status=400)
+
+    results = [
+        {
+            'original_id': property_instance.original_id,
+            'original_title': property_instance.original_title,
+            'rewritten_title': property_instance.rewritten_title,
+            'description': property_instance.description,
+            'provisional': property_instance.provisional,
+            'summary': property_instance.summary,
+            'rank': round(property_instance.rank, 4),
+        }
+        for property_instance in search_properties(text, max(1, limit))
+    ]
+    return JsonResponse({'query': text, 'results': results})
+
+
+@require_GET
+def nearby(request):
+    """Hotels and landmarks near ?hotel_id= or ?lat=&lon=, within ?radius_km= (default 1, at most 50)."""
+    neighbourhoods = get_neighbourhoods()
+    try:
+        radius_km = min(float(request.GET.get('radius_km', 1)), MAX_NEARBY_RADIUS_KM)
+        limit = min(int(request.GET.get('limit', 20)), MAX_SEARCH_RESULTS)
+        hotel_id = int(request.GET['hotel_id']) if 'hotel_id' in request.GET else None
+        if hotel_id is not None:
+            location = neighbourhoods.hotels.location(hotel_id)
+            if location is None:
+                return JsonResponse({'error': f"No coordinates for hotel {hotel_id}."}, status=404)
+        else:
+            location = (float(request.GET['lat']), float(request.GET['lon']))
+    except KeyError:
+        return JsonResponse({'error': "Pass either 'hotel_id' or 'lat' and 'lon'."}, status=400)
+    except ValueError:
+        return JsonResponse({'error': "'hotel_id', 'lat', 'lon', 'radius_km' and 'limit' must be numbers."}, status=400)
+
+    hotels = neighbourhoods.hotels_near(*location, radius_km=radius_km, limit=max(1, limit), exclude=hotel_id)
+    landmarks = neighbourhoods.landmarks_near(*location, radius_km=radius_km, limit=max(1, limit))
+    return JsonResponse({
+        'hotels': [{'hotel_id': key, 'name': name, 'distance_km': round(distance, 3)} for key, name, distance in hotels],
+        'landmarks': [{'name': name, 'distance_km': round(distance, 3)} for _, name, distance in landmarks],
+    })
+
+
+@require_GET
+def card(request, hotel_id):
+    """Everything generated for one hotel, read from its HotelCard row."""
+    hotel_card = HotelCard.objects.filter(hotel_id=hotel_id).values(
+        'hotel_id', 'original_title', 'title', 'description', 'summary', 'rating', 'review', 'provisional', 'updated_at',
+    ).first()
+    if hotel_card is None:
+        return JsonResponse({'error': f"Hotel {hotel_id} not found."}, status=404)
+    return JsonResponse(hotel_card)
+
+
+async def rewrite_stream(request, hotel_id):
+    """Rewrite one hotel's title and description, streaming tokens as Server-Sent Events."""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    async def events():
+        async for event in rewrite_events(hotel_id):
+            # Events are shared by every client of the rewrite, so copy rather than pop
+            data = {key: value for key, value in event.items() if key != 'event'}
+            yield f"event: {event['event']}\ndata: {json.dumps(data)}\n\n"
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep proxies from holding tokens back
+    return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,6 +32,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',  # Makes runserver serve ASGI, which the streaming rewrite view needs
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -69,6 +71,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'property_rewrite.wsgi.application'
+ASGI_APPLICATION = 'property_rewrite.asgi.application'
 
 
 # Database
@@ -83,6 +86,9 @@ DATABASES = {
         'PASSWORD': 'password',  # Your password set in docker-compose for ollama-db
         'HOST': 'ollama-db',  # The name of the container running PostgreSQL
         'PORT': '5432',
+        # Keep connections open across requests/batches; checked before reuse
+        'CONN_MAX_AGE': int(os.environ.get('DEFAULT_DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     },
     'trip': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -91,9 +97,14 @@ DATABASES = {
         'PASSWORD': 'scraper_password',
         'HOST': 'postgres_db',
         'PORT': '5432',
+        'CONN_MAX_AGE': int(os.environ.get('TRIP_DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Hotel (the scraper's table) lives on 'trip'; everything else on 'default'
+DATABASE_ROUTERS = ['properties.routers.TripRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -134,3 +145,85 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Ollama
+# Concurrency assumed by run estimates (--dry-run / --sample), and the throughput
+# --dry-run assumes until a --sample run has measured the real numbers.
+
+OLLAMA_CONCURRENCY = 1
+OLLAMA_PROMPT_TOKENS_PER_SECOND = 250
+OLLAMA_EVAL_TOKENS_PER_SECOND = 25
+
+# Model per stage. Short outputs go to a small model; richer ones use 'model' and
+# switch to 'fast' while the queue latency is above OLLAMA_FALLBACK_QUEUE_SECONDS.
+# Stages without an entry use OLLAMA_DEFAULT_MODEL.
+OLLAMA_DEFAULT_MODEL = 'phi'
+OLLAMA_STAGE_MODELS = {
+    'title': {'model': 'tinyllama'},
+    'description': {'model': 'phi', 'fast': 'tinyllama'},
+    'summary': {'model': 'phi', 'fast': 'tinyllama'},
+    'rating_review': {'model': 'phi', 'fast': 'tinyllama'},
+}
+OLLAMA_FALLBACK_QUEUE_SECONDS = 10
+
+# --dedupe: embeddings come from this Ollama model (pull it first); leave empty to use
+# the built-in character-trigram embedder. Listings at or above DUPLICATE_SIMILARITY
+# (cosine) are treated as the same hotel.
+OLLAMA_EMBEDDING_MODEL = 'nomic-embed-text'
+DUPLICATE_SIMILARITY = 0.92
+
+# --geo-context and /api/properties/nearby/: landmarks within GEO_LANDMARK_RADIUS_KM and
+# the number of hotels within GEO_HOTEL_RADIUS_KM; the API rebuilds its in-memory index
+# from the hotels table every GEO_INDEX_TTL_SECONDS.
+GEO_LANDMARK_RADIUS_KM = 2
+GEO_HOTEL_RADIUS_KM = 1
+GEO_INDEX_TTL_SECONDS = 600
+
+# /api/properties/<hotel_id>/rewrite/stream/ answers repeated requests for an unchanged
+# listing from the cache for this long.
+REWRITE_CACHE_SECONDS = 3600
+
+# --profile: artifacts (.txt summary, .prof for pstats/snakeviz, .folded stack samples)
+# go to PROFILE_DIR; --profile sample takes a stack sample every PROFILE_SAMPLE_INTERVAL s.
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_SAMPLE_INTERVAL = 0.01
+
+# Default --priority rules for the pipeline commands, most significant first, e.g.
+# ['city=Paris,London', 'price=150-', 'recent']. Empty keeps the table's order.
+HOTEL_PRIORITY_RULES = []
+
+# Default of --fallback: titles and descriptions that cannot be generated are written
+# as deterministic template text flagged Property.provisional, and regenerated later
+# (rewrite_property_info --provisional, or watch_hotels once Ollama answers again).
+TEMPLATE_FALLBACK = True
+
+# snapshot_hotels writes here by default; the pipeline commands read it with --snapshot
+HOTEL_SNAPSHOT_PATH = BASE_DIR / 'snapshots' / 'hotels.snap'
+
+# Default of --cancel-grace: after SIGTERM/SIGINT or --deadline, seconds to wait for the
+# Ollama calls already sent before the finished results are written and the run stops.
+# Kept below the 10 s docker stop gives a container before killing it.
+CANCEL_GRACE_SECONDS = 8
+
+# Default of --unique-titles: reject generated titles another hotel already uses in the
+# same city ('city') or anywhere ('all'), and regenerate them up to
+# TITLE_UNIQUENESS_RETRIES times before the title counts as failed. 'off' skips the check.
+UNIQUE_TITLES = 'off'
+TITLE_UNIQUENESS_RETRIES = 2
+
+# Default of --validate: parsed answers are checked before they are written (stage length
+# and paragraph limits, the banned phrases below, Latin-script text without control
+# characters, ratings from 1 to 5). A rejected answer is regenerated with a stricter prompt
+# up to VALIDATION_RETRIES times, then counts as failed. Phrases match whole words, any case.
+VALIDATE_OUTPUT = True
+VALIDATION_RETRIES = 1
+VALIDATION_MIN_LATIN = 0.8  # Share of letters that must be Latin script
+VALIDATION_BANNED_PHRASES = [
+    # Explanations and chatter around the answer
+    'puzzle', 'as an ai', 'language model', 'i cannot', "i can't", 'sure, here', 'here is the', "here's the",
+    'explanation:', 'note:', 'question:', 'answer:',
+    # The prompt echoed back
+    'original hotel:', 'nearby location:', 'city:', 'change this hotel name', 'write a concise',
+    'generate a rating', 'do not include', 'extra content', '20-word', '30-word',
+]